@@ -1,15 +1,22 @@
 import sys
+import os
 from PyQt6.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget
 from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
 
 from ExcelStyleTableView import ExcelStyleTableView  # Import your view
 
-class MergeTableModel(QAbstractTableModel):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Main_File"))
+from column_store import ColumnStore
+from model_batch import BatchedChangesMixin
+
+class MergeTableModel(BatchedChangesMixin, QAbstractTableModel):
     def __init__(self, rows=10, columns=5):
         super().__init__()
         self.rows = rows
         self.columns = columns
-        self.data_matrix = [['Cell {}-{}'.format(r, c) for c in range(columns)] for r in range(rows)]
+        data_matrix = [['Cell {}-{}'.format(r, c) for c in range(columns)] for r in range(rows)]
+        # Numeric columns are kept as typed NumPy arrays, text columns as object arrays
+        self.store = ColumnStore.from_rows(data_matrix, columns)
         self.merged_cells = []  # List of tuples: (top_row, left_col, row_span, col_span)
 
     def rowCount(self, parent=QModelIndex()):
@@ -21,20 +28,23 @@ class MergeTableModel(QAbstractTableModel):
     def data(self, index, role=Qt.ItemDataRole.DisplayRole):
         if not index.isValid():
             return None
-        if role == Qt.ItemDataRole.DisplayRole:
-            return self.data_matrix[index.row()][index.column()]
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return self.store.text(index.row(), index.column())
         return None
 
     def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
         if role == Qt.ItemDataRole.EditRole:
-            self.data_matrix[index.row()][index.column()] = value
-            self.dataChanged.emit(index, index)
+            self.store.set(index.row(), index.column(), value)
+            self.changed(index.row(), index.column(), index.row(), index.column())
             return True
         return False
 
     def flags(self, index):
         return Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsEditable
 
+    def is_numeric_range(self, top, left, bottom, right):
+        return self.store.is_numeric_range(top, left, bottom, right)
+
     def merge_cells(self, top_row, left_col, row_span, col_span):
         self.merged_cells.append((top_row, left_col, row_span, col_span))
         self.layoutChanged.emit()
@@ -75,16 +85,17 @@ class MainWindow(QMainWindow):
         row_span = bottom_row - top_row + 1
         col_span = right_col - left_col + 1
 
-        # Keep text only in top-left cell
+        # Keep text only in top-left cell, the view gets one dataChanged for the block
         top_left_index = self.model.index(top_row, left_col)
         top_left_value = self.model.data(top_left_index)
-        for r in range(top_row, top_row + row_span):
-            for c in range(left_col, left_col + col_span):
-                if r == top_row and c == left_col:
-                    continue
-                self.model.setData(self.model.index(r, c), '')
-
-        self.model.setData(top_left_index, top_left_value)
+        with self.model.batch():
+            for r in range(top_row, top_row + row_span):
+                for c in range(left_col, left_col + col_span):
+                    if r == top_row and c == left_col:
+                        continue
+                    self.model.setData(self.model.index(r, c), '')
+
+            self.model.setData(top_left_index, top_left_value)
         self.model.merge_cells(top_row, left_col, row_span, col_span)
 
 if __name__ == "__main__":
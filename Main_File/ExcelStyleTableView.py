@@ -5,11 +5,20 @@ from PyQt6.QtWidgets import (
     QAbstractItemView, QHeaderView, QTableWidgetItem, QStyledItemDelegate, QStyleOptionViewItem, QTableView
 )
 from PyQt6.QtCore import Qt, QPropertyAnimation, pyqtProperty, QEasingCurve, QRect, QTimer, QModelIndex
-from PyQt6.QtGui import QPainter, QColor, QPen, QBrush, QStandardItemModel, QStandardItem, QWheelEvent, QCursor, QTextOption
+from PyQt6.QtGui import QPainter, QColor, QPen, QBrush, QWheelEvent, QCursor, QTextOption, QRegion
 from PyQt6.QtWidgets import  QStyle,QStyledItemDelegate, QApplication, QTableWidgetItem, QTableWidget, QMenu, QTextEdit
 
-import re
+from contextlib import nullcontext
 
+from SparseTableModel import SparseTableModel, MAX_ROWS, MAX_COLUMNS
+from KineticScroller import KineticScroller
+from formula_engine import is_formula, shift_formula
+
+# Lazy recalculation: pages evaluated ahead of the viewport in the scroll direction
+PREFETCH_PAGES = 1
+
+# Milliseconds between steps of the autofill preview's marching dashes (lower = faster)
+DASH_INTERVAL_MS = 100
 
 
 class ExcelStyleTableView(QTableView):
@@ -45,13 +54,11 @@ class ExcelStyleTableView(QTableView):
         self.setVerticalScrollMode(QTableWidget.ScrollMode.ScrollPerPixel)
         self.setHorizontalScrollMode(QTableWidget.ScrollMode.ScrollPerPixel)
 
-        # Animated scroll state
-        self._velocity = 0.0
-        self._velocity_history = []
-        self._last_wheel_time = 0
-        self._animation_timer = QTimer(self)
-        self._animation_timer.timeout.connect(self._update_scroll)
-        self._animation_timer.start(16)  # ~60 FPS
+        self.my_model = None  # Set by setModelWithHeaders
+
+        # Animated scroll: its timer only runs while the sheet is moving
+        self.scroller = KineticScroller(self)
+        self.scroller.reached_bottom.connect(self._scrolled_to_bottom)
 
         # Middle mouse auto-scroll
         self.middle_mouse_pressed = False
@@ -68,13 +75,15 @@ class ExcelStyleTableView(QTableView):
         self.selected_values = []  # Store selected cells for autofill
         self.handle_size = 6
 
-        self.keep_preview_rect = None            # For visual rectangle after release
-        self.keep_preview_indexes = []           # For tracking pasted cells
+        # Dashed outline of the last autofill: the filled cells as one logical
+        # rectangle, mapped to the viewport (and clipped to it) once per scroll
+        self.keep_preview_range = None           # (top, left, bottom, right) of the filled cells
+        self.keep_preview_rect = None            # its viewport rectangle, None until mapped
+        self.drag_rect = None                    # outline of an autofill drag, as last painted
 
         self.dash_offset = 0.0
         self.dash_timer = QTimer(self)
-        self.dash_timer.timeout.connect(self.update_dash_animation)
-        self.dash_timer.start(100)  # Lower = faster animation
+        self.dash_timer.timeout.connect(self.update_dash_animation)  # started while a preview is on screen
 
         # Autofill state
         self.autofill_dragging = False
@@ -84,8 +93,15 @@ class ExcelStyleTableView(QTableView):
         self.selected_values = []  # Store selected cells for autofill
         self.handle_size = 6
 
+        # Selection outline: the bounds of the selection ranges are worked out
+        # when the selection changes, their viewport rectangle when the view
+        # scrolls or resizes, so a paint only draws them
+        self._selection_bounds = None   # (top, left, bottom, right), None without a selection
+        self._selection_rect = None     # the bounds in viewport coordinates, None until mapped
+
         # Track the last number used in Fill Series
         self.last_series_number = 2  # Initialize to 2 so first Fill Series starts at 3
+
         
         self.setWordWrap(True)
         self.setItemDelegate(WrapTextDelegate())
@@ -138,86 +154,62 @@ class ExcelStyleTableView(QTableView):
         return Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsEditable
 
     def update_dash_animation(self):
+        rect = self._preview_geometry()
+        if rect is None or rect.isEmpty():
+            self.dash_timer.stop()
+            return
         self.dash_offset += 1.0
         if self.dash_offset >= 100.0:  # Prevent overflow
             self.dash_offset = 0.0
-        self.viewport().update()
+        # Only the dashed border moves, repaint just that
+        self.viewport().update(self._outline_region(rect, 2))
+
+    def _sync_dash_timer(self):
+        # The dashes only march while the preview outline is on screen
+        rect = self._preview_geometry()
+        if rect is None or rect.isEmpty():
+            self.dash_timer.stop()
+        elif not self.dash_timer.isActive():
+            self.dash_timer.start(DASH_INTERVAL_MS)
+
+    def _outline_region(self, rect, width):
+        """The strips `width` pixels to each side of the edges of rect, as a QRegion."""
+        if rect is None or rect.isEmpty():
+            return QRegion()
+        region = QRegion(rect.adjusted(-width, -width, width, width))
+        inner = rect.adjusted(width, width, -width, -width)
+        if inner.isValid():
+            region = region.subtracted(QRegion(inner))
+        return region
 
     def wheelEvent(self, event: QWheelEvent):
-        now = event.timestamp()
-        delta = event.angleDelta().y()
-
-        self._velocity_history.append((now, delta))
-        self._velocity_history = [(t, d) for t, d in self._velocity_history if now - t <= 100]
-
-        # Weighted average of recent scroll deltas
-        weighted_sum = 0
-        weight_total = 0
-        for t, d in self._velocity_history:
-            weight = 1.0 - (now - t) / 100.0
-            weight = max(0, weight)
-            weighted_sum += d * weight
-            weight_total += weight
-
-        avg_delta = weighted_sum / weight_total if weight_total else 0
-
-        # Convert delta to velocity (tuned scale)
-        new_velocity = avg_delta * 0.1
-
-        # Blend with previous velocity (natural kick)
-        self._velocity = self._velocity * 0.2 + new_velocity * 0.8
-
+        self.scroller.wheel(event)
         event.accept()
 
-    def _update_scroll(self):
-        scroll_bar = self.verticalScrollBar()
-        if abs(self._velocity) < 0.2:
-            self._velocity = 0.0
-            return
-
-        # Apply movement
-        new_pos = scroll_bar.value() - self._velocity
-
-        # Clamp within bounds and bounce lightly
-        if new_pos < scroll_bar.minimum():
-            new_pos = scroll_bar.minimum()
-            self._velocity = 0.0  # Stop completely at top
-        elif new_pos > scroll_bar.maximum():
-            new_pos = scroll_bar.maximum()
-            self._velocity = 0.0  # Stop completely at bottom
-
-            # Check if we are at the last row
-            if self.my_model is not None:
-                self.add_row_if_needed()
-
-        scroll_bar.setValue(int(new_pos))
-
-        # Apply tuned friction: smoother, but not slippery
-        self._velocity *= 0.88  # The key value for "not too icy"
+    def _scrolled_to_bottom(self):
+        # Check if we are at the last row
+        if self.my_model is not None:
+            self.add_row_if_needed()
 
     def add_row_if_needed(self):
         row_count = self.my_model.rowCount()
-
-        # ✅ Prevent adding more than 1000 rows
-        if row_count >= 1000:
+        if row_count >= MAX_ROWS:  # Virtual models already report the full sheet
             return
-
-        self.my_model.insertRow(row_count)
-        self.my_model.setVerticalHeaderItem(row_count, QStandardItem(str(row_count + 1)))
-
-        # Initialize each new cell in the new row (optional)
-        for col in range(self.my_model.columnCount()):
-            self.my_model.setItem(row_count, col, QStandardItem(""))
-
-
-    def add_row_if_needed(self):
-        row_count = self.my_model.rowCount()
-        if row_count >= 1000:  # Limit to 1000 rows
-            return
-        self.my_model.insertRow(row_count)
-        self.my_model.setVerticalHeaderItem(row_count, QStandardItem(str(row_count + 1)))
+        # Grows by a whole block in one transaction, headers and cells come from the model on demand
+        self.my_model.grow(rows=1)
 
     def keyPressEvent(self, event):
+        model = self.model()
+        if hasattr(model, "undo") and event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            redo = event.key() == Qt.Key.Key_Y or (
+                event.key() == Qt.Key.Key_Z and event.modifiers() & Qt.KeyboardModifier.ShiftModifier)
+            if redo:
+                model.redo()
+                return
+            if event.key() == Qt.Key.Key_Z:
+                model.undo()
+                return
+
         if event.key() == Qt.Key.Key_Right:
             current_index = self.currentIndex()
             if current_index.isValid():
@@ -241,78 +233,20 @@ class ExcelStyleTableView(QTableView):
 
     def add_column_if_needed(self):
         col_count = self.my_model.columnCount()
-        # ✅ Prevent adding more than 1000 columns
-        if col_count >= 1000:
-            QMessageBox.warning(self, "Limit Reached", "Maximum number of columns (1000) reached.")
+        if col_count >= MAX_COLUMNS:
+            QMessageBox.warning(self, "Limit Reached", f"Maximum number of columns ({MAX_COLUMNS}) reached.")
             return
-        self.my_model.insertColumn(col_count)
-
-        # Generate column label (A, B, ..., Z, AA, etc.)
-        col_label = ""
-        index = col_count
-        while index >= 0:
-            col_label = chr(index % 26 + ord('A')) + col_label
-            index = index // 26 - 1
-            if index < 0:
-                break
-
-        self.my_model.setHorizontalHeaderItem(col_count, QStandardItem(col_label))
-
-        # Optionally initialize cells
-        for row in range(self.my_model.rowCount()):
-            self.my_model.setItem(row, col_count, QStandardItem(""))
-
-
-    def setModelWithHeaders(self, rows, cols):
-        self.my_model = QStandardItemModel(rows, cols)
-
-        # Set column headers A, B, C...
-        headers = []
-        for i in range(cols):
-            result = ""
-            col = i
-            while True:
-                result = chr(col % 26 + ord('A')) + result
-                col = col // 26 - 1
-                if col < 0:
-                    break
-            headers.append(result)
-        self.my_model.setHorizontalHeaderLabels(headers)
-
-        # Set row headers 1, 2, ...
-        for row in range(rows):
-            self.my_model.setVerticalHeaderItem(row, QStandardItem(str(row + 1)))
+        # Column label (A, B, ..., Z, AA, etc.) comes from the model's headerData
+        self.my_model.grow(cols=1)
 
-        self.setModel(self.my_model)
 
-        # Connect formula handler
-        self.my_model.dataChanged.connect(self.handle_formula)
-
-    def handle_formula(self, topLeft, bottomRight, roles):
-        for row in range(topLeft.row(), bottomRight.row() + 1):
-            for col in range(topLeft.column(), bottomRight.column() + 1):
-                item = self.my_model.item(row, col)
-                if not item:
-                    continue
-                text = item.text().strip()
-                if text.upper().startswith("=SUM("):
-                    inside = text[5:]
-                    if inside.endswith(")"):
-                        inside = inside[:-1]
-
-                    cells = [ref.strip() for ref in inside.split(',')]
-                    total = 0
-                    for cell_ref in cells:
-                        match = re.match(r"([A-Z]+)(\d+)", cell_ref)
-                        if match:
-                            col_letters, row_str = match.groups()
-                            col_index = self.column_letters_to_index(col_letters)
-                            row_index = int(row_str) - 1
-                            target_item = self.my_model.item(row_index, col_index)
-                            if target_item and target_item.text().isdigit():
-                                total += int(target_item.text())
-
-                    item.setText(str(total))
+    def setModelWithHeaders(self, rows, cols, virtual=False):
+        # Sparse model: headers are generated on demand and empty cells take no memory.
+        # With virtual=True the model reports a full Excel-sized sheet and rows/cols are ignored.
+        self.my_model = SparseTableModel(rows, cols, virtual=virtual)
+
+        # The model recalculates its formulas itself when cell contents change
+        self.setModel(self.my_model)
 
 
 
@@ -324,19 +258,176 @@ class ExcelStyleTableView(QTableView):
     
     def setModel(self, model):
         super().setModel(model)
+        # Header highlighting asks the model about every section of a selected
+        # whole row/column: a million calls on a virtual sheet
+        highlight = not getattr(model, "virtual", False)
+        self.horizontalHeader().setHighlightSections(highlight)
+        self.verticalHeader().setHighlightSections(highlight)
         self.model().layoutChanged.connect(self.apply_merges)
+        # A reset drops the selection without a selectionChanged
+        self.model().modelReset.connect(self._update_selection_bounds)
         self.apply_merges()
+        self._update_selection_bounds()
+        self.report_viewport()
+
+    def selectionChanged(self, selected, deselected):
+        super().selectionChanged(selected, deselected)
+        old_rect = self._selection_geometry()
+        self._update_selection_bounds()
+        self._repaint_selection_outline(old_rect)
+
+    def _update_selection_bounds(self):
+        # From the selection ranges, not selectedIndexes(): a whole column of
+        # a virtual sheet is one range but a million indexes
+        selection_model = self.selectionModel()
+        selection = selection_model.selection() if selection_model is not None else None
+        if not selection:
+            self._selection_bounds = None
+        else:
+            self._selection_bounds = (min(sel_range.top() for sel_range in selection),
+                                      min(sel_range.left() for sel_range in selection),
+                                      max(sel_range.bottom() for sel_range in selection),
+                                      max(sel_range.right() for sel_range in selection))
+        self._selection_rect = None
+
+    def _selection_geometry(self):
+        """The selection outline in viewport coordinates (None without a selection)."""
+        if self._selection_bounds is None:
+            return None
+        if self._selection_rect is None:
+            top, left, bottom, right = self._selection_bounds
+            model = self.model()
+            top_left = self.visualRect(model.index(top, left))
+            bottom_right = self.visualRect(model.index(bottom, right))
+            self._selection_rect = top_left.united(bottom_right).adjusted(0, 0, -1, -1)
+        return self._selection_rect
+
+    def _preview_geometry(self):
+        """The autofill preview outline in viewport coordinates, None without one."""
+        if self.keep_preview_range is None:
+            return None
+        if self.keep_preview_rect is None:
+            top, left, bottom, right = self.keep_preview_range
+            model = self.model()
+            top_left = self.visualRect(model.index(top, left))
+            bottom_right = self.visualRect(model.index(bottom, right))
+            self.keep_preview_rect = self._clip_to_viewport(top_left.united(bottom_right).adjusted(0, 0, -1, -1))
+        return self.keep_preview_rect
+
+    def _clip_to_viewport(self, rect):
+        # With a margin so edges outside the viewport stay outside: a filled
+        # column can be millions of pixels tall
+        return rect.intersected(self.viewport().rect().adjusted(-2, -2, 2, 2))
+
+    def _drag_geometry(self):
+        """Viewport rectangle of the cells an autofill drag would fill, None if none."""
+        if not (self.autofill_dragging and self.autofill_start_index and self.autofill_end_index):
+            return None
+        if self._selection_bounds is None:
+            return None
+        sel_top, sel_left, sel_bottom, sel_right = self._selection_bounds
+        end_row = self.autofill_end_index.row()
+        end_col = self.autofill_end_index.column()
+
+        if self.autofill_direction == 'vertical':
+            if end_row > sel_bottom:
+                drag_top = sel_bottom + 1
+                drag_bottom = end_row
+            elif end_row < sel_top:
+                drag_top = end_row
+                drag_bottom = sel_top - 1
+            else:
+                return None  # No visual if drag within selected rows
+
+            drag_left = sel_left
+            drag_right = sel_right
+
+        elif self.autofill_direction == 'horizontal':
+            if end_col > sel_right:
+                drag_left = sel_right + 1
+                drag_right = end_col
+            elif end_col < sel_left:
+                drag_left = end_col
+                drag_right = sel_left - 1
+            else:
+                return None  # No visual if drag within selected columns
+
+            drag_top = sel_top
+            drag_bottom = sel_bottom
+        else:
+            return None
+
+        model = self.model()
+        drag_top_left = self.visualRect(model.index(drag_top, drag_left))
+        drag_bottom_right = self.visualRect(model.index(drag_bottom, drag_right))
+        return self._clip_to_viewport(drag_top_left.united(drag_bottom_right).adjusted(0, 0, -1, -1))
+
+    def _forget_geometry(self):
+        # Cells moved on screen (scroll, resize, column widths, spans): map the outlines again
+        self._selection_rect = None
+        self.keep_preview_rect = None
+
+    def updateGeometries(self):
+        super().updateGeometries()
+        self._forget_geometry()
+
+    def scrollContentsBy(self, dx, dy):
+        self._forget_geometry()
+        super().scrollContentsBy(dx, dy)
+        self._sync_dash_timer()
+        self.report_viewport(dx, dy)
+
+    def resizeEvent(self, event):
+        self._forget_geometry()
+        super().resizeEvent(event)
+        self._sync_dash_timer()
+        self.report_viewport()
+
+    def report_viewport(self, dx=0, dy=0):
+        # Tell the model which cells are on screen, plus a page ahead in the
+        # direction we scroll, so its stale formulas there are computed first
+        model = self.model()
+        if not hasattr(model, "set_viewport"):
+            return
+        area = self.viewport().rect()
+        top, left = self.rowAt(0), self.columnAt(0)
+        if top < 0 or left < 0:
+            return
+        bottom, right = self.rowAt(area.height() - 1), self.columnAt(area.width() - 1)
+        if bottom < 0:
+            bottom = model.rowCount() - 1
+        if right < 0:
+            right = model.columnCount() - 1
+        rows = (bottom - top + 1) * PREFETCH_PAGES
+        columns = (right - left + 1) * PREFETCH_PAGES
+        if dy < 0:      # contents moved up: scrolling down
+            bottom += rows
+        elif dy > 0:
+            top -= rows
+        if dx < 0:
+            right += columns
+        elif dx > 0:
+            left -= columns
+        model.set_viewport(max(top, 0), max(left, 0),
+                           min(bottom, model.rowCount() - 1), min(right, model.columnCount() - 1))
 
     def apply_merges(self):
         self.clearSpans()
-        for top_row, left_col, row_span, col_span in self.model().merged_cells:
+        for top_row, left_col, row_span, col_span in getattr(self.model(), "merged_cells", []):
             if row_span == 1 and col_span == 1:
                 continue  # Skip single-cell spans
             self.setSpan(top_row, left_col, row_span, col_span)
+        self._forget_geometry()
 
 
-    def _refresh_selection(self, selected, deselected):
-        self.viewport().update()
+    def _repaint_selection_outline(self, old_rect):
+        # Only the outlines moved: the border and fill handle of the old and
+        # the new selection (the cells themselves are updated by Qt)
+        margin = self.handle_size
+        region = self._outline_region(old_rect, margin).united(
+            self._outline_region(self._selection_geometry(), margin))
+        if not region.isEmpty():
+            self.viewport().update(region)
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.MiddleButton:
@@ -356,8 +447,11 @@ class ExcelStyleTableView(QTableView):
         index = self.indexAt(event.pos())
         if index.isValid():
             # Clicking anywhere clears previous visual
-            self.keep_preview_indexes.clear()
-            self.viewport().update()
+            if self.keep_preview_range is not None:
+                self.viewport().update(self._outline_region(self._preview_geometry(), 2))
+                self.keep_preview_range = None
+                self.keep_preview_rect = None
+                self.dash_timer.stop()
 
         super().mousePressEvent(event)
 
@@ -400,7 +494,11 @@ class ExcelStyleTableView(QTableView):
             elif self.autofill_direction == 'horizontal':
                 self.autofill_end_index = self.model().index(self.autofill_start_index.row(), index.column())
 
-            self.viewport().update()
+            # Repaint the old and the new drag outline, not the whole viewport
+            region = self._outline_region(self.drag_rect, 2).united(
+                self._outline_region(self._drag_geometry(), 2))
+            if not region.isEmpty():
+                self.viewport().update(region)
             return
 
         super().mouseMoveEvent(event)
@@ -415,7 +513,8 @@ class ExcelStyleTableView(QTableView):
         elif self.autofill_dragging:
             self.autofill_dragging = False
 
-            if not self.autofill_end_index or not self.autofill_start_index:
+            # Nothing to fill (or the selection went away): leave fill mode
+            if not self.autofill_end_index or not self.autofill_start_index or self._selection_bounds is None:
                 self.autofill_start_index = None
                 self.autofill_end_index = None
                 self.autofill_direction = None
@@ -424,41 +523,35 @@ class ExcelStyleTableView(QTableView):
                 return
 
             model = self.model()
-            selection = self.selectionModel().selectedIndexes()
-            if not selection:
-                return
-
-            # Normalize selection into a grid
-            selection.sort(key=lambda index: (index.row(), index.column()))
-            sel_top = min(index.row() for index in selection)
-            sel_left = min(index.column() for index in selection)
-            sel_bottom = max(index.row() for index in selection)
-            sel_right = max(index.column() for index in selection)
+            # The selection as a grid, from the cached bounds of its ranges
+            sel_top, sel_left, sel_bottom, sel_right = self._selection_bounds
 
             sel_rows = sel_bottom - sel_top + 1
             sel_cols = sel_right - sel_left + 1
 
-            # Get selected values BEFORE writing
-            selected_values = [
-                [model.data(model.index(sel_top + r, sel_left + c)) for c in range(sel_cols)]
-                for r in range(sel_rows)
-            ]
+            # Source block values are read as the fill needs them, not copied up
+            # front (a whole column is a million cells). The fill never overlaps
+            # the selection, so they are still the values from before writing.
+            def selected_value(row_offset, col_offset):
+                return model.data(model.index(sel_top + row_offset, sel_left + col_offset), Qt.ItemDataRole.EditRole)
 
             # Check if selected values are all numeric
-            is_numeric = all(
-                all(
+            if hasattr(model, "is_numeric_range"):
+                # Typed column store answers this without re-parsing every string
+                is_numeric = model.is_numeric_range(sel_top, sel_left, sel_bottom, sel_right)
+            else:
+                # Stops at the first cell that isn't a number
+                is_numeric = all(
                     value and value.strip() and value.strip().lstrip('-').replace('.', '', 1).isdigit()
-                    for value in row
+                    for value in (selected_value(r, c) for r in range(sel_rows) for c in range(sel_cols))
                 )
-                for row in selected_values
-            )
 
             # Determine base number for series mode
             try:
                 if self.autofill_direction == 'vertical':
-                    last_value_str = selected_values[-1][0]
+                    last_value_str = selected_value(sel_rows - 1, 0)
                 else:
-                    last_value_str = selected_values[0][-1]
+                    last_value_str = selected_value(0, sel_cols - 1)
 
                 self.last_series_number = int(last_value_str)
             except (ValueError, IndexError, TypeError):
@@ -497,18 +590,23 @@ class ExcelStyleTableView(QTableView):
                 fill_range = list(range(fill_start_row, fill_end_row + step, step))
                 num_steps = len(fill_range)
 
-                for row_index, r in enumerate(fill_range):
-                    for col_offset in range(sel_cols):
-                        value_index = (row_index % sel_rows)
-                        base_value = selected_values[value_index][col_offset] or ""
+                # The whole fill is one undo step and one dataChanged
+                with self._batch(model), self._undo_range(model, "Autofill", fill_range, sel_left, sel_right, vertical=True):
+                    for row_index, r in enumerate(fill_range):
+                        for col_offset in range(sel_cols):
+                            value_index = (row_index % sel_rows)
+                            base_value = selected_value(value_index, col_offset) or ""
 
-                        if fill_mode == "series" and self.last_series_number is not None:
-                            series_value = self.last_series_number + (row_index + 1) * step
-                            new_value = str(series_value)
-                        else:
-                            new_value = base_value
+                            if fill_mode == "series" and self.last_series_number is not None:
+                                series_value = self.last_series_number + (row_index + 1) * step
+                                new_value = str(series_value)
+                            elif is_formula(base_value):
+                                # Relative references follow the fill, like Excel
+                                new_value = shift_formula(base_value, r - (sel_top + value_index), 0)
+                            else:
+                                new_value = base_value
 
-                        model.setData(model.index(r, sel_left + col_offset), new_value)
+                            model.setData(model.index(r, sel_left + col_offset), new_value)
 
 
             elif self.autofill_direction == 'horizontal':
@@ -518,28 +616,25 @@ class ExcelStyleTableView(QTableView):
                 fill_range = list(range(fill_start_col, fill_end_col + step, step))
                 num_steps = len(fill_range)
 
-                for col_index, c in enumerate(fill_range):
-                    for row_offset in range(sel_rows):
-                        value_index = (col_index % sel_cols)
-                        base_value = selected_values[row_offset][value_index] or ""
+                with self._batch(model), self._undo_range(model, "Autofill", fill_range, sel_top, sel_bottom, vertical=False):
+                    for col_index, c in enumerate(fill_range):
+                        for row_offset in range(sel_rows):
+                            value_index = (col_index % sel_cols)
+                            base_value = selected_value(row_offset, value_index) or ""
 
-                        if fill_mode == "series" and self.last_series_number is not None:
-                            series_value = self.last_series_number + (col_index + 1) * step
-                            new_value = str(series_value)
-                        else:
-                            new_value = base_value
+                            if fill_mode == "series" and self.last_series_number is not None:
+                                series_value = self.last_series_number + (col_index + 1) * step
+                                new_value = str(series_value)
+                            elif is_formula(base_value):
+                                new_value = shift_formula(base_value, 0, c - (sel_left + value_index))
+                            else:
+                                new_value = base_value
 
-                        model.setData(model.index(sel_top + row_offset, c), new_value)
+                            model.setData(model.index(sel_top + row_offset, c), new_value)
 
 
             # Determine the area to keep visual (for the dashed outline after autofill)
             if self.autofill_end_index and self.autofill_direction:
-                selection.sort(key=lambda idx: (idx.row(), idx.column()))
-                sel_top = min(idx.row() for idx in selection)
-                sel_bottom = max(idx.row() for idx in selection)
-                sel_left = min(idx.column() for idx in selection)
-                sel_right = max(idx.column() for idx in selection)
-
                 if self.autofill_direction == 'vertical':
                     fill_top = sel_bottom + 1 if self.autofill_end_index.row() > sel_bottom else self.autofill_end_index.row()
                     fill_bottom = self.autofill_end_index.row() if self.autofill_end_index.row() > sel_bottom else sel_top - 1
@@ -551,12 +646,10 @@ class ExcelStyleTableView(QTableView):
                     fill_left = sel_right + 1 if self.autofill_end_index.column() > sel_right else self.autofill_end_index.column()
                     fill_right = self.autofill_end_index.column() if self.autofill_end_index.column() > sel_right else sel_left - 1
 
-                # Save indexes for repaint
-                self.keep_preview_indexes = [
-                    model.index(r, c)
-                    for r in range(min(fill_top, fill_bottom), max(fill_top, fill_bottom) + 1)
-                    for c in range(min(fill_left, fill_right), max(fill_left, fill_right) + 1)
-                ]
+                # Save the filled rectangle for repaint
+                self.keep_preview_range = (min(fill_top, fill_bottom), min(fill_left, fill_right),
+                                           max(fill_top, fill_bottom), max(fill_left, fill_right))
+                self.keep_preview_rect = None
 
             # Reset autofill state
             self.autofill_start_index = None
@@ -564,6 +657,7 @@ class ExcelStyleTableView(QTableView):
             self.autofill_direction = None
             self.autofill_dragging = False
             self.viewport().update()
+            self._sync_dash_timer()
 
             # Reset cursor to default on release
             self.unsetCursor()
@@ -573,6 +667,26 @@ class ExcelStyleTableView(QTableView):
         super().mouseReleaseEvent(event)
 
 
+    def rowsPerPage(self):
+        return max(1, self.viewport().height() // max(1, self.verticalHeader().defaultSectionSize()))
+
+    def columnsPerPage(self):
+        return max(1, self.viewport().width() // max(1, self.horizontalHeader().defaultSectionSize()))
+
+    def _batch(self, model):
+        # Coalesce the per-cell dataChanged signals of a bulk write when the model can
+        if not hasattr(model, "batch"):
+            return nullcontext()
+        return model.batch()
+
+    def _undo_range(self, model, label, fill_range, first, last, vertical):
+        # Record a fill as a single range diff when the model supports undo
+        if not fill_range or not hasattr(model, "undo_range"):
+            return nullcontext()
+        if vertical:
+            return model.undo_range(label, min(fill_range), first, max(fill_range), last)
+        return model.undo_range(label, first, min(fill_range), last, max(fill_range))
+
     def auto_scroll_update(self):
         if not self.middle_mouse_pressed or not self.middle_click_position:
             return
@@ -588,69 +702,34 @@ class ExcelStyleTableView(QTableView):
         new_v = v_scroll.value() + int(delta.y() * scroll_speed_factor)
         v_scroll.setValue(new_v)
 
-        # If we're near bottom, add a new row
-        if v_scroll.value() >= v_scroll.maximum() - 5:
-            model = self.model()
-            if isinstance(model, QStandardItemModel):
-                current_cols = model.columnCount()
-                model.insertRow(model.rowCount())
-                model.setVerticalHeaderItem(model.rowCount() - 1, QStandardItem(str(model.rowCount())))
-                for col in range(current_cols):
-                    model.setItem(model.rowCount() - 1, col, QStandardItem(""))
+        # Scrolling down within a screen of the bottom: pre-allocate a block of rows ahead
+        model = self.model()
+        can_grow = isinstance(model, SparseTableModel) and not model.virtual
+        if can_grow and delta.y() > 0 and v_scroll.value() >= v_scroll.maximum() - self.viewport().height():
+            model.grow(rows=self.rowsPerPage())
 
         # Scroll horizontally
         h_scroll = self.horizontalScrollBar()
         new_h = h_scroll.value() + int(delta.x() * scroll_speed_factor)
         h_scroll.setValue(new_h)
 
-        # If we're near right, add a new column
-        if h_scroll.value() >= h_scroll.maximum() - 5:
-            model = self.model()
-            if isinstance(model, QStandardItemModel):
-                current_rows = model.rowCount()
-                model.insertColumn(model.columnCount())
-
-                # Generate next header letter (A, B, ..., AA, AB, etc.)
-                new_col_index = model.columnCount() - 1
-                result = ""
-                col = new_col_index
-                while True:
-                    result = chr(col % 26 + ord('A')) + result
-                    col = col // 26 - 1
-                    if col < 0:
-                        break
-                model.setHorizontalHeaderItem(new_col_index, QStandardItem(result))
-
-                for row in range(current_rows):
-                    model.setItem(row, new_col_index, QStandardItem(""))
+        # Same to the right with a block of columns
+        if can_grow and delta.x() > 0 and h_scroll.value() >= h_scroll.maximum() - self.viewport().width():
+            model.grow(cols=self.columnsPerPage())
 
 
     def paintEvent(self, event):
         super().paintEvent(event)
 
-        selection = self.selectionModel().selectedIndexes()
-        if not selection:
+        # Bounds and their rectangle are cached, see _update_selection_bounds
+        selection_rect = self._selection_geometry()
+        if selection_rect is None:
             return
 
-        model = self.model()
-        selection.sort(key=lambda idx: (idx.row(), idx.column()))
-        sel_top = min(idx.row() for idx in selection)
-        sel_bottom = max(idx.row() for idx in selection)
-        sel_left = min(idx.column() for idx in selection)
-        sel_right = max(idx.column() for idx in selection)
-
         painter = QPainter(self.viewport())
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
         # Draw main selection border
-        top_left_index = model.index(sel_top, sel_left)
-        bottom_right_index = model.index(sel_bottom, sel_right)
-
-        rect_top_left = self.visualRect(top_left_index)
-        rect_bottom_right = self.visualRect(bottom_right_index)
-
-        selection_rect = rect_top_left.united(rect_bottom_right).adjusted(0, 0, -1, -1)
-
         pen = QPen(QColor(0, 128, 0), 2)
         painter.setPen(pen)
         painter.drawRect(selection_rect)
@@ -665,46 +744,10 @@ class ExcelStyleTableView(QTableView):
         painter.fillRect(self.handle_rect, QColor(0, 0, 255))
 
         # Store drag_rect for checking cursor position in mouseMoveEvent
-        self.drag_rect = None  # Initialize to None each time
+        self.drag_rect = self._drag_geometry()
 
         # Draw drag selection preview if dragging
-        if self.autofill_dragging and self.autofill_start_index and self.autofill_end_index:
-            start_row = self.autofill_start_index.row()
-            start_col = self.autofill_start_index.column()
-            end_row = self.autofill_end_index.row()
-            end_col = self.autofill_end_index.column()
-
-            if self.autofill_direction == 'vertical':
-                if end_row > sel_bottom:
-                    drag_top = sel_bottom + 1
-                    drag_bottom = end_row
-                elif end_row < sel_top:
-                    drag_top = end_row
-                    drag_bottom = sel_top - 1
-                else:
-                    return  # No visual if drag within selected rows
-
-                drag_left = sel_left
-                drag_right = sel_right
-
-            elif self.autofill_direction == 'horizontal':
-                if end_col > sel_right:
-                    drag_left = sel_right + 1
-                    drag_right = end_col
-                elif end_col < sel_left:
-                    drag_left = end_col
-                    drag_right = sel_left - 1
-                else:
-                    return  # No visual if drag within selected columns
-
-                drag_top = sel_top
-                drag_bottom = sel_bottom
-
-            drag_top_left = self.visualRect(model.index(drag_top, drag_left))
-            drag_bottom_right = self.visualRect(model.index(drag_bottom, drag_right))
-
-            self.drag_rect = drag_top_left.united(drag_bottom_right).adjusted(0, 0, -1, -1)
-
+        if self.drag_rect is not None and not self.drag_rect.isEmpty():
             # Draw dashed rectangle for drag preview
             pen.setStyle(Qt.PenStyle.DashLine)
             pen.setColor(QColor(0, 128, 0))
@@ -713,21 +756,15 @@ class ExcelStyleTableView(QTableView):
 
         # Draw last autofill rect (after mouse release)
             # Persistent preview after autofill ends
-        if self.keep_preview_indexes:
-            preview_rects = [self.visualRect(index) for index in self.keep_preview_indexes]
-            if preview_rects:
-                united_rect = preview_rects[0]
-                for rect in preview_rects[1:]:
-                    united_rect = united_rect.united(rect)
-                united_rect.adjust(0, 0, -1, -1)
-
-                pen = QPen(QColor(0, 128, 0), 1)
-                pen.setStyle(Qt.PenStyle.CustomDashLine)
-                pen.setDashPattern([4, 2])
-                pen.setDashOffset(self.dash_offset)
-
-                painter.setPen(pen)
-                painter.drawRect(united_rect)
+        preview_rect = self._preview_geometry()
+        if preview_rect is not None and not preview_rect.isEmpty():
+            pen = QPen(QColor(0, 128, 0), 1)
+            pen.setStyle(Qt.PenStyle.CustomDashLine)
+            pen.setDashPattern([4, 2])
+            pen.setDashOffset(self.dash_offset)
+
+            painter.setPen(pen)
+            painter.drawRect(preview_rect)
    
 
 
@@ -738,7 +775,8 @@ class WrapTextDelegate(QStyledItemDelegate):
         return editor
 
     def setEditorData(self, editor, index):
-        editor.setText(index.model().data(index, Qt.ItemDataRole.DisplayRole))
+        # Edit what was typed (the formula), not the value it shows
+        editor.setText(index.model().data(index, Qt.ItemDataRole.EditRole))
 
     def setModelData(self, editor, model, index):
         model.setData(index, editor.toPlainText(), Qt.ItemDataRole.EditRole)
@@ -147,6 +147,20 @@ class ExcelToolbarKit(QWidget):
         self.wrap_text_btn.setChecked(cell.wrapText())
         self.merge_center_btn.setChecked(cell.columnSpan() > 1 or cell.rowSpan() > 1)
 
+    def update_for_style(self, style, merged=False):
+        """Set the buttons straight from a style_table.Style."""
+        self.current_cell = None
+        self.h_left_btn.setChecked(style.h_align == "left")
+        self.h_center_btn.setChecked(style.h_align == "center")
+        self.h_right_btn.setChecked(style.h_align == "right")
+
+        self.v_top_btn.setChecked(style.v_align == "top")
+        self.v_middle_btn.setChecked(style.v_align == "center")
+        self.v_bottom_btn.setChecked(style.v_align == "bottom")
+
+        self.wrap_text_btn.setChecked(style.wrap)
+        self.merge_center_btn.setChecked(merged)
+
     def update_button_states(self):
         if self.current_cell:
             self.update_for_cell(self.current_cell)
@@ -0,0 +1,129 @@
+"""Momentum scrolling for the sheet view, in both directions.
+
+Wheel events only record a sample (in a small ring buffer) and kick the
+velocity. A timer moves the scroll bars while there is velocity left and
+stops itself when it runs out, so an idle sheet gets no timer wakeups.
+
+Every frame measures the time since the previous one and moves by the
+distance the decaying velocity covers in that time, friction included. A
+late frame (a busy GUI thread) therefore moves further in one step instead
+of making the whole scroll slower or longer.
+"""
+from collections import deque
+import math
+
+from PyQt6.QtCore import QObject, QTimer, QElapsedTimer, Qt, pyqtSignal
+
+
+FRAME_MS = 16               # ~60 FPS while moving
+SAMPLE_WINDOW_MS = 100      # wheel samples older than this don't count
+SAMPLE_SLOTS = 16           # size of the sample ring buffer
+WHEEL_SCALE = 6.0           # pixels per second of velocity per unit of wheel delta
+FRICTION = 0.88             # velocity kept per 1/60 s, the key value for "not too icy"
+STOP_SPEED = 12.0           # pixels per second, slower than this stops
+MAX_FRAME_TIME = 0.1        # seconds; after a longer stall don't jump the whole way
+
+# Exponential decay rate per second matching FRICTION per 60 FPS frame
+DECAY_RATE = -math.log(FRICTION) * 60
+
+
+class KineticScroller(QObject):
+    reached_bottom = pyqtSignal()   # pushed past the end of the vertical scroll bar
+
+    def __init__(self, area):
+        super().__init__(area)
+        self.area = area                    # the QAbstractScrollArea whose bars are moved
+        self.velocity_x = 0.0               # pixels per second, positive moves left/up
+        self.velocity_y = 0.0
+        self._samples = deque(maxlen=SAMPLE_SLOTS)  # (timestamp ms, dx, dy)
+        self._carry_x = 0.0                 # sub-pixel movement not applied yet
+        self._carry_y = 0.0
+        self._clock = QElapsedTimer()
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self._timer.setInterval(FRAME_MS)
+        self._timer.timeout.connect(self._step)
+
+    def is_moving(self):
+        return self._timer.isActive()
+
+    def wheel(self, event):
+        """Feed a QWheelEvent. Shift+wheel scrolls sideways, like in Excel."""
+        delta = event.angleDelta()
+        dx, dy = delta.x(), delta.y()
+        if dx == 0 and event.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+            dx, dy = dy, 0
+        self.add_sample(event.timestamp(), dx, dy)
+
+    def add_sample(self, timestamp, dx, dy):
+        now = timestamp
+        samples = self._samples
+        samples.append((now, dx, dy))
+
+        # Weighted average of the recent deltas, newer ones count more
+        sum_x = sum_y = weight_total = 0.0
+        for t, sample_x, sample_y in samples:
+            age = now - t
+            if not 0 <= age < SAMPLE_WINDOW_MS:
+                continue
+            weight = 1.0 - age / SAMPLE_WINDOW_MS
+            sum_x += sample_x * weight
+            sum_y += sample_y * weight
+            weight_total += weight
+        if not weight_total:
+            return
+
+        # Blend with previous velocity (natural kick)
+        self.velocity_x = self.velocity_x * 0.2 + sum_x / weight_total * WHEEL_SCALE * 0.8
+        self.velocity_y = self.velocity_y * 0.2 + sum_y / weight_total * WHEEL_SCALE * 0.8
+        self._start()
+
+    def stop(self):
+        self.velocity_x = self.velocity_y = 0.0
+        self._carry_x = self._carry_y = 0.0
+        self._timer.stop()
+
+    def _start(self):
+        if abs(self.velocity_x) < STOP_SPEED and abs(self.velocity_y) < STOP_SPEED:
+            return
+        if not self._timer.isActive():
+            self._clock.start()
+            self._timer.start()
+
+    def _step(self):
+        elapsed = min(self._clock.restart() / 1000.0, MAX_FRAME_TIME)
+        decay = math.exp(-DECAY_RATE * elapsed)
+        # Distance the velocity covers while it decays over `elapsed`
+        travel = (1.0 - decay) / DECAY_RATE
+
+        if self.velocity_x:
+            self.velocity_x, self._carry_x = self._move(
+                self.area.horizontalScrollBar(), self.velocity_x, self._carry_x + self.velocity_x * travel, decay)
+        if self.velocity_y:
+            self.velocity_y, self._carry_y = self._move(
+                self.area.verticalScrollBar(), self.velocity_y, self._carry_y + self.velocity_y * travel, decay)
+
+        if not self.velocity_x and not self.velocity_y:
+            self._timer.stop()
+
+    def _move(self, scroll_bar, velocity, carry, decay):
+        # Apply the whole pixels of the carried movement; returns the new (velocity, carry)
+        pixels = int(carry)
+        new_pos = scroll_bar.value() - pixels
+
+        # Clamp within bounds, stopping completely at either end
+        if new_pos < scroll_bar.minimum():
+            scroll_bar.setValue(scroll_bar.minimum())
+            return 0.0, 0.0
+        if new_pos > scroll_bar.maximum():
+            scroll_bar.setValue(scroll_bar.maximum())
+            if scroll_bar.orientation() == Qt.Orientation.Vertical:
+                self.reached_bottom.emit()
+            return 0.0, 0.0
+
+        if pixels:
+            scroll_bar.setValue(new_pos)
+        velocity *= decay
+        if abs(velocity) < STOP_SPEED:
+            return 0.0, 0.0
+        return velocity, carry - pixels
@@ -0,0 +1,67 @@
+"""Recalculation on a background thread.
+
+The GUI thread works out what to recompute and hands the thread a stable
+copy of the inputs: copy-on-write snapshots of the cell store and the string
+table, the formula cells as they were, and a private fork of the computed
+values that the thread writes its own results into. The user can keep
+editing the live sheet meanwhile.
+
+Results come back in batches through results_ready (a queued connection,
+the slot runs on the GUI thread). Every run has an id; when a newer edit
+makes a run obsolete the model cancels it and ignores whatever it still
+sends.
+"""
+import time
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from cell_store import ChunkedCellStore
+from formula_engine import CIRCULAR
+from range_aggregates import SheetSource
+from shared_strings import StringSnapshot
+
+
+RESULT_BATCH = 2000       # send results after this many formulas...
+RESULT_INTERVAL = 0.1     # ...or after this many seconds, whichever comes first
+
+
+class RecalcThread(QThread):
+    results_ready = pyqtSignal(int, list)   # run id, [(row, column, value), ...]
+
+    def __init__(self, run_id, order, cyclic, model, parent=None):
+        super().__init__(parent)
+        self.run_id = run_id
+        self.order = order      # formula cells in topological order
+        self.cyclic = cyclic    # cells caught in a reference cycle
+        # Everything the thread reads is taken here, on the GUI thread
+        self.formulas = dict(model.dependencies.formulas)
+        self.cells = model.cells.snapshot()
+        self.strings = StringSnapshot(model.strings.snapshot())
+        self.values = ChunkedCellStore.from_snapshot(model.values.snapshot())
+        self._cancelled = False
+
+    def cancel(self):
+        """Stop after the formula being computed; nothing more is sent."""
+        self._cancelled = True
+
+    def run(self):
+        source = SheetSource(self.cells, self.strings, self.values, self.formulas)
+        formulas = self.formulas
+        values = self.values
+        batch = []
+        sent = time.monotonic()
+        for row, column in self.order:
+            if self._cancelled:
+                return
+            value = formulas[(row, column)].evaluate(source)
+            value = 0 if value is None else value
+            values.set(row, column, value)
+            batch.append((row, column, value))
+            if len(batch) >= RESULT_BATCH or time.monotonic() - sent > RESULT_INTERVAL:
+                self.results_ready.emit(self.run_id, batch)
+                batch = []
+                sent = time.monotonic()
+        if self._cancelled:
+            return
+        batch.extend((row, column, CIRCULAR) for row, column in self.cyclic)
+        self.results_ready.emit(self.run_id, batch)
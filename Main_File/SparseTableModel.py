@@ -0,0 +1,754 @@
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from itertools import count
+
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, QCoreApplication, QTimer, pyqtSlot
+
+from cell_store import ChunkedCellStore, column_label
+from shared_strings import SharedStringTable
+from style_table import StyleTable
+from format_layers import FormatLayers
+from sheet_snapshot import SheetSnapshot
+from model_batch import BatchedChangesMixin
+from dependency_graph import DependencyGraph
+from formula_engine import compile_formula_at, format_value, is_formula, FormulaError, CIRCULAR
+from range_aggregates import SheetSource
+from parallel_recalc import evaluate_parallel, PARALLEL_MIN_FORMULAS
+from RecalcThread import RecalcThread
+from undo_stack import UndoStack, CellRangeCommand, FormatCommand, MergeCommand, encode_runs, iter_runs
+
+
+# Excel's sheet size, used as the logical size of a virtual model
+MAX_ROWS = 1048576
+MAX_COLUMNS = 16384
+
+# grow() never adds fewer rows/columns than this, so edge growth happens in blocks
+GROW_BLOCK_ROWS = 64
+GROW_BLOCK_COLUMNS = 16
+
+# Extra roles: the cell's style id and whether its text wraps
+StyleIdRole = Qt.ItemDataRole.UserRole + 1
+WrapTextRole = Qt.ItemDataRole.UserRole + 2
+STYLE_ROLES = (Qt.ItemDataRole.TextAlignmentRole, StyleIdRole, WrapTextRole)
+# True while a formula cell waits for a background recalculation
+PendingRole = Qt.ItemDataRole.UserRole + 3
+PENDING_ROLES = (Qt.ItemDataRole.DisplayRole, PendingRole)
+
+# Recalculations touching at least this many formulas run on a RecalcThread
+BACKGROUND_MIN_FORMULAS = 2000
+PENDING_TEXT = "#BUSY!"   # shown by a formula that has no value yet, like Excel
+
+# schedule_recalc() collects changed rectangles this many ms before recalculating
+# them together; 0 means until control is back in the event loop
+RECALC_DELAY_MS = 0
+
+# Lazy mode: a referenced range this small is checked cell by cell for stale formulas
+STALE_SCAN_CELLS = 64
+
+H_ALIGN_FLAGS = {
+    "left": Qt.AlignmentFlag.AlignLeft,
+    "center": Qt.AlignmentFlag.AlignHCenter,
+    "right": Qt.AlignmentFlag.AlignRight,
+}
+V_ALIGN_FLAGS = {
+    "top": Qt.AlignmentFlag.AlignTop,
+    "center": Qt.AlignmentFlag.AlignVCenter,
+    "bottom": Qt.AlignmentFlag.AlignBottom,
+}
+
+
+def alignment_changes(alignment):
+    """Style changes for a Qt alignment, only for the directions it sets."""
+    changes = {}
+    for name, flag in H_ALIGN_FLAGS.items():
+        if alignment & flag:
+            changes["h_align"] = name
+    for name, flag in V_ALIGN_FLAGS.items():
+        if alignment & flag:
+            changes["v_align"] = name
+    return changes
+
+
+def alignment_flags(style):
+    return H_ALIGN_FLAGS[style.h_align] | V_ALIGN_FLAGS[style.v_align]
+
+
+# Qt asks for flags cell by cell when a whole row/column is selected, build them once
+CELL_FLAGS = Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsEditable
+
+
+class SparseItem:
+    """Stand-in for QStandardItem. It holds no data itself, every read and
+    write goes straight to the model's cell store."""
+    __slots__ = ("_model", "_row", "_column")
+
+    def __init__(self, model, row, column):
+        self._model = model
+        self._row = row
+        self._column = column
+
+    def row(self):
+        return self._row
+
+    def column(self):
+        return self._column
+
+    def index(self):
+        return self._model.index(self._row, self._column)
+
+    def data(self, role=Qt.ItemDataRole.UserRole + 1):
+        return self._model.data(self.index(), role)
+
+    def setData(self, value, role=Qt.ItemDataRole.UserRole + 1):
+        self._model.setData(self.index(), value, role)
+
+    def text(self):
+        return self._model.cell_text(self._row, self._column)
+
+    def setText(self, text):
+        self._model.setData(self.index(), text, Qt.ItemDataRole.EditRole)
+
+    def textAlignment(self):
+        return alignment_flags(self._model.style_at(self._row, self._column))
+
+    def setTextAlignment(self, alignment):
+        self._model.setData(self.index(), alignment, Qt.ItemDataRole.TextAlignmentRole)
+
+
+class SparseTableModel(BatchedChangesMixin, QAbstractTableModel):
+    def __init__(self, rows=0, columns=0, parent=None, virtual=False):
+        super().__init__(parent)
+        # A virtual model reports the full sheet size up front. Storage is still
+        # only allocated for touched cells and headers are generated on demand.
+        self.virtual = virtual
+        if virtual:
+            rows, columns = MAX_ROWS, MAX_COLUMNS
+        self.rows = rows
+        self.columns = columns
+        self.strings = SharedStringTable()    # every distinct cell text, stored once
+        self.cells = ChunkedCellStore()       # string ids, only for cells that were written
+        self.values = ChunkedCellStore()      # computed values of formula cells (cells holds the formula)
+        self.styles = StyleTable()            # every distinct style combination, stored once
+        self.formats = FormatLayers(self.styles)  # styled rectangles, resolved to style ids on lookup
+        self._alignment_cache = {}            # style id -> Qt alignment flags
+        self.merged_cells = []  # List of tuples: (top_row, left_col, row_span, col_span)
+        self.undo_stack = UndoStack()
+        self._undo_depth = 0    # > 0 while an undo_range block records the whole range
+        self._restoring = False # undo/redo writes are not recorded again
+        self.dependencies = DependencyGraph()  # formula cells and what they read
+        # What formulas read cells through, with block cached range aggregates
+        self.source = SheetSource(self.cells, self.strings, self.values, self.dependencies.formulas)
+        self.background_recalc = True  # big recalculations go to a RecalcThread
+        self._recalc_thread = None     # the run whose results are still wanted
+        self._recalc_run = 0           # id of that run, older runs are ignored
+        self._threads = set()          # running threads, kept alive until they finish
+        self._pending = set()          # formula cells waiting for the background run (or stale)
+        self._pending_bounds = None    # (top, left, bottom, right) of the background run's cells
+        # Lazy mode: edits only mark formulas stale, they are computed when
+        # shown (set_viewport), read by a computed formula, or exported
+        self.lazy_recalc = False
+        self.viewport = None           # rectangle the view shows, with its prefetch margin
+        self._stale_rank = {}          # stale cell -> position in a topological order
+        self._ranks = count()
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self._stop_threads)
+        # Bursts of edits (fills, merges, undo) are recalculated once, see schedule_recalc()
+        self._dirty = set()            # changed rectangles not recalculated yet
+        self._recalc_timer = QTimer(self)
+        self._recalc_timer.setSingleShot(True)
+        self._recalc_timer.setInterval(RECALC_DELAY_MS)
+        self._recalc_timer.timeout.connect(self.flush_recalc)
+        self.dataChanged.connect(self._contents_changed)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.rows
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.columns
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.display_text(index.row(), index.column())
+        if role == Qt.ItemDataRole.EditRole:
+            return self.cell_text(index.row(), index.column())
+        if role == Qt.ItemDataRole.TextAlignmentRole:
+            style_id = self.formats.style_id_at(index.row(), index.column())
+            flags = self._alignment_cache.get(style_id)
+            if flags is None:
+                flags = self._alignment_cache[style_id] = alignment_flags(self.styles.get(style_id))
+            return flags
+        if role == StyleIdRole:
+            return self.formats.style_id_at(index.row(), index.column())
+        if role == WrapTextRole:
+            return self.style_at(index.row(), index.column()).wrap
+        if role == PendingRole:
+            return (index.row(), index.column()) in self._pending
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid():
+            return False
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            row, column = index.row(), index.column()
+            if self._undo_depth or self._restoring:
+                self.set_cell_text(row, column, value)
+            else:
+                with self.undo_range("Edit", row, column, row, column):
+                    self.set_cell_text(row, column, value)
+        elif role == Qt.ItemDataRole.TextAlignmentRole:
+            self.apply_style(index.row(), index.column(), index.row(), index.column(), **alignment_changes(value))
+            return True
+        else:
+            return False
+        self.changed(index.row(), index.column(), index.row(), index.column())
+        return True
+
+    def cell_text(self, row, column):
+        """What was typed into the cell, i.e. the formula for a formula cell (EditRole)."""
+        string_id = self.cells.get(row, column)
+        return "" if string_id is None else self.strings.get(string_id)
+
+    def display_text(self, row, column):
+        """What the cell shows, i.e. the computed value for a formula cell (DisplayRole)."""
+        value = self.values.get(row, column)
+        if value is not None:
+            return format_value(value)
+        string_id = self.cells.get(row, column)
+        if string_id is None:
+            return ""
+        if (row, column) in self.dependencies:
+            # formula not calculated yet
+            return PENDING_TEXT if (row, column) in self._pending else ""
+        return self.strings.get(string_id)
+
+    def items_in_range(self, top, left, bottom, right):
+        """(row, column, text) of the non-empty cells in a rectangle."""
+        strings = self.strings
+        for row, column, string_id in self.cells.items_in_range(top, left, bottom, right):
+            yield row, column, strings.get(string_id)
+
+    def display_items_in_range(self, top, left, bottom, right):
+        """Like items_in_range(), with formula cells giving their computed value."""
+        self.flush_recalc()
+        if self._pending:
+            self.evaluate_stale(top, left, bottom, right)
+        strings = self.strings
+        values = self.values
+        formulas = self.dependencies.formulas
+        for row, column, string_id in self.cells.items_in_range(top, left, bottom, right):
+            if (row, column) in formulas:
+                value = values.get(row, column)
+                if value is not None:
+                    yield row, column, format_value(value)
+            else:
+                yield row, column, strings.get(string_id)
+
+    def set_cell_text(self, row, column, value):
+        # Store the shared string id, releasing the one the cell held before
+        text = "" if value is None else str(value)
+        old_id = self.cells.get(row, column)
+        new_id = self.strings.add(text) if text else None
+        self.cells.set(row, column, new_id)
+        if old_id is not None:
+            self.strings.release(old_id)
+
+        # Keep the dependency graph in step with the formulas in the store;
+        # the value is computed by the next recalculate()
+        cell = (row, column)
+        if is_formula(text):
+            try:
+                self.dependencies.set_formula(cell, compile_formula_at(text, row, column))
+                self.values.set(row, column, None)
+                return
+            except FormulaError:
+                pass  # not a formula we understand, it stays plain text
+        if cell in self.dependencies:
+            self.dependencies.remove(cell)
+            self.values.set(row, column, None)
+            # Not a formula any more, so nothing left to compute for it
+            self._pending.discard(cell)
+            self._stale_rank.pop(cell, None)
+
+    def _contents_changed(self, top_left, bottom_right, roles):
+        # Every edit of cell contents is recalculated, whoever made it (the
+        # view, an import, undo). The recalculation itself reports DisplayRole
+        # only, so it never comes back in here.
+        if roles and Qt.ItemDataRole.EditRole not in roles:
+            return
+        self.schedule_recalc(top_left.row(), top_left.column(), bottom_right.row(), bottom_right.column())
+
+    def schedule_recalc(self, top, left, bottom, right):
+        """Note a changed rectangle. Everything noted until the timer fires (one
+        event loop turn by default, see set_recalc_delay) is recalculated in
+        one go, so cells many of the changes reach are computed once."""
+        self._dirty.add((top, left, bottom, right))
+        if not self._recalc_timer.isActive():
+            self._recalc_timer.start()
+
+    def set_recalc_delay(self, msec):
+        self._recalc_timer.setInterval(msec)
+
+    def flush_recalc(self):
+        """Recalculate what schedule_recalc() collected now."""
+        self._recalc_timer.stop()
+        if not self._dirty:
+            return 0
+        rects = list(self._dirty)
+        self._dirty = set()
+        return self.recalculate_rects(rects)
+
+    def recalculate(self, top, left, bottom, right):
+        """Recompute the formulas in a changed rectangle and everything depending on it.
+
+        Only computed values are written and only DisplayRole is reported, so
+        recalculating never looks like an edit and never goes on the undo stack.
+        Big recalculations run on a RecalcThread and their cells show as
+        pending until the results arrive. A running one is only cancelled when
+        the edit changes, reaches or may read its cells (its unfinished cells
+        are then folded into this one); other edits are computed alongside it.
+        In lazy mode the cells are only marked stale.
+        """
+        return self.recalculate_rects([(top, left, bottom, right)])
+
+    def recalculate_rects(self, rects):
+        """recalculate() for several changed rectangles, in one topological order."""
+        graph = self.dependencies
+        roots = []
+        for rect in rects:
+            roots.extend(graph.formulas_in(*rect))
+        if self._recalc_thread is not None and not self.lazy_recalc:
+            order, cyclic = graph.recalc_order(rects, roots)
+            if len(order) + len(cyclic) < BACKGROUND_MIN_FORMULAS and not self._touches_pending(rects, roots, order, cyclic):
+                # Unrelated to the running recalculation: computed now, the run goes on
+                self._evaluate(order, cyclic)
+                return len(order) + len(cyclic)
+        if self._recalc_thread is not None:
+            self._cancel_background()
+            roots.extend(self._pending)
+            self._pending = set()
+        if self.lazy_recalc:
+            return self._mark_stale(rects, roots)
+        if self._pending:
+            # Stale cells left over from lazy mode
+            roots.extend(self._pending)
+            self._pending = set()
+            self._stale_rank = {}
+        order, cyclic = graph.recalc_order(rects, roots)
+        if not order and not cyclic:
+            return 0
+        if self.background_recalc and len(order) + len(cyclic) >= BACKGROUND_MIN_FORMULAS:
+            self._start_background(order, cyclic)
+            return len(order) + len(cyclic)
+        self._evaluate(order, cyclic)
+        return len(order) + len(cyclic)
+
+    def _touches_pending(self, rects, roots, order, cyclic):
+        # Whether an edit has to restart the background run: it overwrites or
+        # reaches a pending cell, or enters a formula that may read one
+        pending = self._pending
+        if any(cell in pending for cell in order) or any(cell in pending for cell in cyclic):
+            return True
+        for top, left, bottom, right in rects:
+            if (bottom - top + 1) * (right - left + 1) <= len(pending):
+                if any((row, column) in pending for row in range(top, bottom + 1) for column in range(left, right + 1)):
+                    return True
+            elif any(top <= row <= bottom and left <= column <= right for row, column in pending):
+                return True
+        # New formulas aren't part of the run, checked against the bounds of the pending cells
+        pending_top, pending_left, pending_bottom, pending_right = self._pending_bounds
+        formulas = self.dependencies.formulas
+        for cell in roots:
+            for top, left, bottom, right in formulas[cell].references:
+                if top <= pending_bottom and bottom >= pending_top and left <= pending_right and right >= pending_left:
+                    return True
+        return False
+
+    def _evaluate(self, order, cyclic=()):
+        source = self.source
+        values = self.values
+        formulas = self.dependencies.formulas
+        pending = self._pending
+        with self.batch():
+            for row, column in order:
+                value = formulas[(row, column)].evaluate(source)
+                # A formula showing an empty cell shows 0, like Excel
+                values.set(row, column, 0 if value is None else value)
+                pending.discard((row, column))
+                self.changed(row, column, row, column, PENDING_ROLES)
+            for row, column in cyclic:
+                values.set(row, column, CIRCULAR)
+                pending.discard((row, column))
+                self.changed(row, column, row, column, PENDING_ROLES)
+
+    # Lazy recalculation
+
+    def _mark_stale(self, rects, roots):
+        order, cyclic = self.dependencies.recalc_order(rects, roots)
+        if not order and not cyclic:
+            return 0
+        rank = self._stale_rank
+        for cell in cyclic:
+            rank.pop(cell, None)
+        # Every dependent of a re-marked cell is in `order` too and ranked
+        # after it, so the ranks of all stale cells stay a topological order
+        rank.update(zip(order, self._ranks))
+        with self.batch():
+            self._evaluate((), cyclic)
+            if order:
+                self._pending.update(order)
+                rows = [row for row, _column in order]
+                columns = [column for _row, column in order]
+                self.changed(min(rows), min(columns), max(rows), max(columns), PENDING_ROLES)
+        if self.viewport is not None:
+            self.evaluate_stale(*self.viewport)
+        return len(order) + len(cyclic)
+
+    def set_viewport(self, top, left, bottom, right):
+        """The cells the view shows, plus its prefetch margin. Stale formulas in
+        there are computed right away."""
+        self.viewport = (top, left, bottom, right)
+        if self._pending and self._recalc_thread is None:
+            self.evaluate_stale(top, left, bottom, right)
+
+    def evaluate_stale(self, top, left, bottom, right):
+        """Compute the stale formulas of a rectangle, and the stale cells they read.
+
+        Waits for a running background recalculation instead. Returns the
+        number of formulas computed.
+        """
+        if self._recalc_thread is not None:
+            self.wait_recalc()
+            return 0
+        pending = self._pending
+        if not pending:
+            return 0
+        needed = set(cell for cell in self.dependencies.formulas_in(top, left, bottom, right) if cell in pending)
+        queue = list(needed)
+        formulas = self.dependencies.formulas
+        columns = None   # col -> sorted rows of the stale cells, built on first need
+        covered = {}     # col -> (top, bottom) of a span whose stale cells are collected
+        while queue:
+            cell = queue.pop()
+            for first_row, first_col, last_row, last_col in formulas[cell].references:
+                if (last_row - first_row + 1) * (last_col - first_col + 1) <= STALE_SCAN_CELLS:
+                    found = [(row, col) for row in range(first_row, last_row + 1) for col in range(first_col, last_col + 1)
+                             if (row, col) in pending]
+                else:
+                    if columns is None:
+                        columns = {}
+                        for row, col in pending:
+                            columns.setdefault(col, []).append(row)
+                        for rows in columns.values():
+                            rows.sort()
+                    found = []
+                    for col in range(first_col, last_col + 1):
+                        rows = columns.get(col)
+                        if rows is None:
+                            continue
+                        # Only the part of the range outside the span collected before,
+                        # so SUM(A1:A1), SUM(A1:A2), ... don't rescan the column
+                        low, high = covered.get(col, (last_row + 1, last_row))
+                        for start, stop in ((first_row, min(last_row, low - 1)), (max(first_row, high + 1), last_row)):
+                            if start <= stop:
+                                found.extend((row, col) for row in rows[bisect_left(rows, start):bisect_right(rows, stop)])
+                        if first_row <= high + 1 and last_row >= low - 1:
+                            covered[col] = (min(low, first_row), max(high, last_row))
+                        else:
+                            covered[col] = (first_row, last_row)
+                for precedent in found:
+                    if precedent not in needed:
+                        needed.add(precedent)
+                        queue.append(precedent)
+        if not needed:
+            return 0
+        rank = self._stale_rank
+        order = sorted(needed, key=rank.__getitem__)
+        for cell in order:
+            del rank[cell]
+        self._evaluate(order)
+        return len(order)
+
+    def compact_strings(self):
+        remap = self.strings.compact()
+        for row, column, string_id in list(self.cells.items()):
+            if remap[string_id] != string_id:
+                self.cells.set(row, column, remap[string_id])
+
+    def snapshot(self):
+        """O(1) copy-on-write snapshot of the cell contents, safe to read off the GUI thread.
+        Formulas still stale or pending are computed first, so exports see current values."""
+        self.flush_recalc()
+        if self._pending:
+            self.evaluate_stale(0, 0, self.rows - 1, self.columns - 1)
+        return SheetSnapshot(self.rows, self.columns, self.cells.snapshot(), self.strings.snapshot(),
+                             self.values.snapshot())
+
+    def load_rows(self, rows, top=0, left=0):
+        """Bulk import, e.g. openpyxl's sheet.iter_rows(values_only=True).
+        Values go straight into the string table, one dataChanged at the end."""
+        bottom = top - 1
+        right = left - 1
+        for row, values in enumerate(rows, start=top):
+            for column, value in enumerate(values, start=left):
+                if value is None:
+                    continue
+                self.set_cell_text(row, column, value)
+                right = max(right, column)
+            bottom = row
+        if bottom >= self.rows or right >= self.columns:
+            self.grow(rows=bottom + 1 - self.rows, cols=right + 1 - self.columns)
+        if bottom >= top and right >= left:
+            self.changed(top, left, bottom, right)
+
+    def recalculate_all(self, jobs=1):
+        """Recompute every formula, e.g. after an import.
+
+        With jobs > 1 and enough formulas, independent parts of the sheet are
+        computed in worker processes (see parallel_recalc); jobs=None uses
+        every core.
+        """
+        graph = self.dependencies
+        if jobs == 1 or len(graph) < PARALLEL_MIN_FORMULAS or self.lazy_recalc:
+            return self.recalculate(0, 0, self.rows - 1, self.columns - 1)
+        if self._recalc_thread is not None:
+            self._cancel_background()
+        self._pending = set()
+        self._stale_rank = {}
+        edges = {}
+        order, cyclic = graph.recalc_order([], list(graph.formulas), edges)
+        results = evaluate_parallel(graph, self.source, order, edges, jobs)
+        values = self.values
+        with self.batch():
+            for (row, column), value in zip(order, results):
+                values.set(row, column, value)
+                self.changed(row, column, row, column, [Qt.ItemDataRole.DisplayRole])
+            for row, column in cyclic:
+                values.set(row, column, CIRCULAR)
+                self.changed(row, column, row, column, [Qt.ItemDataRole.DisplayRole])
+        return len(order) + len(cyclic)
+
+    # Background recalculation
+
+    def _start_background(self, order, cyclic):
+        self._recalc_run += 1
+        thread = RecalcThread(self._recalc_run, order, cyclic, self)
+        thread.results_ready.connect(self._apply_results)
+        thread.finished.connect(lambda: self._threads.discard(thread))
+        self._threads.add(thread)
+        self._recalc_thread = thread
+        self._pending = set(order)
+        self._pending.update(cyclic)
+        # One dataChanged over the pending cells so they show as pending
+        rows = [row for row, _column in self._pending]
+        columns = [column for _row, column in self._pending]
+        self._pending_bounds = (min(rows), min(columns), max(rows), max(columns))
+        self.changed(*self._pending_bounds, PENDING_ROLES)
+        thread.start()
+
+    def _cancel_background(self):
+        self._recalc_thread.cancel()
+        self._recalc_thread = None
+        self._recalc_run += 1   # whatever it already sent is stale now
+
+    @pyqtSlot(int, list)   # a real slot, so queued results are posted to the model itself
+    def _apply_results(self, run_id, results):
+        if run_id != self._recalc_run:
+            return
+        values = self.values
+        pending = self._pending
+        with self.batch():
+            for row, column, value in results:
+                if (row, column) not in pending:
+                    continue    # overwritten since the run started
+                values.set(row, column, value)
+                pending.discard((row, column))
+                self.changed(row, column, row, column, PENDING_ROLES)
+        if not pending:
+            self._recalc_thread = None
+
+    def _stop_threads(self):
+        # A QThread must not be destroyed while it runs
+        for thread in list(self._threads):
+            thread.cancel()
+            thread.wait()
+
+    def is_recalculating(self):
+        return bool(self._pending)
+
+    def wait_recalc(self):
+        """Block until the background recalculation is done and its results are in,
+        e.g. before an export. Runs on the GUI thread."""
+        self.flush_recalc()
+        thread = self._recalc_thread
+        if thread is not None:
+            thread.wait()
+            # The results are queued to this object, deliver them now
+            QCoreApplication.sendPostedEvents(self)
+
+    def style_at(self, row, column):
+        return self.styles.get(self.formats.style_id_at(row, column))
+
+    def apply_style(self, top, left, bottom, right, **changes):
+        """Change some style attributes of a rectangle, e.g. apply_style(0, 0, 9, 2, wrap=True).
+
+        The rectangle is recorded once in the formatting layers, so a whole
+        column costs the same as a single cell.
+        """
+        if not changes:
+            return
+        added, removed = self.formats.add(top, left, bottom, right, **changes)
+        if not self._restoring:
+            self.undo_stack.push(FormatCommand("Format", added, removed))
+        self.changed(top, left, bottom, right, STYLE_ROLES)
+
+    def format_rects_changed(self, rects):
+        with self.batch():
+            for rect in rects:
+                self.changed(rect.top, rect.left, rect.bottom, rect.right, STYLE_ROLES)
+
+    # Undo / redo
+
+    def capture_runs(self, top, left, bottom, right):
+        """Run-length encoded cell text of a rectangle (see undo_stack.encode_runs)."""
+        strings = self.strings
+        items = [(row, column, strings.get(string_id))
+                 for row, column, string_id in self.cells.items_in_range(top, left, bottom, right)]
+        return encode_runs(top, left, bottom, right, items)
+
+    def restore_runs(self, rect, runs):
+        """Bulk restore of a rectangle from encoded runs, one dataChanged at the end."""
+        top, left, bottom, right = rect
+        self._restoring = True
+        try:
+            for row, column, _string_id in list(self.cells.items_in_range(top, left, bottom, right)):
+                self.set_cell_text(row, column, None)
+            for row, column, text in iter_runs(top, left, bottom, right, runs):
+                self.set_cell_text(row, column, text)
+            self.changed(top, left, bottom, right)
+        finally:
+            self._restoring = False
+
+    @contextmanager
+    def undo_range(self, label, top, left, bottom, right):
+        """Record every write inside the block as one undo command for the rectangle.
+
+            with model.undo_range("Autofill", 10, 0, 5000, 2):
+                ...
+        """
+        if self._undo_depth or self._restoring:
+            yield
+            return
+        before = self.capture_runs(top, left, bottom, right)
+        self._undo_depth += 1
+        try:
+            yield
+        finally:
+            self._undo_depth -= 1
+        after = self.capture_runs(top, left, bottom, right)
+        self.undo_stack.push(CellRangeCommand(label, (top, left, bottom, right), before, after))
+
+    def undo(self):
+        return self.undo_stack.undo(self)
+
+    def redo(self):
+        return self.undo_stack.redo(self)
+
+    def flags(self, index):
+        return CELL_FLAGS
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        # Labels are produced on demand instead of storing a header item per row/column
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return column_label(section)
+        return str(section + 1)
+
+    def insertRows(self, row, count, parent=QModelIndex()):
+        # Rows can only be appended, the store is addressed by absolute position
+        if row != self.rows or count < 1 or self.rows + count > MAX_ROWS:
+            return False
+        self.beginInsertRows(QModelIndex(), row, row + count - 1)
+        self.rows += count
+        self.endInsertRows()
+        return True
+
+    def insertColumns(self, column, count, parent=QModelIndex()):
+        if column != self.columns or count < 1 or self.columns + count > MAX_COLUMNS:
+            return False
+        self.beginInsertColumns(QModelIndex(), column, column + count - 1)
+        self.columns += count
+        self.endInsertColumns()
+        return True
+
+    def grow(self, rows=0, cols=0):
+        """Append at least `rows` rows and `cols` columns, one insert transaction per axis.
+
+        Growth is rounded up to a block (and to a quarter of the current size
+        for big sheets), so repeated calls at the edge only rarely touch the view.
+        Returns the number of rows and columns actually added.
+        """
+        added_rows = added_cols = 0
+        if rows > 0 and self.rows < MAX_ROWS:
+            step = max(rows, GROW_BLOCK_ROWS, self.rows // 4)
+            added_rows = min(step, MAX_ROWS - self.rows)
+            self.beginInsertRows(QModelIndex(), self.rows, self.rows + added_rows - 1)
+            self.rows += added_rows
+            self.endInsertRows()
+        if cols > 0 and self.columns < MAX_COLUMNS:
+            step = max(cols, GROW_BLOCK_COLUMNS, self.columns // 4)
+            added_cols = min(step, MAX_COLUMNS - self.columns)
+            self.beginInsertColumns(QModelIndex(), self.columns, self.columns + added_cols - 1)
+            self.columns += added_cols
+            self.endInsertColumns()
+        return added_rows, added_cols
+
+    # QStandardItemModel compatible helpers used by the view and MainPage
+
+    def item(self, row, column=0):
+        if 0 <= row < self.rows and 0 <= column < self.columns:
+            return SparseItem(self, row, column)
+        return None
+
+    def itemFromIndex(self, index):
+        if not index.isValid():
+            return None
+        return self.item(index.row(), index.column())
+
+    def setItem(self, row, column, item):
+        # Copy the item's contents into the store, an empty item just clears the cell
+        index = self.index(row, column)
+        self.setData(index, item.text(), Qt.ItemDataRole.EditRole)
+        alignment = item.data(Qt.ItemDataRole.TextAlignmentRole)
+        if alignment is not None:
+            self.setData(index, alignment, Qt.ItemDataRole.TextAlignmentRole)
+
+    def merge_cells(self, top_row, left_col, row_span, col_span):
+        self.merged_cells.append((top_row, left_col, row_span, col_span))
+        self.layoutChanged.emit()
+
+    def merge_range(self, top_row, left_col, row_span, col_span):
+        """Merge & Center: keep the top-left text, clear the rest, one undo step."""
+        bottom, right = top_row + row_span - 1, left_col + col_span - 1
+        before = self.capture_runs(top_row, left_col, bottom, right)
+        self._undo_depth += 1
+        try:
+            for row, column, _string_id in list(self.cells.items_in_range(top_row, left_col, bottom, right)):
+                if row != top_row or column != left_col:
+                    self.set_cell_text(row, column, None)
+        finally:
+            self._undo_depth -= 1
+        after = self.capture_runs(top_row, left_col, bottom, right)
+        self.changed(top_row, left_col, bottom, right)
+
+        span = (top_row, left_col, row_span, col_span)
+        cells = CellRangeCommand("Merge", (top_row, left_col, bottom, right), before, after)
+        self.undo_stack.push(MergeCommand("Merge", span, cells))
+        self.merge_cells(top_row, left_col, row_span, col_span)
@@ -0,0 +1,237 @@
+"""Sparse chunked storage for sheet cells.
+
+The grid is cut into CHUNK_SIZE x CHUNK_SIZE blocks. A block is only
+allocated when a cell inside it is written, so empty cells cost nothing.
+
+snapshot() gives an immutable view of the store in O(1). The snapshot shares
+every block with the live store; a block is copied the first time the live
+store writes to it afterwards (copy-on-write), so readers on other threads
+see a consistent sheet while editing goes on.
+
+Every write also gives the column of its block, and the whole column, a new
+version number, unique over the whole store, so caches built from them (see
+range_aggregates) can tell they changed without comparing contents.
+"""
+from itertools import count
+from types import MappingProxyType
+
+CHUNK_SHIFT = 6
+CHUNK_SIZE = 1 << CHUNK_SHIFT    # 64 x 64 cells per block
+CHUNK_MASK = CHUNK_SIZE - 1
+
+# A block keeps its cells in a dict while it is mostly empty and switches to a
+# flat list once it is filled past this point (a list is smaller at that size)
+DENSE_THRESHOLD = CHUNK_SIZE * CHUNK_SIZE // 8
+
+_versions = count(1)
+
+
+def column_label(index):
+    """0 -> A, 25 -> Z, 26 -> AA, ..."""
+    result = ""
+    col = index
+    while True:
+        result = chr(col % 26 + ord('A')) + result
+        col = col // 26 - 1
+        if col < 0:
+            break
+    return result
+
+
+def chunk_key(row, col):
+    return (row >> CHUNK_SHIFT, col >> CHUNK_SHIFT)
+
+
+def chunk_offset(row, col):
+    return ((row & CHUNK_MASK) << CHUNK_SHIFT) | (col & CHUNK_MASK)
+
+
+class Chunk:
+    __slots__ = ("cells", "count", "generation")
+
+    def __init__(self, generation=0):
+        self.cells = {}  # offset -> value while sparse, flat list once dense
+        self.count = 0
+        self.generation = generation  # store generation that owns this block
+
+    def copy(self, generation):
+        chunk = Chunk(generation)
+        chunk.cells = self.cells.copy()
+        chunk.count = self.count
+        return chunk
+
+    def get(self, offset):
+        cells = self.cells
+        if type(cells) is dict:
+            return cells.get(offset)
+        return cells[offset]
+
+    def set(self, offset, value):
+        cells = self.cells
+        if type(cells) is dict:
+            if value is None:
+                if cells.pop(offset, None) is not None:
+                    self.count -= 1
+                return
+            if offset not in cells:
+                self.count += 1
+            cells[offset] = value
+            if self.count > DENSE_THRESHOLD:
+                dense = [None] * (CHUNK_SIZE * CHUNK_SIZE)
+                for key, item in cells.items():
+                    dense[key] = item
+                self.cells = dense
+            return
+
+        old = cells[offset]
+        if old is None and value is not None:
+            self.count += 1
+        elif old is not None and value is None:
+            self.count -= 1
+        cells[offset] = value
+
+    def items(self):
+        cells = self.cells
+        if type(cells) is dict:
+            return cells.items()
+        return ((offset, value) for offset, value in enumerate(cells) if value is not None)
+
+
+class CellGrid:
+    """Read side shared by the live store and its snapshots."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks  # (chunk_row, chunk_col) -> Chunk
+
+    def __len__(self):
+        return sum(chunk.count for chunk in self._chunks.values())
+
+    def get(self, row, col, default=None):
+        chunk = self._chunks.get((row >> CHUNK_SHIFT, col >> CHUNK_SHIFT))
+        if chunk is None:
+            return default
+        value = chunk.get(((row & CHUNK_MASK) << CHUNK_SHIFT) | (col & CHUNK_MASK))
+        return default if value is None else value
+
+    def items(self):
+        """Yield (row, col, value) for every non-empty cell, block by block."""
+        for (chunk_row, chunk_col), chunk in self._chunks.items():
+            base_row = chunk_row << CHUNK_SHIFT
+            base_col = chunk_col << CHUNK_SHIFT
+            for offset, value in chunk.items():
+                yield base_row + (offset >> CHUNK_SHIFT), base_col + (offset & CHUNK_MASK), value
+
+    def items_in_range(self, top, left, bottom, right):
+        """Like items(), but only visits the blocks overlapping the rectangle."""
+        first_row, last_row = top >> CHUNK_SHIFT, bottom >> CHUNK_SHIFT
+        first_col, last_col = left >> CHUNK_SHIFT, right >> CHUNK_SHIFT
+        if (last_row - first_row + 1) * (last_col - first_col + 1) <= len(self._chunks):
+            # Small rectangle: look its blocks up instead of walking every block
+            keys = [(chunk_row, chunk_col)
+                    for chunk_row in range(first_row, last_row + 1)
+                    for chunk_col in range(first_col, last_col + 1)
+                    if (chunk_row, chunk_col) in self._chunks]
+        else:
+            keys = [(chunk_row, chunk_col) for chunk_row, chunk_col in self._chunks
+                    if first_row <= chunk_row <= last_row and first_col <= chunk_col <= last_col]
+        for key in keys:
+            chunk = self._chunks[key]
+            base_row = key[0] << CHUNK_SHIFT
+            base_col = key[1] << CHUNK_SHIFT
+            for offset, value in chunk.items():
+                row = base_row + (offset >> CHUNK_SHIFT)
+                col = base_col + (offset & CHUNK_MASK)
+                if top <= row <= bottom and left <= col <= right:
+                    yield row, col, value
+
+    def chunk(self, chunk_row, chunk_col):
+        """The block at a chunk position, or None. Read only."""
+        return self._chunks.get((chunk_row, chunk_col))
+
+    def chunk_count(self):
+        return len(self._chunks)
+
+    def chunk_rows(self, chunk_col):
+        """Chunk rows that have a block in a chunk column, unsorted."""
+        return [chunk_row for chunk_row, col in self._chunks if col == chunk_col]
+
+    def extent(self):
+        """(rows, columns) of the used area, i.e. one past the last non-empty cell."""
+        rows = cols = 0
+        for row, col, _value in self.items():
+            rows = max(rows, row + 1)
+            cols = max(cols, col + 1)
+        return rows, cols
+
+
+class CellStoreSnapshot(CellGrid):
+    """Immutable view returned by ChunkedCellStore.snapshot(). Safe to read
+    from another thread and picklable for worker processes."""
+
+    # Nothing in a snapshot changes, so every block and column keeps one version
+    column_versions = MappingProxyType({})
+    block_versions = MappingProxyType({})
+
+
+class ChunkedCellStore(CellGrid):
+    def __init__(self):
+        super().__init__({})
+        self.column_versions = {}  # column -> version of its last write
+        self.block_versions = {}   # (chunk row, column) -> version of its last write
+        self._generation = 0
+        self._shared = False  # the chunk dict itself is referenced by a snapshot
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """A writable store starting from a snapshot's contents, in O(1).
+
+        Blocks stay shared with the snapshot (and the store it came from)
+        until they are written, so e.g. a background recalculation can keep
+        its own results without touching the live sheet.
+        """
+        store = cls()
+        store._chunks = snapshot._chunks
+        store._shared = True
+        store._generation = -1   # no shared block belongs to this store yet
+        return store
+
+    def snapshot(self):
+        """O(1): the snapshot keeps the current blocks, later writes copy them first."""
+        self._generation += 1
+        self._shared = True
+        return CellStoreSnapshot(self._chunks)
+
+    def _writable(self, key):
+        if self._shared:
+            self._chunks = dict(self._chunks)
+            self._shared = False
+        chunk = self._chunks.get(key)
+        if chunk is not None and chunk.generation != self._generation:
+            chunk = self._chunks[key] = chunk.copy(self._generation)
+        return chunk
+
+    def set(self, row, col, value):
+        """Write a cell. None clears it, and a block is freed once it is empty."""
+        key = (row >> CHUNK_SHIFT, col >> CHUNK_SHIFT)
+        if value is None and key not in self._chunks:
+            return
+        chunk = self._writable(key)
+        if chunk is None:
+            chunk = self._chunks[key] = Chunk(self._generation)
+
+        chunk.set(((row & CHUNK_MASK) << CHUNK_SHIFT) | (col & CHUNK_MASK), value)
+        self.block_versions[(key[0], col)] = self.column_versions[col] = next(_versions)
+        if chunk.count == 0:
+            del self._chunks[key]
+
+    def clear(self):
+        self._chunks = {}
+        self._shared = False
+        self.block_versions = {}
+        version = next(_versions)
+        for col in self.column_versions:
+            self.column_versions[col] = version
+
+    def clear_range(self, top, left, bottom, right):
+        for (row, col, _value) in list(self.items_in_range(top, left, bottom, right)):
+            self.set(row, col, None)
@@ -0,0 +1,189 @@
+"""Columnar backing store for MergeTableModel.
+
+Columns holding mostly numbers live in contiguous int64/float64 NumPy
+arrays with a validity mask; their few text cells are kept in a side dict
+keyed by row, so typing text into a numeric column (or clearing it again)
+costs O(1). Columns that are mostly text when loaded are object arrays.
+Numeric consumers (the autofill series check) can work on the arrays
+directly instead of re-parsing cell strings.
+
+Storage is lossless: text is only typed when the number prints back as the
+same text, so "007", "1.50" or "1e3" stay text. Float columns remember
+which cells were typed as ints.
+"""
+import re
+
+import numpy as np
+
+
+INT_PATTERN = re.compile(r"[+-]?\d+\Z")
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+FLOAT_INT_MAX = 1 << 53     # ints a float column holds exactly
+
+
+def parse_number(value):
+    """Return value as an int or float, or None if it isn't a number."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return value.item() if isinstance(value, np.generic) else value
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    if not text:
+        return None
+    if INT_PATTERN.match(text):
+        return int(text)
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    # "nan"/"inf" typed into a cell are text, not numbers
+    if number != number or number in (float("inf"), float("-inf")):
+        return None
+    return number
+
+
+def exact_number(value):
+    """parse_number(), but text only counts when the number gives back the same text."""
+    number = parse_number(value)
+    if number is None or not isinstance(value, str):
+        return number
+    if isinstance(number, int):
+        return number if str(number) == value else None
+    return number if repr(number) == value else None
+
+
+def _fits_int64(number):
+    return INT64_MIN <= number <= INT64_MAX
+
+
+def _fits_float(number):
+    return not isinstance(number, int) or -FLOAT_INT_MAX <= number <= FLOAT_INT_MAX
+
+
+def _as_text(value):
+    return value if isinstance(value, str) else str(value)
+
+
+class Column:
+    __slots__ = ("kind", "values", "valid", "integral", "text")
+
+    def __init__(self, rows):
+        self.kind = "int"                         # "int", "float" or "object"
+        self.values = np.zeros(rows, dtype=np.int64)
+        self.valid = np.zeros(rows, dtype=bool)
+        self.integral = None                      # float columns: cells that were ints
+        self.text = {}                            # numeric columns: row -> text of untyped cells
+
+
+class ColumnStore:
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = [Column(rows) for _ in range(columns)]
+
+    @classmethod
+    def from_rows(cls, matrix, columns):
+        """Build the store from a list of rows, typing each column once."""
+        store = cls(len(matrix), columns)
+        for col in range(columns):
+            store.load_column(col, [row[col] for row in matrix])
+        return store
+
+    def load_column(self, col, values):
+        column = self.columns[col]
+        numbers = [exact_number(value) for value in values]
+        valid = np.array([value is not None and value != "" for value in values], dtype=bool)
+        typed = [number for number in numbers if number is not None]
+
+        column.valid = valid
+        column.integral = None
+        column.text = {}
+        if len(typed) * 2 < int(valid.sum()):
+            column.kind = "object"
+            column.values = np.array([_as_text(value) if ok else None for value, ok in zip(values, valid)],
+                                     dtype=object)
+            return
+        if all(isinstance(number, int) and _fits_int64(number) for number in typed):
+            column.kind = "int"
+            column.values = np.array([number or 0 for number in numbers], dtype=np.int64)
+        else:
+            column.kind = "float"
+            # Ints a float can't hold exactly are kept as text
+            numbers = [number if number is None or _fits_float(number) else None for number in numbers]
+            column.values = np.array([0.0 if number is None else float(number) for number in numbers], dtype=np.float64)
+            column.integral = np.array([isinstance(number, int) for number in numbers], dtype=bool)
+        column.text = {row: _as_text(values[row]) for row in np.flatnonzero(valid).tolist() if numbers[row] is None}
+
+    def get(self, row, col):
+        """Python value of a cell (int, float or str), None when empty."""
+        column = self.columns[col]
+        if not column.valid[row]:
+            return None
+        if column.kind == "object":
+            return column.values[row]
+        text = column.text.get(row)
+        if text is not None:
+            return text
+        value = column.values[row].item()
+        if column.integral is not None and column.integral[row]:
+            return int(value)
+        return value
+
+    def text(self, row, col):
+        value = self.get(row, col)
+        if value is None:
+            return ""
+        return _as_text(value)
+
+    def set(self, row, col, value):
+        column = self.columns[col]
+        if value is None or value == "":
+            if column.kind == "object":
+                column.values[row] = None
+            else:
+                column.text.pop(row, None)
+            column.valid[row] = False
+            return
+
+        if column.kind == "object":
+            column.values[row] = _as_text(value)
+            column.valid[row] = True
+            return
+
+        number = exact_number(value)
+        if column.kind == "int" and number is not None and not (isinstance(number, int) and _fits_int64(number)):
+            typed = column.values[column.valid]
+            if _fits_float(number) and not (np.abs(typed) > FLOAT_INT_MAX).any():
+                # Once per column: it stays a float column
+                column.kind = "float"
+                column.integral = column.valid.copy()
+                column.values = column.values.astype(np.float64)
+            else:
+                number = None   # no exact typed home for it, keep it as text
+        elif column.kind == "float" and number is not None and not _fits_float(number):
+            number = None
+
+        column.valid[row] = True
+        if number is None:
+            column.text[row] = _as_text(value)
+            return
+        column.text.pop(row, None)
+        column.values[row] = number
+        if column.integral is not None:
+            column.integral[row] = isinstance(number, int)
+
+    def is_numeric_range(self, top, left, bottom, right):
+        """True if every cell of the rectangle holds a number."""
+        for col in range(left, right + 1):
+            column = self.columns[col]
+            if column.kind == "object" or not column.valid[top:bottom + 1].all():
+                return False
+            if column.text and any(top <= row <= bottom for row in column.text):
+                return False
+        return True
+
+    def nbytes(self):
+        return sum(column.values.nbytes + column.valid.nbytes + (0 if column.integral is None else column.integral.nbytes)
+                   for column in self.columns)
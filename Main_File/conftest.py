@@ -0,0 +1,9 @@
+# The view tests need a QApplication, and it has to exist before any test
+# module creates a plain QCoreApplication
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication  # noqa: E402
+
+app = QApplication.instance() or QApplication([])
@@ -0,0 +1,253 @@
+"""Precedents/dependents graph of the formula cells of a sheet.
+
+Every formula cell remembers the rectangles it reads (its precedents).
+Single-cell references are kept in an exact index and ranges are filed per
+column and band of rows, so "which formulas read this cell or range" is a
+lookup, not a scan of all formulas. A range taller than TALL_ROWS
+(SUM(A1:A500000)) is filed once per column instead of once per band, like
+the tall rectangles in format_layers. A range wider than WIDE_COLUMNS
+(SUM(A1:BZ1)) is filed once per band of rows instead; only the rare range
+that is both wide and tall is kept in a short list that is always checked.
+For single-cell lookups each bucket's ranges are also kept sorted by their
+bottom row (built on first use), so a lookup skips the ranges that end above
+the cell instead of testing the whole bucket.
+
+recalc_order() gives the transitive dependents of an edit in topological
+order, plus the cells caught in a reference cycle. The graph remembers the
+cyclic cells, so a formula reading one gets #CIRCULAR! whether it is
+recomputed with the cycle or on its own.
+"""
+from bisect import bisect_right
+from collections import deque
+
+from cell_store import CHUNK_SHIFT
+
+
+TALL_ROWS = 1 << (2 * CHUNK_SHIFT)
+WIDE_COLUMNS = 1 << CHUNK_SHIFT
+
+
+def _intersects(rect, top, left, bottom, right):
+    return rect[0] <= bottom and rect[2] >= top and rect[1] <= right and rect[3] >= left
+
+
+def _wide_and_tall(rect):
+    return rect[3] - rect[1] + 1 > WIDE_COLUMNS and rect[2] - rect[0] + 1 > TALL_ROWS
+
+
+class DependencyGraph:
+    def __init__(self):
+        self.formulas = {}       # (row, col) -> compiled Formula
+        self._precedents = {}    # (row, col) -> rectangles the formula reads
+        self._cells = {}         # (row, col) -> {formula cell, ...} for single-cell references
+        self._blocks = {}        # (row band, col) -> {formula cell, ...}
+        self._columns = {}       # col -> {formula cell, ...} for tall rectangles
+        self._rows = {}          # row band -> {formula cell, ...} for wide rectangles
+        self._wide = set()       # formula cells reading a rectangle both wide and tall
+        self._spans = {}         # id(index), key -> ([-bottom, ...], [(top, left, right, cell), ...]), lowest bottom first
+        self.cyclic = set()      # cells in, or only reachable through, a cycle at the last recalc_order
+
+
+    def __len__(self):
+        return len(self.formulas)
+
+    def __contains__(self, cell):
+        return cell in self.formulas
+
+    def _buckets(self, rect):
+        # Index buckets of a rectangle; none for one both wide and tall (see _wide)
+        top, left, bottom, right = rect
+        if top == bottom and left == right:
+            yield self._cells, (top, left)
+        elif right - left + 1 > WIDE_COLUMNS:
+            if bottom - top + 1 <= TALL_ROWS:
+                for row_band in range(top >> CHUNK_SHIFT, (bottom >> CHUNK_SHIFT) + 1):
+                    yield self._rows, row_band
+        elif bottom - top + 1 > TALL_ROWS:
+            for col in range(left, right + 1):
+                yield self._columns, col
+        else:
+            for row_band in range(top >> CHUNK_SHIFT, (bottom >> CHUNK_SHIFT) + 1):
+                for col in range(left, right + 1):
+                    yield self._blocks, (row_band, col)
+
+    def set_formula(self, cell, formula):
+        """Register or replace the formula of a cell."""
+        self.remove(cell)
+        self.formulas[cell] = formula
+        rects = self._precedents[cell] = formula.references
+        for rect in rects:
+            if _wide_and_tall(rect):
+                self._wide.add(cell)
+                self._spans.pop((id(self._wide), None), None)
+            for index, key in self._buckets(rect):
+                index.setdefault(key, set()).add(cell)
+                self._spans.pop((id(index), key), None)
+
+    def remove(self, cell):
+        if self.formulas.pop(cell, None) is None:
+            return
+        self._wide.discard(cell)
+        self.cyclic.discard(cell)
+        for rect in self._precedents.pop(cell):
+            if _wide_and_tall(rect):
+                self._spans.pop((id(self._wide), None), None)
+            for index, key in self._buckets(rect):
+                self._spans.pop((id(index), key), None)
+                cells = index.get(key)
+                if cells is not None:
+                    cells.discard(cell)
+                    if not cells:
+                        del index[key]
+
+    def clear(self):
+        self.formulas.clear()
+        self._precedents.clear()
+        self._cells.clear()
+        self._blocks.clear()
+        self._columns.clear()
+        self._rows.clear()
+        self._wide.clear()
+        self._spans.clear()
+        self.cyclic.clear()
+
+    def formulas_in(self, top, left, bottom, right):
+        """Formula cells inside a rectangle."""
+        if (bottom - top + 1) * (right - left + 1) <= len(self.formulas):
+            formulas = self.formulas
+            return [(row, col) for row in range(top, bottom + 1) for col in range(left, right + 1)
+                    if (row, col) in formulas]
+        return [(row, col) for row, col in self.formulas
+                if top <= row <= bottom and left <= col <= right]
+
+    def dependents(self, top, left, bottom, right):
+        """Formula cells that directly read any cell of the rectangle."""
+        if top == bottom and left == right:
+            return self._cell_dependents(top, left)
+        if (bottom - top + 1) * (right - left + 1) <= len(self._cells):
+            index = self._cells
+            found = [cell for row in range(top, bottom + 1) for col in range(left, right + 1)
+                     for cell in index.get((row, col), ())]
+        else:
+            found = [cell for (row, col), cells in self._cells.items()
+                     if top <= row <= bottom and left <= col <= right for cell in cells]
+        first_band, last_band = top >> CHUNK_SHIFT, bottom >> CHUNK_SHIFT
+        candidates = set(self._wide)
+        blocks = self._blocks
+        if (last_band - first_band + 1) * (right - left + 1) <= len(blocks):
+            for row_band in range(first_band, last_band + 1):
+                for col in range(left, right + 1):
+                    cells = blocks.get((row_band, col))
+                    if cells:
+                        candidates.update(cells)
+        else:
+            # A huge rectangle (a whole column): walk the index instead
+            for (row_band, col), cells in blocks.items():
+                if first_band <= row_band <= last_band and left <= col <= right:
+                    candidates.update(cells)
+        if right - left + 1 <= len(self._columns):
+            for col in range(left, right + 1):
+                cells = self._columns.get(col)
+                if cells:
+                    candidates.update(cells)
+        else:
+            for col, cells in self._columns.items():
+                if left <= col <= right:
+                    candidates.update(cells)
+        if last_band - first_band + 1 <= len(self._rows):
+            for row_band in range(first_band, last_band + 1):
+                cells = self._rows.get(row_band)
+                if cells:
+                    candidates.update(cells)
+        else:
+            for row_band, cells in self._rows.items():
+                if first_band <= row_band <= last_band:
+                    candidates.update(cells)
+
+        precedents = self._precedents
+        result = set(cell for cell in candidates
+                     if any(_intersects(rect, top, left, bottom, right) for rect in precedents[cell]))
+        if found:
+            result.update(found)
+        return list(result)
+
+    def _cell_dependents(self, row, col):
+        # The common case, a single cell, without the rectangle bookkeeping
+        result = set(self._cells.get((row, col), ()))
+        band = row >> CHUNK_SHIFT
+        for index, key in ((self._blocks, (band, col)), (self._columns, col), (self._rows, band), (self._wide, None)):
+            if key in index if key is not None else index:
+                ends, spans = self._sorted_spans(index, key)
+                # Only the ranges ending at or below the row can hold it
+                result.update(cell for top, left, right, cell in spans[:bisect_right(ends, -row)]
+                              if top <= row and left <= col <= right)
+        return list(result)
+
+    def _sorted_spans(self, index, key):
+        found = self._spans.get((id(index), key))
+        if found is None:
+            cells = index if key is None else index[key]
+            precedents = self._precedents
+            spans = sorted((-rect[2], rect[0], rect[1], rect[3], cell) for cell in cells for rect in precedents[cell]
+                           if rect[0] != rect[2] or rect[1] != rect[3])
+            found = self._spans[(id(index), key)] = ([span[0] for span in spans], [span[1:] for span in spans])
+        return found
+
+    def recalc_order(self, rects, roots=(), edges=None):
+        """Formula cells to recompute after the rectangles changed, in topological order.
+
+        `roots` are formula cells that must be recomputed themselves (newly
+        entered ones). Returns (order, cyclic): cyclic are the cells that are
+        in, or only reachable through, a reference cycle. If an `edges` dict
+        is passed it is filled with cell -> direct dependents.
+
+        A cell that reads a cyclic cell outside this recalculation is cyclic
+        too, like it would be when the whole sheet is recomputed.
+        """
+        affected = set(cell for cell in roots if cell in self.formulas)
+        queue = deque(affected)
+        for rect in rects:
+            for cell in self.dependents(*rect):
+                if cell not in affected:
+                    affected.add(cell)
+                    queue.append(cell)
+
+        # Walk the dependents, remembering the edges inside the affected set
+        if edges is None:
+            edges = {}
+        while queue:
+            cell = queue.popleft()
+            row, col = cell
+            found = edges[cell] = self.dependents(row, col, row, col)
+            for dependent in found:
+                if dependent not in affected:
+                    affected.add(dependent)
+                    queue.append(dependent)
+
+        # Kahn's algorithm; whatever never reaches in-degree 0 is part of a cycle
+        indegree = dict.fromkeys(affected, 0)
+        for cell in affected:
+            for dependent in edges[cell]:
+                indegree[dependent] += 1
+        ready = deque(cell for cell, count in indegree.items() if count == 0)
+        order = []
+        outside = set()   # cells reading a cyclic cell left out of this recalculation
+        for row, col in self.cyclic:
+            if (row, col) not in affected:
+                outside.update(self._cell_dependents(row, col))
+        cyclic = []
+        while ready:
+            cell = ready.popleft()
+            if cell in outside:
+                # Its dependents keep their in-degree and end up cyclic as well
+                cyclic.append(cell)
+                continue
+            order.append(cell)
+            for dependent in edges[cell]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+        cyclic.extend(cell for cell, count in indegree.items() if count > 0)
+        self.cyclic.difference_update(order)
+        self.cyclic.update(cyclic)
+        return order, cyclic
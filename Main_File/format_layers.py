@@ -0,0 +1,132 @@
+"""Range based formatting: a list of styled rectangles over the sheet.
+
+Formatting a cell, a block, a whole row or a whole column adds one rectangle
+holding the changed attributes. A cell's effective style is the default
+style with every rectangle covering it applied in the order they were added,
+so later formats win, like Excel's cell/row/column formats.
+
+Rectangles are found through a bucket index instead of a scan:
+short rectangles are filed under each band of BAND rows they cross, tall ones
+(whole columns and the like) under each band of BAND columns they cross.
+A whole column therefore costs one index entry however long the sheet is.
+"""
+from style_table import DEFAULT_STYLE
+
+
+BAND_SHIFT = 6
+BAND = 1 << BAND_SHIFT          # rows/columns per index bucket
+TALL_ROWS = BAND * BAND         # taller rectangles are indexed by column band
+
+
+class FormatRect:
+    __slots__ = ("seq", "top", "left", "bottom", "right", "changes")
+
+    def __init__(self, seq, top, left, bottom, right, changes):
+        self.seq = seq
+        self.top = top
+        self.left = left
+        self.bottom = bottom
+        self.right = right
+        self.changes = changes   # tuple of (attribute, value) pairs
+
+    def contains(self, row, column):
+        return self.top <= row <= self.bottom and self.left <= column <= self.right
+
+    def covers(self, other):
+        return (self.top <= other.top and self.bottom >= other.bottom
+                and self.left <= other.left and self.right >= other.right)
+
+
+class FormatLayers:
+    def __init__(self, styles):
+        self.styles = styles          # StyleTable the resolved styles are interned in
+        self._rects = {}              # seq -> FormatRect, in application order
+        self._row_bands = {}          # row band -> [seq, ...] for short rectangles
+        self._column_bands = {}       # column band -> [seq, ...] for tall rectangles
+        self._next_seq = 1
+        self._stale = 0               # index entries pointing at removed rectangles
+        self._resolved = {}           # tuple of covering seqs -> style id
+
+    def __len__(self):
+        return len(self._rects)
+
+    def add(self, top, left, bottom, right, **changes):
+        """Format a rectangle. Costs O(bands crossed), not O(cells).
+
+        Returns the new FormatRect and the older ones it replaced (for undo).
+        """
+        if not changes:
+            return None, []
+        rect = FormatRect(self._next_seq, top, left, bottom, right, tuple(sorted(changes.items())))
+        self._next_seq += 1
+
+        # Older rectangles that are hidden completely by this one can go
+        keys = set(changes)
+        removed = [old for old in self._rects.values()
+                   if rect.covers(old) and keys.issuperset(name for name, _value in old.changes)]
+        for old in removed:
+            self.remove(old)
+
+        self.restore(rect)
+        return rect, removed
+
+    def remove(self, rect):
+        if self._rects.pop(rect.seq, None) is None:
+            return
+        self._resolved.clear()
+        self._stale += 1
+        if self._stale > len(self._rects):
+            self._rebuild_index()
+
+    def restore(self, rect):
+        """Put back a rectangle removed earlier. It keeps its place in the precedence order."""
+        self._rects[rect.seq] = rect
+        self._index(rect)
+        self._resolved.clear()
+
+    def clear(self):
+        self._rects.clear()
+        self._row_bands.clear()
+        self._column_bands.clear()
+        self._resolved.clear()
+        self._stale = 0
+
+    def _index(self, rect):
+        if rect.bottom - rect.top + 1 > TALL_ROWS:
+            bands, first, last = self._column_bands, rect.left >> BAND_SHIFT, rect.right >> BAND_SHIFT
+        else:
+            bands, first, last = self._row_bands, rect.top >> BAND_SHIFT, rect.bottom >> BAND_SHIFT
+        for band in range(first, last + 1):
+            bands.setdefault(band, []).append(rect.seq)
+
+    def _rebuild_index(self):
+        self._row_bands = {}
+        self._column_bands = {}
+        self._stale = 0
+        for rect in self._rects.values():
+            self._index(rect)
+
+    def covering(self, row, column):
+        """Rectangles covering a cell, oldest first."""
+        rects = self._rects
+        seqs = set(self._row_bands.get(row >> BAND_SHIFT, ()))
+        seqs.update(self._column_bands.get(column >> BAND_SHIFT, ()))
+        # A restored rectangle can have a second, stale index entry; the set drops it
+        found = [rects[seq] for seq in sorted(seqs) if seq in rects and rects[seq].contains(row, column)]
+        return found
+
+    def style_id_at(self, row, column):
+        found = self.covering(row, column)
+        if not found:
+            return 0
+        key = tuple(rect.seq for rect in found)
+        style_id = self._resolved.get(key)
+        if style_id is None:
+            attributes = DEFAULT_STYLE._asdict()
+            for rect in found:
+                attributes.update(rect.changes)
+            style_id = self._resolved[key] = self.styles.intern(DEFAULT_STYLE._make(attributes.values()))
+        return style_id
+
+    def rects(self):
+        return list(self._rects.values())
@@ -0,0 +1,781 @@
+"""Formula engine: tokenizer, parser and compiler for cell formulas.
+
+compile_formula_at("=SUM(A1:A10)*2", row, col) parses the text once into a
+small AST and turns that into nested Python closures. References are kept
+relative to the formula's own cell unless they are absolute ($A$1, A$1, $A1),
+i.e. in R1C1 form, so =A1*B1 in row 1 and =A2*B2 in row 2 are the same
+FormulaTemplate. Templates are cached by their tokens with the references
+in R1C1 form (see template_key): filling a formula
+down 100k rows compiles it once, and every cell only keeps the shared
+template and its own position (a Formula).
+
+Formulas read cells through a CellSource, not through the Qt model, so the
+engine can also run on snapshots, in worker processes and in headless tools.
+
+Supported: numbers, "text", TRUE/FALSE, error values, A1 and $A$1
+references, A1:B9 ranges, + - * / ^ % & = <> < > <= >= and SUM, AVERAGE,
+COUNT, MAX, MIN.
+"""
+from collections import OrderedDict
+import math
+import re
+import sys
+
+from cell_store import column_label
+from column_store import parse_number
+
+
+COMPILED_CACHE_SIZE = 4096   # distinct formula templates kept compiled
+MEMO_MAX_BYTES = 16 << 20    # default memory bound of a RangeMemo
+
+
+class FormulaError(Exception):
+    """The text is not a valid formula."""
+
+
+class CellError(Exception):
+    """An Excel error value (#DIV/0!, #VALUE!, ...) raised while evaluating.
+    Formula.evaluate() turns it into the error text shown in the cell."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+DIV0 = "#DIV/0!"
+VALUE = "#VALUE!"
+NAME = "#NAME?"
+NUM = "#NUM!"
+REF = "#REF!"             # a reference moved off the sheet, e.g. =A1 filled up from row 1
+CIRCULAR = "#CIRCULAR!"   # shown by cells caught in a reference cycle
+ERROR_CODES = (DIV0, VALUE, NAME, NUM, CIRCULAR, REF, "#N/A")
+
+
+# Tokenizer
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+      (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<string>"(?:[^"]|"")*")
+    | (?P<error>\#(?:DIV/0!|VALUE!|NAME\?|NUM!|REF!|N/A|CIRCULAR!))
+    | (?P<ref>\$?[A-Za-z]{1,3}\$?[0-9]+)(?![A-Za-z0-9_.(])
+    | (?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+    | (?P<op><>|<=|>=|[-+*/^&=<>%:(),])
+    )""", re.VERBOSE)
+
+REF_PATTERN = re.compile(r"(\$?)([A-Za-z]{1,3})(\$?)([0-9]+)$")
+
+# The references of a formula text, skipping strings and names the way the
+# tokenizer does (used to rewrite references without parsing)
+REFERENCE_SCAN = re.compile(r"""
+      (?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?
+    | "(?:[^"]|"")*"
+    | (?P<ref>\$?[A-Za-z]{1,3}\$?[0-9]+(?::\$?[A-Za-z]{1,3}\$?[0-9]+)?)(?![A-Za-z0-9_.(])
+    | [A-Za-z_][A-Za-z0-9_.]*
+    """, re.VERBOSE)
+
+
+def column_index(letters):
+    """A -> 0, Z -> 25, AA -> 26, ..."""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + (ord(char) - ord('A') + 1)
+    return index - 1
+
+
+def parse_ref(text):
+    """'B3' -> (2, 1) as (row, column), 0 based. '$B$3' gives the same."""
+    row, col, _row_absolute, _col_absolute = parse_ref_parts(text)
+    return row, col
+
+
+def parse_ref_parts(text):
+    """'B$3' -> (2, 1, True, False): row, column and whether each is absolute."""
+    match = REF_PATTERN.match(text)
+    if not match or int(match.group(4)) < 1:
+        raise FormulaError("bad reference %r" % text)
+    return int(match.group(4)) - 1, column_index(match.group(2)), bool(match.group(3)), bool(match.group(1))
+
+
+def shift_formula(text, rows, cols):
+    """Formula text copied `rows` down and `cols` right: relative references
+    move along, absolute parts stay. A reference pushed off the sheet
+    becomes #REF!, like Excel."""
+    def shift(match):
+        reference = match.group("ref")
+        if reference is None:
+            return match.group(0)
+        parts = []
+        for end in reference.split(":"):
+            ref_row, ref_col, row_absolute, col_absolute = parse_ref_parts(end)
+            if not row_absolute:
+                ref_row += rows
+            if not col_absolute:
+                ref_col += cols
+            if ref_row < 0 or ref_col < 0:
+                return REF
+            parts.append("%s%s%s%d" % ("$" if col_absolute else "", column_label(ref_col),
+                                       "$" if row_absolute else "", ref_row + 1))
+        return ":".join(parts)
+    try:
+        return REFERENCE_SCAN.sub(shift, text)
+    except FormulaError:
+        return text
+
+
+def tokenize(text):
+    """Split formula text (without the leading '=') into (kind, value) tokens."""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if not match or match.end() == position:
+            raise FormulaError("unexpected %r at %d" % (text[position:position + 10], position))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = value[1:-1].replace('""', '"')
+        elif kind == "name":
+            value = value.upper()
+        tokens.append((kind, value))
+        position = match.end()
+    tokens.append(("end", None))
+    return tokens
+
+
+# Parser, Excel precedence from loosest to tightest:
+#   comparison, &, + -, * /, ^, unary - +, %, range ':'
+# Nodes are tuples: ("num", v) ("str", s) ("bool", b) ("err", code)
+# ("ref", row, col, row_abs, col_abs)
+# ("range", top, left, bottom, right, top_abs, left_abs, bottom_abs, right_abs)
+# ("neg", x) ("pct", x) ("bin", op, a, b) ("call", NAME, (args, ...))
+# A reference row/column that is not absolute is stored relative to the
+# formula's cell (R1C1 style), so the tree does not depend on where it is.
+
+COMPARISONS = ("=", "<>", "<", ">", "<=", ">=")
+
+
+class Parser:
+    def __init__(self, tokens, row=0, col=0):
+        self.tokens = tokens
+        self.position = 0
+        self.row = row    # the formula's cell, relative references are stored from here
+        self.col = col
+
+    def peek(self):
+        return self.tokens[self.position]
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, value):
+        kind, found = self.take()
+        if kind != "op" or found != value:
+            raise FormulaError("expected %r" % value)
+
+    def parse(self):
+        node = self.comparison()
+        if self.peek()[0] != "end":
+            raise FormulaError("unexpected %r" % (self.peek()[1],))
+        return node
+
+    def binary(self, operators, operand):
+        node = operand()
+        while self.peek()[0] == "op" and self.peek()[1] in operators:
+            op = self.take()[1]
+            node = ("bin", op, node, operand())
+        return node
+
+    def comparison(self):
+        return self.binary(COMPARISONS, self.concat)
+
+    def concat(self):
+        return self.binary(("&",), self.additive)
+
+    def additive(self):
+        return self.binary(("+", "-"), self.term)
+
+    def term(self):
+        return self.binary(("*", "/"), self.power)
+
+    def power(self):
+        return self.binary(("^",), self.unary)
+
+    def unary(self):
+        kind, value = self.peek()
+        if kind == "op" and value in ("-", "+"):
+            self.take()
+            operand = self.unary()
+            return ("neg", operand) if value == "-" else operand
+        return self.percent()
+
+    def percent(self):
+        node = self.primary()
+        while self.peek() == ("op", "%"):
+            self.take()
+            node = ("pct", node)
+        return node
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == "number":
+            number = float(value)
+            return ("num", int(number) if number.is_integer() and "." not in value and "e" not in value.lower() else number)
+        if kind == "string":
+            return ("str", value)
+        if kind == "error":
+            return ("err", value)
+        if kind == "ref":
+            row, col, row_absolute, col_absolute = parse_ref_parts(value)
+            if self.peek() == ("op", ":"):
+                self.take()
+                kind, end = self.take()
+                if kind != "ref":
+                    raise FormulaError("bad range end")
+                end_row, end_col, end_row_absolute, end_col_absolute = parse_ref_parts(end)
+                # Corners ordered as seen from this cell
+                if end_row < row:
+                    row, end_row, row_absolute, end_row_absolute = end_row, row, end_row_absolute, row_absolute
+                if end_col < col:
+                    col, end_col, col_absolute, end_col_absolute = end_col, col, end_col_absolute, col_absolute
+                return ("range", self.place(row, row_absolute, self.row), self.place(col, col_absolute, self.col),
+                        self.place(end_row, end_row_absolute, self.row), self.place(end_col, end_col_absolute, self.col),
+                        row_absolute, col_absolute, end_row_absolute, end_col_absolute)
+            return ("ref", self.place(row, row_absolute, self.row), self.place(col, col_absolute, self.col),
+                    row_absolute, col_absolute)
+        if kind == "name":
+            if self.peek() == ("op", "("):
+                self.take()
+                args = []
+                if self.peek() != ("op", ")"):
+                    args.append(self.comparison())
+                    while self.peek() == ("op", ","):
+                        self.take()
+                        args.append(self.comparison())
+                self.expect(")")
+                return ("call", value, tuple(args))
+            if value in ("TRUE", "FALSE"):
+                return ("bool", value == "TRUE")
+            return ("name", value)
+        if kind == "op" and value == "(":
+            node = self.comparison()
+            self.expect(")")
+            return node
+        raise FormulaError("unexpected %r" % (value,))
+
+    @staticmethod
+    def place(position, absolute, origin):
+        return position if absolute else position - origin
+
+
+def parse(text, row=0, col=0):
+    """Formula text, with or without the leading '=', written in cell (row, col) to an AST."""
+    text = text.strip()
+    if text.startswith("="):
+        text = text[1:]
+    if not text:
+        raise FormulaError("empty formula")
+    return Parser(tokenize(text), row, col).parse()
+
+
+# Values
+
+def cell_value(text):
+    """Cell text as a formula sees it: None when empty, a number when it parses as one."""
+    if text is None or text == "":
+        return None
+    if not isinstance(text, str):
+        return text
+    number = parse_number(text)
+    return text if number is None else number
+
+
+def format_value(value):
+    """A computed value as cell text."""
+    if value is None:
+        return ""
+    if value is True or value is False:
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return "%.15g" % value
+    return str(value)
+
+
+def to_number(value):
+    """Coercion used by operators and literal function arguments."""
+    if value is None:
+        return 0
+    if value is True or value is False:
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    number = parse_number(value)
+    if number is None:
+        # An error shown in a referenced cell passes through unchanged
+        raise CellError(value if value in ERROR_CODES else VALUE)
+    return number
+
+
+def error_checked(value):
+    """value, unless it is an error shown in a referenced cell: that one is raised."""
+    if isinstance(value, str) and value in ERROR_CODES:
+        raise CellError(value)
+    return value
+
+
+def numbers_in(values):
+    """The numbers among referenced cell values; text, booleans and blanks are skipped."""
+    numbers = []
+    for value in values:
+        if isinstance(value, (int, float)):
+            if value is not True and value is not False:
+                numbers.append(value)
+        elif value in ERROR_CODES:
+            raise CellError(value)
+    return numbers
+
+
+# Partial aggregate of some numbers: (total, count, low, high), low/high are
+# None when count is 0. Every function below is computed from one of these,
+# so a range can be reduced block by block and the pieces combined.
+NO_NUMBERS = (0, 0, None, None)
+
+
+def stats_of(numbers):
+    if not numbers:
+        return NO_NUMBERS
+    return sum(numbers), len(numbers), min(numbers), max(numbers)
+
+
+def literal_stats(value, skip_text):
+    """Stats of a non-reference argument. COUNT (skip_text) leaves out text
+    that isn't a number, the other functions give #VALUE! for it."""
+    if skip_text and isinstance(value, str) and value not in ERROR_CODES and parse_number(value) is None:
+        return NO_NUMBERS
+    return stats_of([to_number(value)])
+
+
+def combine_stats(first, second):
+    if not second[1]:
+        return first
+    if not first[1]:
+        return second
+    return (first[0] + second[0], first[1] + second[1],
+            min(first[2], second[2]), max(first[3], second[3]))
+
+
+class CellSource:
+    """What a compiled formula reads cells through.
+
+    value() is one cell: None for empty, a number or text. range_values()
+    yields the non-empty values of a rectangle; the default loops over
+    value(), sources backed by a sparse store should only visit stored cells.
+    range_stats() reduces a rectangle for the aggregate functions; sources
+    that can do it faster than Python (see range_aggregates) override it.
+    Sources that can tell when a rectangle changed return a version from
+    range_version() and set `memo`, so a range many formulas aggregate is
+    reduced once per change (see RangeMemo).
+    """
+    memo = None
+
+    def range_version(self, top, left, bottom, right):
+        """Something that changes whenever a cell of the rectangle does, or None."""
+        return None
+
+    def value(self, row, col):
+        raise NotImplementedError
+
+    def range_values(self, top, left, bottom, right):
+        value = self.value
+        for row in range(top, bottom + 1):
+            for col in range(left, right + 1):
+                found = value(row, col)
+                if found is not None:
+                    yield found
+
+    def range_stats(self, top, left, bottom, right):
+        return stats_of(numbers_in(self.range_values(top, left, bottom, right)))
+
+
+class RangeMemo:
+    """LRU cache of range aggregates, each entry valid for one version of its range.
+
+    10k cells computing AVERAGE(B1:B50000) reduce B1:B50000 once; the next
+    lookup after a cell of it changed sees another version and reduces it
+    again. Every function is finished from the same aggregate (see FUNCTIONS),
+    so SUM and AVERAGE of a range share an entry. Errors in the range are
+    remembered too. Entries are dropped least recently used first once their
+    estimated size passes max_bytes.
+    """
+
+    def __init__(self, max_bytes=MEMO_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # rect -> (version, stats or CellError, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self, source, rect):
+        version = source.range_version(*rect)
+        if version is None:
+            return source.range_stats(*rect)
+        entries = self._entries
+        entry = entries.get(rect)
+        if entry is not None and entry[0] == version:
+            entries.move_to_end(rect)
+            self.hits += 1
+            found = entry[1]
+        else:
+            self.misses += 1
+            try:
+                found = source.range_stats(*rect)
+            except CellError as error:
+                found = error
+            if entry is not None:
+                self.bytes -= entry[2]
+            size = sys.getsizeof(rect) + sys.getsizeof(version) + sys.getsizeof(found) + 64
+            entries[rect] = (version, found, size)
+            entries.move_to_end(rect)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(entries) > 1:
+                _rect, (_version, _found, old_size) = entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+        if isinstance(found, CellError):
+            raise found
+        return found
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+
+def range_stats(source, rect):
+    """source.range_stats(), through the source's memo if it has one."""
+    memo = source.memo
+    if memo is None:
+        return source.range_stats(*rect)
+    return memo.stats(source, rect)
+
+
+class TextSource(CellSource):
+    """CellSource over cell text, e.g. TextSource(model.cell_text, model.items_in_range)
+    or TextSource(snapshot.text, snapshot.items_in_range)."""
+
+    def __init__(self, text_at, items_in_range=None):
+        self.text_at = text_at
+        self.items_in_range = items_in_range
+
+    def value(self, row, col):
+        return cell_value(self.text_at(row, col))
+
+    def range_values(self, top, left, bottom, right):
+        if self.items_in_range is None:
+            return super().range_values(top, left, bottom, right)
+        return (cell_value(text) for _row, _col, text in self.items_in_range(top, left, bottom, right))
+
+
+# Functions: each gets the combined stats of its arguments (references
+# count their numbers only, other arguments are coerced with to_number)
+
+def _average(stats):
+    if not stats[1]:
+        raise CellError(DIV0)
+    return stats[0] / stats[1]
+
+
+FUNCTIONS = {
+    "SUM": lambda stats: stats[0],
+    "AVERAGE": _average,
+    "COUNT": lambda stats: stats[1],
+    "MAX": lambda stats: stats[3] if stats[1] else 0,
+    "MIN": lambda stats: stats[2] if stats[1] else 0,
+}
+
+
+# Compiler: AST -> closure taking a CellSource
+
+def _compare(op, left, right):
+    left, right = error_checked(left), error_checked(right)
+    if isinstance(left, str) and isinstance(right, str):
+        left, right = left.lower(), right.lower()
+    elif not (isinstance(left, str) or isinstance(right, str)):
+        left, right = to_number(left), to_number(right)
+    else:
+        # Excel orders numbers before text
+        left, right = isinstance(left, str), isinstance(right, str)
+    if op == "=":
+        return left == right
+    if op == "<>":
+        return left != right
+    if op == "<":
+        return left < right
+    if op == ">":
+        return left > right
+    if op == "<=":
+        return left <= right
+    return left >= right
+
+
+def _divide(left, right):
+    if right == 0:
+        raise CellError(DIV0)
+    return left / right
+
+
+def _power(left, right):
+    # In floats: an int power can grow without bound (and take forever)
+    try:
+        result = float(left) ** right
+    except (OverflowError, ZeroDivisionError):
+        raise CellError(NUM)
+    if isinstance(result, complex):
+        raise CellError(NUM)
+    return result
+
+
+def finite(value):
+    """value, unless it is a number a cell can't hold (inf, nan, beyond a float): #NUM!."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            if not math.isfinite(value):
+                raise CellError(NUM)
+        except OverflowError:
+            raise CellError(NUM)
+    return value
+
+
+ARITHMETIC = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": _divide,
+    "^": _power,
+}
+
+
+def _error(code):
+    def run(source, row, col):
+        raise CellError(code)
+    return run
+
+
+# A reference row (or column) is constant + factor * the formula's own row:
+# factor 0 for an absolute one, 1 for a relative one (constant is the offset)
+
+def _cell_at(node):
+    """(row, col) of a "ref" node -> constants and factors."""
+    return node[1], 0 if node[3] else 1, node[2], 0 if node[4] else 1
+
+
+def _rect_at(node, row, col):
+    """(top, left, bottom, right) of a "range" node for a formula in (row, col)."""
+    top = node[1] if node[5] else node[1] + row
+    left = node[2] if node[6] else node[2] + col
+    bottom = node[3] if node[7] else node[3] + row
+    right = node[4] if node[8] else node[4] + col
+    # Mixed absolute/relative corners can cross over when moved
+    if bottom < top:
+        top, bottom = bottom, top
+    if right < left:
+        left, right = right, left
+    return top, left, bottom, right
+
+
+def compile_node(node):
+    """AST -> closure run(source, row, col), (row, col) being the formula's cell."""
+    kind = node[0]
+    if kind in ("num", "str", "bool"):
+        constant = node[1]
+        return lambda source, row, col: constant
+    if kind == "err":
+        return _error(node[1])
+    if kind == "ref":
+        row_offset, row_factor, col_offset, col_factor = _cell_at(node)
+        return lambda source, row, col: source.value(row_offset + row_factor * row, col_offset + col_factor * col)
+    if kind == "range":
+        # A range only makes sense as a function argument
+        return _error(VALUE)
+    if kind == "name":
+        return _error(NAME)
+    if kind == "neg":
+        operand = compile_node(node[1])
+        return lambda source, row, col: -to_number(operand(source, row, col))
+    if kind == "pct":
+        operand = compile_node(node[1])
+        return lambda source, row, col: to_number(operand(source, row, col)) / 100
+    if kind == "bin":
+        op = node[1]
+        left, right = compile_node(node[2]), compile_node(node[3])
+        if op == "&":
+            return lambda source, row, col: (format_value(error_checked(left(source, row, col)))
+                                             + format_value(error_checked(right(source, row, col))))
+        if op in COMPARISONS:
+            return lambda source, row, col: _compare(op, left(source, row, col), right(source, row, col))
+        func = ARITHMETIC[op]
+        return lambda source, row, col: finite(func(to_number(left(source, row, col)),
+                                                    to_number(right(source, row, col))))
+    if kind == "call":
+        return compile_call(node[1], node[2])
+    raise FormulaError("unknown node %r" % (kind,))
+
+
+def compile_call(name, args):
+    func = FUNCTIONS.get(name)
+    if func is None:
+        return _error(NAME)
+
+    collectors = []
+    for arg in args:
+        if arg[0] == "range":
+            collectors.append(lambda source, row, col, arg=arg: range_stats(source, _rect_at(arg, row, col)))
+        elif arg[0] == "ref":
+            cell = _cell_at(arg)
+            collectors.append(lambda source, row, col, cell=cell: stats_of(numbers_in(
+                (source.value(cell[0] + cell[1] * row, cell[2] + cell[3] * col),))))
+        else:
+            operand = compile_node(arg)
+            collectors.append(lambda source, row, col, operand=operand: literal_stats(
+                operand(source, row, col), name == "COUNT"))
+
+    if len(collectors) == 1:
+        collect = collectors[0]
+        return lambda source, row, col: func(collect(source, row, col))
+
+    def run(source, row, col):
+        stats = NO_NUMBERS
+        for collect in collectors:
+            stats = combine_stats(stats, collect(source, row, col))
+        return func(stats)
+    return run
+
+
+def supported(node):
+    """False when the tree uses a function or name the engine doesn't know
+    (it would only ever give #NAME? here, e.g. IF or VLOOKUP)."""
+    kind = node[0]
+    if kind == "name":
+        return False
+    if kind == "call":
+        return node[1] in FUNCTIONS and all(supported(arg) for arg in node[2])
+    if kind in ("neg", "pct"):
+        return supported(node[1])
+    if kind == "bin":
+        return supported(node[2]) and supported(node[3])
+    return True
+
+
+def references(node, row=0, col=0, found=None):
+    """Every cell or range a node reads from cell (row, col), as (top, left, bottom, right) rectangles."""
+    if found is None:
+        found = []
+    kind = node[0]
+    if kind == "ref":
+        row_offset, row_factor, col_offset, col_factor = _cell_at(node)
+        cell_row, cell_col = row_offset + row_factor * row, col_offset + col_factor * col
+        found.append((cell_row, cell_col, cell_row, cell_col))
+    elif kind == "range":
+        found.append(_rect_at(node, row, col))
+    elif kind in ("neg", "pct"):
+        references(node[1], row, col, found)
+    elif kind == "bin":
+        references(node[2], row, col, found)
+        references(node[3], row, col, found)
+    elif kind == "call":
+        for arg in node[2]:
+            references(arg, row, col, found)
+    return found
+
+
+class FormulaTemplate:
+    """A compiled formula in R1C1 form, shared by all the cells whose formula
+    has the same shape (e.g. every cell of a filled column)."""
+    __slots__ = ("tree", "_run")
+
+    def __init__(self, tree):
+        self.tree = tree
+        self._run = compile_node(tree)
+
+    def at(self, row, col):
+        return Formula(self, row, col)
+
+
+class Formula:
+    """A FormulaTemplate placed in a cell."""
+    __slots__ = ("template", "row", "col")
+
+    def __init__(self, template, row, col):
+        self.template = template
+        self.row = row
+        self.col = col
+
+    @property
+    def references(self):
+        return tuple(references(self.template.tree, self.row, self.col))
+
+    def evaluate(self, source):
+        """Value of the formula; Excel errors come back as their text, e.g. '#DIV/0!'."""
+        try:
+            return finite(self.template._run(source, self.row, self.col))
+        except CellError as error:
+            return error.code
+        except (ArithmeticError, ValueError):
+            return NUM
+
+
+def is_formula(text):
+    return isinstance(text, str) and text.lstrip().startswith("=") and len(text.strip()) > 1
+
+
+_templates = {}   # template key -> FormulaTemplate, the oldest is dropped first
+
+
+def template_key(tokens, row, col):
+    """Formulas with the same key behave the same wherever they are: the
+    tokens, with references as R1C1 offsets from cell (row, col). Unlike R1C1
+    text it can't mix up a reference with a name that looks like one (R1C1)."""
+    key = []
+    for kind, value in tokens:
+        if kind == "ref":
+            ref_row, ref_col, row_absolute, col_absolute = parse_ref_parts(value)
+            value = (Parser.place(ref_row, row_absolute, row), Parser.place(ref_col, col_absolute, col),
+                     row_absolute, col_absolute)
+        key.append((kind, value))
+    return tuple(key)
+
+
+def compile_formula_at(text, row, col):
+    """The formula of cell (row, col), compiled once per template.
+    Raises FormulaError for bad formulas."""
+    text = text.strip()
+    if text.startswith("="):
+        text = text[1:]
+    if not text:
+        raise FormulaError("empty formula")
+    tokens = tokenize(text)
+    key = template_key(tokens, row, col)
+    template = _templates.get(key)
+    if template is None:
+        template = FormulaTemplate(Parser(tokens, row, col).parse())
+        if len(_templates) >= COMPILED_CACHE_SIZE:
+            del _templates[next(iter(_templates))]
+        _templates[key] = template
+    return Formula(template, row, col)
+
+
+def compile_formula(text):
+    """A formula not tied to a cell (relative references count from A1)."""
+    return compile_formula_at(text, 0, 0)
+
+
+def evaluate(text, source):
+    return compile_formula(text).evaluate(source)
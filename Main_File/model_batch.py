@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+
+from PyQt6.QtCore import Qt
+
+
+class BatchedChangesMixin:
+    """Adds `with model.batch():` to a QAbstractTableModel.
+
+    Inside a batch, changes reported through changed() are not emitted one
+    by one; the bounding rectangle of all of them goes out as a single
+    dataChanged when the outermost batch ends. Batches can be nested.
+    """
+
+    _batch_depth = 0
+    _batch_rect = None    # [top, left, bottom, right] touched so far
+    _batch_roles = None
+
+    @contextmanager
+    def batch(self):
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._batch_rect is not None:
+                top, left, bottom, right = self._batch_rect
+                roles = list(self._batch_roles)
+                self._batch_rect = None
+                self._batch_roles = None
+                self.dataChanged.emit(self.index(top, left), self.index(bottom, right), roles)
+
+    def changed(self, top, left, bottom, right, roles=(Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole)):
+        """Report changed cells: emitted now, or merged into the running batch."""
+        bottom = min(bottom, self.rowCount() - 1)
+        right = min(right, self.columnCount() - 1)
+        if bottom < top or right < left:
+            return
+        if not self._batch_depth:
+            self.dataChanged.emit(self.index(top, left), self.index(bottom, right), list(roles))
+            return
+        if self._batch_rect is None:
+            self._batch_rect = [top, left, bottom, right]
+            self._batch_roles = set(roles)
+            return
+        rect = self._batch_rect
+        rect[0] = min(rect[0], top)
+        rect[1] = min(rect[1], left)
+        rect[2] = max(rect[2], bottom)
+        rect[3] = max(rect[3], right)
+        self._batch_roles.update(roles)
@@ -0,0 +1,194 @@
+"""Full recalculation spread over worker processes.
+
+The formulas to compute are split into connected components of the
+dependency graph (cells that never read each other, directly or through
+other formulas, e.g. one calculation block per region). Components are
+packed into bundles of similar size and every bundle goes to a
+ProcessPoolExecutor worker together with what it reads: the formula
+templates it uses, the cells in topological order, and compact column arrays (NumPy slices of just the
+rows its ranges touch) instead of the sheet. The workers send back plain
+values which the caller writes into the model.
+
+Qt is not imported here, so workers stay light.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from formula_engine import CellSource, CellError, NO_NUMBERS, ERROR_CODES, FormulaTemplate, combine_stats
+from range_aggregates import slice_stats
+
+
+PARALLEL_MIN_FORMULAS = 5000   # fewer formulas than this are not worth the process overhead
+BUNDLES_PER_JOB = 2            # a little slack so one slow bundle doesn't idle the other workers
+
+
+class ArraySource(CellSource):
+    """CellSource over the column arrays sent to a worker.
+
+    columns: col -> (first row, float array, {row: error text})
+    singles: (row, col) -> value for single cells outside the arrays or holding text
+    Results computed in the worker are written back with set() so later
+    formulas in the bundle read them.
+    """
+
+    def __init__(self, columns, singles):
+        self.columns = columns
+        self.singles = singles
+
+    def value(self, row, col):
+        if (row, col) in self.singles:
+            return self.singles[(row, col)]
+        column = self.columns.get(col)
+        if column is None:
+            return None
+        first, numbers, errors = column
+        if not first <= row < first + len(numbers):
+            return None
+        if row in errors:
+            return errors[row]
+        number = numbers[row - first]
+        return None if number != number else float(number)
+
+    def set(self, row, col, value):
+        column = self.columns.get(col)
+        if column is None or not column[0] <= row < column[0] + len(column[1]):
+            self.singles[(row, col)] = value
+            return
+        first, numbers, errors = column
+        errors.pop(row, None)
+        self.singles.pop((row, col), None)
+        if isinstance(value, (int, float)) and value is not True and value is not False:
+            numbers[row - first] = value
+            return
+        numbers[row - first] = np.nan
+        if value in ERROR_CODES:
+            errors[row] = value
+        elif value is not None:
+            self.singles[(row, col)] = value
+
+    def range_stats(self, top, left, bottom, right):
+        stats = NO_NUMBERS
+        for col in range(left, right + 1):
+            column = self.columns.get(col)
+            if column is None:
+                continue
+            first, numbers, errors = column
+            start = max(top - first, 0)
+            stop = min(bottom - first + 1, len(numbers))
+            if start >= stop:
+                continue
+            for row in sorted(errors):
+                if start <= row - first < stop:
+                    raise CellError(errors[row])
+            stats = combine_stats(stats, slice_stats(numbers[start:stop]))
+        return stats
+
+
+def evaluate_bundle(templates, formulas, columns, singles):
+    """Worker entry point: templates are the R1C1 trees of the formulas, compiled
+    once here; formulas is [(row, col, template number), ...] in topological
+    order. Returns their values in the same order."""
+    source = ArraySource(columns, singles)
+    templates = [FormulaTemplate(tree) for tree in templates]
+    results = []
+    for row, col, number in formulas:
+        value = templates[number].at(row, col).evaluate(source)
+        if value is None:
+            value = 0
+        source.set(row, col, value)
+        results.append(value)
+    return results
+
+
+def components(order, edges):
+    """Split topologically ordered cells into independent groups, each still in order."""
+    parent = {cell: cell for cell in order}
+
+    def find(cell):
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    for cell in order:
+        for dependent in edges.get(cell, ()):
+            if dependent in parent:
+                first, second = find(cell), find(dependent)
+                if first != second:
+                    parent[second] = first
+    groups = {}
+    for cell in order:
+        groups.setdefault(find(cell), []).append(cell)
+    return list(groups.values())
+
+
+def pack(groups, count):
+    """Greedy: biggest component first, always into the smallest bundle."""
+    bundles = [[] for _ in range(min(count, len(groups)))]
+    for group in sorted(groups, key=len, reverse=True):
+        min(bundles, key=len).extend(group)
+    return [bundle for bundle in bundles if bundle]
+
+
+def bundle_inputs(bundle, graph, source):
+    """The formula templates of a bundle, its cells and the compact column arrays they read."""
+    templates = []
+    numbers = {}   # id of a template -> its position in templates
+    formulas = []
+    for row, col in bundle:
+        template = graph.formulas[(row, col)].template
+        number = numbers.get(id(template))
+        if number is None:
+            number = numbers[id(template)] = len(templates)
+            templates.append(template.tree)
+        formulas.append((row, col, number))
+    extents = {}   # col -> [top, bottom] of the ranges read in it
+    singles = {}
+    for cell in bundle:
+        for top, left, bottom, right in graph.formulas[cell].references:
+            if top == bottom and left == right:
+                value = source.value(top, left)
+                if value is not None:
+                    singles[(top, left)] = value
+                continue
+            for col in range(left, right + 1):
+                extent = extents.get(col)
+                if extent is None:
+                    extents[col] = [top, bottom]
+                else:
+                    extent[0] = min(extent[0], top)
+                    extent[1] = max(extent[1], bottom)
+    columns = {}
+    for col, (top, bottom) in extents.items():
+        numbers, errors = source.column_numbers(col, top, bottom)
+        columns[col] = (top, numbers, errors)
+    return templates, formulas, columns, singles
+
+
+def evaluate_parallel(graph, source, order, edges, jobs=None, executor=None):
+    """Values for the topologically ordered formula cells `order`, as a list.
+
+    `edges` are the dependents found by graph.recalc_order(). If everything
+    is one component it is evaluated in this process. Pass an executor to
+    reuse a pool.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    bundles = pack(components(order, edges), jobs * BUNDLES_PER_JOB)
+    if len(bundles) == 1:
+        return evaluate_bundle(*bundle_inputs(order, graph, source))
+
+    own_pool = executor is None
+    if own_pool:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        futures = [executor.submit(evaluate_bundle, *bundle_inputs(bundle, graph, source))
+                   for bundle in bundles]
+        computed = {}
+        for bundle, future in zip(bundles, futures):
+            computed.update(zip(bundle, future.result()))
+    finally:
+        if own_pool:
+            executor.shutdown()
+    return [computed[cell] for cell in order]
@@ -0,0 +1,236 @@
+"""Vectorized SUM/AVERAGE/COUNT/MAX/MIN over a sheet's cell store.
+
+SheetSource is the CellSource formulas use on a live sheet. A range is cut
+along the 64-row blocks of the cell store; for every block and column the
+cells are turned into a NumPy array of numbers once (through the string
+table's number cache) and reduced to a partial aggregate. Both are kept with
+the version of that block column, so after one cell changes only its block
+is read again.
+
+The partials of a column are also stacked into arrays (ColumnSummary), so
+the whole blocks in the middle of SUM(A1:A500000) are reduced by a couple of
+NumPy calls; only the two partial blocks at its ends are sliced.
+
+On top of that, whole range results are memoized per column versions (see
+formula_engine.RangeMemo), for the many formulas aggregating the same range.
+"""
+import numpy as np
+
+from cell_store import CHUNK_SHIFT, CHUNK_SIZE, CHUNK_MASK
+from formula_engine import CellSource, CellError, RangeMemo, NO_NUMBERS, ERROR_CODES, combine_stats
+
+
+MEMO_MAX_COLUMNS = 64   # wider ranges are not memoized, their version would be as wide
+
+
+class BlockColumn:
+    __slots__ = ("versions", "numbers", "errors", "stats")
+
+    def __init__(self, versions, numbers, errors):
+        self.versions = versions  # block versions of this column in (cells, values)
+        self.numbers = numbers    # float array, NaN where the cell is not a number
+        self.errors = errors      # [(row in block, error text), ...]
+        self.stats = slice_stats(numbers)
+
+
+class ColumnSummary:
+    """Block partials of one column stacked into arrays, ordered by chunk row."""
+    __slots__ = ("versions", "rows", "totals", "counts", "lows", "highs", "errors")
+
+    def __init__(self, versions, blocks):
+        self.versions = versions   # (cells column version, values column version)
+        self.rows = np.array([chunk_row for chunk_row, _block in blocks], dtype=np.int64)
+        stats = [block.stats for _chunk_row, block in blocks]
+        self.totals = np.array([total for total, _count, _low, _high in stats], dtype=float)
+        self.counts = np.array([count for _total, count, _low, _high in stats], dtype=np.int64)
+        self.lows = np.array([np.inf if low is None else low for _total, _count, low, _high in stats])
+        self.highs = np.array([-np.inf if high is None else high for _total, _count, _low, high in stats])
+        # first error text of each block, None for blocks without errors
+        self.errors = [block.errors[0][1] if block.errors else None for _chunk_row, block in blocks]
+
+    def stats(self, first, last):
+        """Combined stats of the blocks with first <= chunk row <= last."""
+        start = np.searchsorted(self.rows, first)
+        stop = np.searchsorted(self.rows, last, side="right")
+        if start >= stop:
+            return NO_NUMBERS
+        for error in self.errors[start:stop]:
+            if error is not None:
+                raise CellError(error)
+        count = int(self.counts[start:stop].sum())
+        if not count:
+            return NO_NUMBERS
+        return (float(self.totals[start:stop].sum()), count,
+                float(self.lows[start:stop].min()), float(self.highs[start:stop].max()))
+
+
+def slice_stats(numbers):
+    valid = numbers[~np.isnan(numbers)]
+    if not len(valid):
+        return NO_NUMBERS
+    return float(valid.sum()), len(valid), float(valid.min()), float(valid.max())
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and value is not True and value is not False
+
+
+class SheetSource(CellSource):
+    """Reads a sheet's stores: typed text as shared string ids, the computed
+    values of formula cells, and which cells are formulas."""
+
+    def __init__(self, cells, strings, values, formulas):
+        self.cells = cells          # ChunkedCellStore of string ids
+        self.strings = strings      # SharedStringTable
+        self.values = values        # ChunkedCellStore of computed formula values
+        self.formulas = formulas    # formula cells, their text is not their value
+        self._blocks = {}           # (chunk_row, col) -> BlockColumn
+        self._columns = {}          # col -> ColumnSummary
+        self.block_reads = 0        # block columns (re)built, for profiling
+        self.memo = RangeMemo()     # range -> aggregate, with hit/miss counters
+
+    def value(self, row, col):
+        if (row, col) in self.formulas:
+            return self.values.get(row, col)
+        string_id = self.cells.get(row, col)
+        if string_id is None:
+            return None
+        number = self.strings.number(string_id)
+        return self.strings.get(string_id) if number is None else number
+
+    def range_values(self, top, left, bottom, right):
+        formulas = self.formulas
+        values = self.values
+        strings = self.strings
+        for row, col, string_id in self.cells.items_in_range(top, left, bottom, right):
+            if (row, col) in formulas:
+                value = values.get(row, col)
+                if value is not None:
+                    yield value
+                continue
+            number = strings.number(string_id)
+            yield strings.get(string_id) if number is None else number
+
+    def forget(self):
+        """Drop the cached blocks (e.g. after the stores were replaced)."""
+        self._blocks = {}
+        self._columns = {}
+        self.memo.clear()
+
+    def range_version(self, top, left, bottom, right):
+        # The column versions of both stores: conservative (any write in the
+        # column counts), but a lookup per column instead of per block
+        if right - left >= MEMO_MAX_COLUMNS:
+            return None
+        cells = self.cells.column_versions
+        values = self.values.column_versions
+        if left == right:
+            return cells.get(left), values.get(left)
+        return tuple((cells.get(col), values.get(col)) for col in range(left, right + 1))
+
+    def _column(self, col):
+        versions = (self.cells.column_versions.get(col), self.values.column_versions.get(col))
+        summary = self._columns.get(col)
+        if summary is None or summary.versions != versions:
+            blocks = []
+            for chunk_row in sorted(self.cells.chunk_rows(col >> CHUNK_SHIFT)):
+                block = self._block(chunk_row, col)
+                if block.stats[1] or block.errors:
+                    blocks.append((chunk_row, block))
+            summary = self._columns[col] = ColumnSummary(versions, blocks)
+        return summary
+
+    def _block(self, chunk_row, col):
+        chunk_col = col >> CHUNK_SHIFT
+        chunk = self.cells.chunk(chunk_row, chunk_col)
+        if chunk is None:
+            return None
+        value_chunk = self.values.chunk(chunk_row, chunk_col)
+        versions = (self.cells.block_versions.get((chunk_row, col)),
+                    self.values.block_versions.get((chunk_row, col)))
+        block = self._blocks.get((chunk_row, col))
+        if block is not None and block.versions == versions:
+            return block
+
+        self.block_reads += 1
+        offset = col & CHUNK_MASK
+        numbers = np.full(CHUNK_SIZE, np.nan)
+        errors = []
+        strings = self.strings
+        cells = chunk.cells
+        if type(cells) is dict:
+            entries = [(position >> CHUNK_SHIFT, string_id) for position, string_id in cells.items()
+                       if position & CHUNK_MASK == offset]
+        else:
+            entries = [(row, string_id) for row, string_id in enumerate(cells[offset::CHUNK_SIZE])
+                       if string_id is not None]
+        for row, string_id in entries:
+            number = strings.number(string_id)
+            if number is not None:
+                numbers[row] = number
+            elif strings.get(string_id) in ERROR_CODES:
+                errors.append((row, strings.get(string_id)))
+
+        # Formula cells: their computed value replaces the formula text
+        if value_chunk is not None:
+            for position, value in value_chunk.items():
+                if position & CHUNK_MASK != offset:
+                    continue
+                row = position >> CHUNK_SHIFT
+                if _is_number(value):
+                    numbers[row] = value
+                elif value in ERROR_CODES:
+                    errors.append((row, value))
+
+        errors.sort()
+        block = self._blocks[(chunk_row, col)] = BlockColumn(versions, numbers, errors)
+        return block
+
+    def _slice_stats(self, chunk_row, col, top, bottom):
+        """Stats of the rows top..bottom of one block."""
+        block = self._block(chunk_row, col)
+        if block is None:
+            return NO_NUMBERS
+        base = chunk_row << CHUNK_SHIFT
+        start = max(top - base, 0)
+        stop = min(bottom - base + 1, CHUNK_SIZE)
+        if start == 0 and stop == CHUNK_SIZE:
+            if block.errors:
+                raise CellError(block.errors[0][1])
+            return block.stats
+        for row, error in block.errors:
+            if start <= row < stop:
+                raise CellError(error)
+        return slice_stats(block.numbers[start:stop])
+
+    def column_numbers(self, col, top, bottom):
+        """Rows top..bottom of a column as a float array (NaN for non-numbers),
+        plus {row: error text}. Built from the cached blocks."""
+        numbers = np.full(bottom - top + 1, np.nan)
+        errors = {}
+        for chunk_row in range(top >> CHUNK_SHIFT, (bottom >> CHUNK_SHIFT) + 1):
+            block = self._block(chunk_row, col)
+            if block is None:
+                continue
+            base = chunk_row << CHUNK_SHIFT
+            start = max(top - base, 0)
+            stop = min(bottom - base + 1, CHUNK_SIZE)
+            numbers[base + start - top:base + stop - top] = block.numbers[start:stop]
+            for row, error in block.errors:
+                if start <= row < stop:
+                    errors[base + row] = error
+        return numbers, errors
+
+    def range_stats(self, top, left, bottom, right):
+        first, last = top >> CHUNK_SHIFT, bottom >> CHUNK_SHIFT
+        stats = NO_NUMBERS
+        for col in range(left, right + 1):
+            if last - first < 2:
+                for chunk_row in range(first, last + 1):
+                    stats = combine_stats(stats, self._slice_stats(chunk_row, col, top, bottom))
+                continue
+            # Partial blocks at both ends, the whole ones in between from the column summary
+            stats = combine_stats(stats, self._slice_stats(first, col, top, bottom))
+            stats = combine_stats(stats, self._column(col).stats(first + 1, last - 1))
+            stats = combine_stats(stats, self._slice_stats(last, col, top, bottom))
+        return stats
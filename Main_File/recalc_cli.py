@@ -0,0 +1,262 @@
+"""Headless recalculation of xlsx workbooks, for batch jobs without a display.
+
+    python recalc_cli.py book.xlsx other.xlsx --jobs 4 --output-dir out/
+
+Every worksheet is read with openpyxl in read-only mode into the same stores
+the sheet model uses (cell store, string table, dependency graph), all
+formulas are computed with the formula engine, and the workbook is written
+again in write-only mode, row by row, with formula cells replaced by their
+values. Formulas the engine does not understand (other sheets, unknown
+syntax, functions other than SUM/AVERAGE/COUNT/MAX/MIN), formulas caught in
+a reference cycle, and the formulas reading any of them are written back as
+formulas, so Excel computes them on open. Cells keep their xlsx types: numbers,
+booleans and errors are values, text stays text (a "5" stored as text is not
+counted by SUM, an "=..." string is not a formula), and dates are numbers to
+formulas, like in Excel. Computed errors are written as error values.
+
+Only values survive: the write-only output has no styles, number formats,
+column widths or merged cells.
+
+--jobs N uses N worker processes: one file each when several files are
+given, otherwise the independent parts of big sheets (see parallel_recalc).
+Qt is never imported.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import os
+import sys
+import time
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ERROR_CODES as XLSX_ERROR_CODES
+from openpyxl.utils.datetime import CALENDAR_WINDOWS_1900, to_excel
+
+from cell_store import ChunkedCellStore
+from shared_strings import SharedStringTable
+from dependency_graph import DependencyGraph
+from formula_engine import compile_formula_at, supported, FormulaError, ERROR_CODES
+from range_aggregates import SheetSource
+from parallel_recalc import evaluate_parallel, PARALLEL_MIN_FORMULAS
+
+
+DATE_TYPES = (datetime.datetime, datetime.date, datetime.time, datetime.timedelta)
+
+# String kept for cells whose value is in the values store; the text of a
+# constant is never read, the string only marks the cell as filled
+VALUE_CELL = ""
+
+
+def cell_value(value, epoch=CALENDAR_WINDOWS_1900):
+    """A number, boolean, date or error value of an openpyxl cell as formulas see it."""
+    if isinstance(value, DATE_TYPES):
+        # Formulas see dates as Excel serial numbers (=A1+1 is the next day)
+        return to_excel(value, epoch)
+    return value
+
+
+def _error_cell(target, code):
+    cell = WriteOnlyCell(target, value=code)
+    cell.data_type = "e"   # an error value, not text that looks like one
+    return cell
+
+
+def _text_cell(target, text):
+    cell = WriteOnlyCell(target, value=text)
+    cell.data_type = "s"   # text, even when it looks like a formula or an error
+    return cell
+
+
+class TextStrings(SharedStringTable):
+    """The text cells of a workbook. Unlike typed sheet cells they stay text:
+    a "5" stored as a string in the xlsx is not the number 5."""
+
+    def number(self, string_id):
+        return None
+
+
+class ValueCells:
+    """The cells SheetSource reads from the values store: the formula cells and
+    the typed constants (numbers, booleans, dates, errors) of the workbook."""
+
+    def __init__(self, formulas, values):
+        self.formulas = formulas
+        self.values = values
+
+    def __contains__(self, cell):
+        return cell in self.formulas or self.values.get(*cell) is not None
+
+
+class Sheet:
+    """One worksheet in the sheet model's stores, without the Qt model around them."""
+
+    def __init__(self, title):
+        self.title = title
+        self.strings = TextStrings()
+        self.cells = ChunkedCellStore()
+        self.values = ChunkedCellStore()      # typed constants and computed formula values
+        self.dependencies = DependencyGraph()
+        self.source = SheetSource(self.cells, self.strings, self.values,
+                                  ValueCells(self.dependencies.formulas, self.values))
+        self.unsupported = []  # formula cells left for Excel
+
+    def load_rows(self, rows, epoch=CALENDAR_WINDOWS_1900):
+        """Read openpyxl cells (read-only iter_rows, not values_only). Only cells
+        of the formula data type are formulas."""
+        for row, cells in enumerate(rows):
+            for col, cell in enumerate(cells):
+                value = cell.value
+                if value is None:
+                    continue
+                if cell.data_type == "f":
+                    if not isinstance(value, str):
+                        # Array and data table formulas
+                        self.cells.set(row, col, self.strings.add(VALUE_CELL))
+                        self.unsupported.append((row, col))
+                        continue
+                    self.cells.set(row, col, self.strings.add(value))
+                    try:
+                        formula = compile_formula_at(value, row, col)
+                    except FormulaError:
+                        self.unsupported.append((row, col))
+                        continue
+                    if supported(formula.template.tree):
+                        self.dependencies.set_formula((row, col), formula)
+                    else:
+                        self.unsupported.append((row, col))
+                elif isinstance(value, str) and cell.data_type != "e":
+                    self.cells.set(row, col, self.strings.add(value))
+                else:
+                    self.cells.set(row, col, self.strings.add(VALUE_CELL))
+                    self.values.set(row, col, cell_value(value, epoch))
+
+    def recalculate(self, jobs=1, executor=None):
+        graph = self.dependencies
+        if self.unsupported:
+            # Formulas reading one we can't compute are left for Excel as well
+            order, cyclic = graph.recalc_order([(row, col, row, col) for row, col in self.unsupported])
+            for cell in order + cyclic:
+                graph.remove(cell)
+            self.unsupported.extend(order + cyclic)
+        edges = {}
+        order, cyclic = graph.recalc_order([], list(graph.formulas), edges)
+        values = self.values
+        if jobs != 1 and len(order) >= PARALLEL_MIN_FORMULAS:
+            results = evaluate_parallel(graph, self.source, order, edges, jobs, executor)
+            for (row, col), value in zip(order, results):
+                values.set(row, col, value)
+        else:
+            formulas = graph.formulas
+            for row, col in order:
+                value = formulas[(row, col)].evaluate(self.source)
+                values.set(row, col, 0 if value is None else value)
+        # Excel reports cycles itself, with its iteration settings
+        for cell in cyclic:
+            graph.remove(cell)
+        self.unsupported.extend(cyclic)
+        return len(order)
+
+    def computed_rows(self, rows, error_cell=None, text_cell=None):
+        """The same cells again (read a second time) as values to write, formula
+        cells replaced by their values. error_cell(code) makes what is written
+        for a computed error, text_cell(text) what is written for text openpyxl
+        would otherwise take for a formula or an error."""
+        formulas = self.dependencies.formulas
+        values = self.values
+        for row, cells in enumerate(rows):
+            computed = []
+            for col, cell in enumerate(cells):
+                value = cell.value
+                if (row, col) in formulas:
+                    value = values.get(row, col)
+                    if error_cell is not None and value in ERROR_CODES:
+                        value = error_cell(value)
+                elif (text_cell is not None and cell.data_type == "s" and isinstance(value, str)
+                      and (value.startswith("=") or value in XLSX_ERROR_CODES)):
+                    value = text_cell(value)
+                computed.append(value)
+            yield computed
+
+
+def _rows(worksheet):
+    # Cells, not values_only: their data type tells formulas from text
+    return worksheet.iter_rows(min_row=1, min_col=1)
+
+
+def recalc_file(path, output, jobs=1, executor=None):
+    """Recalculate one workbook into `output`. Returns (sheets, formulas, unsupported)."""
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    result = openpyxl.Workbook(write_only=True)
+    formulas = unsupported = 0
+    try:
+        for worksheet in workbook.worksheets:
+            sheet = Sheet(worksheet.title)
+            sheet.load_rows(_rows(worksheet), workbook.epoch)
+            formulas += sheet.recalculate(jobs, executor)
+            unsupported += len(sheet.unsupported)
+            target = result.create_sheet(worksheet.title)
+            for values in sheet.computed_rows(_rows(worksheet), lambda code: _error_cell(target, code),
+                                              lambda text: _text_cell(target, text)):
+                target.append(values)
+        result.save(output)
+    finally:
+        workbook.close()
+    return len(workbook.worksheets), formulas, unsupported
+
+
+def output_path(path, output_dir, suffix):
+    base, extension = os.path.splitext(os.path.basename(path))
+    return os.path.join(output_dir or os.path.dirname(path), base + suffix + extension)
+
+
+def _run_one(path, output, jobs=1, executor=None):
+    # Worker entry point for whole files; errors are reported, not raised
+    started = time.perf_counter()
+    try:
+        sheets, formulas, unsupported = recalc_file(path, output, jobs, executor)
+    except Exception as error:
+        return False, "%s: failed: %s" % (path, error)
+    note = " (%d left as formulas)" % unsupported if unsupported else ""
+    return True, "%s: %d sheets, %d formulas%s in %.2fs -> %s" % (
+        path, sheets, formulas, note, time.perf_counter() - started, output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Recalculate the formulas of xlsx files without Excel or a display.",
+        epilog="The output keeps values only: styles, number formats, column widths and merged "
+               "cells are not copied. Formulas the engine can't compute are kept as formulas.")
+    parser.add_argument("files", nargs="+", help="xlsx workbooks to recalculate")
+    parser.add_argument("-o", "--output-dir", help="where to write the results (default: next to each input)")
+    parser.add_argument("--suffix", default="_values", help="added to the output file names (default: _values)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per core (default: 1)")
+    args = parser.parse_args(argv)
+
+    jobs = args.jobs or os.cpu_count() or 1
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    outputs = [output_path(path, args.output_dir, args.suffix) for path in args.files]
+
+    ok = True
+    if jobs > 1 and len(args.files) > 1:
+        # Several files: one per worker, each computed serially
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for success, message in executor.map(_run_one, args.files, outputs):
+                ok = ok and success
+                print(message, flush=True)
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        try:
+            for path, output in zip(args.files, outputs):
+                success, message = _run_one(path, output, jobs, executor)
+                ok = ok and success
+                print(message, flush=True)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Interned, reference-counted string table for cell text (like xlsx sharedStrings).
+
+Cells store the integer id returned by add() instead of their own str, so a
+column of repeated values ("Open", "Closed", ...) keeps one copy of each.
+The table also caches what each string means as a number, so formulas parse
+"42" once, not once per cell holding it or per recalculation.
+"""
+from column_store import parse_number
+
+
+TEXT = False   # _numbers marker for a string that is not a number
+
+
+class SharedStringTable:
+    def __init__(self):
+        self._ids = {}       # text -> id
+        self._strings = []   # id -> text, None for a free slot
+        self._refs = []      # id -> number of cells using it
+        self._numbers = []   # id -> parsed number, TEXT, or None until asked
+        self._free = []      # released ids, reused by add()
+        self._shared = False # _strings is referenced by a snapshot
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, text):
+        """Take a reference to `text` and return its id."""
+        string_id = self._ids.get(text)
+        if string_id is None:
+            if self._free:
+                string_id = self._free.pop()
+                self._strings[string_id] = text
+                self._refs[string_id] = 0
+                self._numbers[string_id] = None
+            else:
+                string_id = len(self._strings)
+                self._strings.append(text)
+                self._refs.append(0)
+                self._numbers.append(None)
+            self._ids[text] = string_id
+        self._refs[string_id] += 1
+        return string_id
+
+    def release(self, string_id):
+        """Drop one reference. A string nobody uses any more is freed right away."""
+        self._refs[string_id] -= 1
+        if self._refs[string_id] == 0:
+            if self._shared:
+                # A snapshot may still read this id, clear it in a private copy
+                self._strings = list(self._strings)
+                self._shared = False
+            del self._ids[self._strings[string_id]]
+            self._strings[string_id] = None
+            self._free.append(string_id)
+
+    def get(self, string_id):
+        return self._strings[string_id]
+
+    def number(self, string_id):
+        """The string as a number (int or float), None if it isn't one. Cached per id."""
+        number = self._numbers[string_id]
+        if number is None:
+            number = parse_number(self._strings[string_id])
+            if number is None:
+                number = TEXT
+            self._numbers[string_id] = number
+        return None if number is TEXT else number
+
+    def refcount(self, string_id):
+        return self._refs[string_id]
+
+    def snapshot(self):
+        """id -> text list for readers. Ids a snapshot can see are never
+        overwritten while it is shared: new strings only get appended."""
+        self._shared = True
+        return self._strings
+
+    def compact(self):
+        """Renumber the live strings densely and drop the free slots.
+
+        Returns {old_id: new_id}; callers holding ids must remap them.
+        """
+        remap = {}
+        strings = []
+        refs = []
+        numbers = []
+        for old_id, text in enumerate(self._strings):
+            if text is None:
+                continue
+            remap[old_id] = len(strings)
+            strings.append(text)
+            refs.append(self._refs[old_id])
+            numbers.append(self._numbers[old_id])
+        self._strings = strings
+        self._refs = refs
+        self._numbers = numbers
+        self._ids = {text: string_id for string_id, text in enumerate(strings)}
+        self._free = []
+        self._shared = False
+        return remap
+
+
+class StringSnapshot:
+    """Read side of a SharedStringTable.snapshot() for another thread.
+
+    Numbers are parsed into a cache of its own, so the table's cache is
+    only ever written on the thread that owns the table.
+    """
+
+    def __init__(self, strings):
+        self._strings = strings  # id -> text list from SharedStringTable.snapshot()
+        self._numbers = {}
+
+    def get(self, string_id):
+        return self._strings[string_id]
+
+    def number(self, string_id):
+        number = self._numbers.get(string_id)
+        if number is None:
+            number = parse_number(self._strings[string_id])
+            if number is None:
+                number = TEXT
+            self._numbers[string_id] = number
+        return None if number is TEXT else number
@@ -0,0 +1,56 @@
+"""Read-only, consistent view of a sheet for background readers.
+
+Created with SparseTableModel.snapshot() on the GUI thread in O(1); after
+that it can be handed to worker threads or processes (it is plain Python
+and picklable) for export, recalculation or indexing while the user keeps
+editing the live sheet.
+"""
+from formula_engine import format_value
+
+
+class SheetSnapshot:
+    def __init__(self, rows, columns, cells, strings, values=None):
+        self.rows = rows
+        self.columns = columns
+        self._cells = cells        # CellStoreSnapshot of string ids
+        self._strings = strings    # id -> text list shared with the string table
+        self._values = values      # CellStoreSnapshot of computed formula values
+
+    def __len__(self):
+        return len(self._cells)
+
+    def text(self, row, column):
+        string_id = self._cells.get(row, column)
+        return "" if string_id is None else self._strings[string_id]
+
+    def display_text(self, row, column):
+        """The computed value for a formula cell, the text otherwise."""
+        if self._values is not None:
+            value = self._values.get(row, column)
+            if value is not None:
+                return format_value(value)
+        return self.text(row, column)
+
+    def items(self):
+        """Yield (row, column, text) for every non-empty cell, in no particular order."""
+        strings = self._strings
+        for row, column, string_id in self._cells.items():
+            yield row, column, strings[string_id]
+
+    def items_in_range(self, top, left, bottom, right):
+        strings = self._strings
+        for row, column, string_id in self._cells.items_in_range(top, left, bottom, right):
+            yield row, column, strings[string_id]
+
+    def extent(self):
+        return self._cells.extent()
+
+    def iter_rows(self):
+        """Rows of the used area as lists of text, top to bottom (for exports)."""
+        rows, columns = self.extent()
+        by_row = {}
+        for row, column, text in self.items():
+            by_row.setdefault(row, {})[column] = text
+        for row in range(rows):
+            cells = by_row.get(row, {})
+            yield [cells.get(column, "") for column in range(columns)]
@@ -0,0 +1,32 @@
+"""Per-sheet flyweight table of cell styles.
+
+Every distinct combination of formatting attributes is stored once and cells
+refer to it by a small integer id. Id 0 is always the default style.
+"""
+from collections import namedtuple
+
+
+# Alignment values follow the xlsx names: left/center/right and top/center/bottom.
+# New attributes (font, fill, ...) get appended here with a default below.
+Style = namedtuple("Style", ["h_align", "v_align", "wrap"])
+
+DEFAULT_STYLE = Style(h_align="left", v_align="center", wrap=False)
+
+
+class StyleTable:
+    def __init__(self):
+        self._styles = [DEFAULT_STYLE]       # id -> Style
+        self._ids = {DEFAULT_STYLE: 0}       # Style -> id
+
+    def __len__(self):
+        return len(self._styles)
+
+    def get(self, style_id):
+        return self._styles[style_id]
+
+    def intern(self, style):
+        style_id = self._ids.get(style)
+        if style_id is None:
+            style_id = self._ids[style] = len(self._styles)
+            self._styles.append(style)
+        return style_id
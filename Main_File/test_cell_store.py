@@ -0,0 +1,32 @@
+"""ChunkedCellStore: sparse blocks, range reads and snapshots."""
+from cell_store import ChunkedCellStore, CHUNK_SIZE, DENSE_THRESHOLD, column_label
+
+
+def test_blocks_only_for_written_cells():
+    store = ChunkedCellStore()
+    store.set(1000000, 16000, "far")
+    store.set(3, 2, "near")
+    assert store.chunk_count() == 2
+    assert store.get(1000000, 16000) == "far"
+    assert store.get(5, 5) is None
+    assert store.extent() == (1000001, 16001)
+
+    store.set(1000000, 16000, None)
+    assert store.chunk_count() == 1
+    assert len(store) == 1
+
+
+def test_dense_block_and_range_reads():
+    store = ChunkedCellStore()
+    for row in range(CHUNK_SIZE):
+        for col in range(DENSE_THRESHOLD // CHUNK_SIZE + 2):
+            store.set(row, col, row * 100 + col)
+    assert store.get(10, 3) == 1003
+    assert sorted(store.items_in_range(10, 1, 11, 2)) == [(10, 1, 1001), (10, 2, 1002), (11, 1, 1101), (11, 2, 1102)]
+
+    store.clear_range(0, 0, CHUNK_SIZE - 1, 0)
+    assert store.get(10, 0) is None and store.get(10, 1) == 1001
+
+
+def test_column_label():
+    assert [column_label(col) for col in (0, 25, 26, 701, 702, 16383)] == ["A", "Z", "AA", "ZZ", "AAA", "XFD"]
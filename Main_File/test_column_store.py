@@ -0,0 +1,33 @@
+"""ColumnStore: typed numeric columns with their few text cells on the side."""
+from column_store import ColumnStore
+
+
+def test_text_in_numeric_column_keeps_it_typed():
+    store = ColumnStore.from_rows([[str(row)] for row in range(1000)], 1)
+    column = store.columns[0]
+    values = column.values
+
+    store.set(5, 0, "abc")
+    assert store.text(5, 0) == "abc"
+    assert not store.is_numeric_range(0, 0, 9, 0)
+    assert store.is_numeric_range(6, 0, 999, 0)
+    store.set(5, 0, "")
+    assert store.get(5, 0) is None
+
+    # The array was neither converted nor rebuilt
+    assert column.kind == "int" and column.values is values
+    store.set(5, 0, "5")
+    assert store.get(5, 0) == 5 and store.is_numeric_range(0, 0, 999, 0)
+
+
+def test_storage_is_lossless():
+    store = ColumnStore.from_rows([["1"], ["2"], ["3"]], 1)
+    store.set(0, 0, "1.5")
+    store.set(1, 0, "007")
+    assert store.columns[0].kind == "float"
+    assert [store.get(row, 0) for row in range(3)] == [1.5, "007", 3]
+    assert store.text(2, 0) == "3"
+
+    names = ColumnStore.from_rows([["a"], ["b"], ["3"]], 1)
+    assert names.columns[0].kind == "object"
+    assert names.text(2, 0) == "3"
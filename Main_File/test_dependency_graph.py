@@ -0,0 +1,45 @@
+"""DependencyGraph: dependents lookups, recalculation order and cycles."""
+from dependency_graph import DependencyGraph
+from formula_engine import compile_formula_at
+
+
+def sheet(**formulas):
+    # sheet(B1="=A1*2") -> graph with those formulas at their A1 positions
+    graph = DependencyGraph()
+    for name, text in formulas.items():
+        col = ord(name[0]) - ord("A")
+        row = int(name[1:]) - 1
+        graph.set_formula((row, col), compile_formula_at(text, row, col))
+    return graph
+
+
+def test_running_total_order():
+    graph = DependencyGraph()
+    for row in range(200):
+        graph.set_formula((row, 1), compile_formula_at("=SUM($A$1:A%d)" % (row + 1), row, 1))
+        graph.set_formula((row, 2), compile_formula_at("=SUM($B$1:B%d)" % (row + 1), row, 2))
+
+    assert sorted(graph.dependents(150, 0, 150, 0)) == [(row, 1) for row in range(150, 200)]
+    order, cyclic = graph.recalc_order([(0, 0, 0, 0)])
+    assert not cyclic
+    assert len(order) == 400
+    position = {cell: index for index, cell in enumerate(order)}
+    assert all(position[(row, 1)] < position[(row, 2)] for row in range(200))
+
+    graph.remove((199, 1))
+    assert (199, 1) not in graph.dependents(150, 0, 150, 0)
+
+
+def test_reader_of_a_cycle_is_circular_after_an_incremental_edit():
+    graph = sheet(G13="=MIN(B15:E36)", C31="=MAX(C18:E37)")
+    order, cyclic = graph.recalc_order([], list(graph.formulas))
+    assert not order and sorted(cyclic) == [(12, 6), (30, 2)]
+
+    # B34 is read by G13 only: G13 still reads the cycle in C31
+    order, cyclic = graph.recalc_order([(33, 1, 33, 1)])
+    assert not order and cyclic == [(12, 6)]
+
+    graph.set_formula((30, 2), compile_formula_at("=1", 30, 2))
+    order, cyclic = graph.recalc_order([(30, 2, 30, 2)], [(30, 2)])
+    assert order == [(30, 2), (12, 6)] and not cyclic
+    assert not graph.cyclic
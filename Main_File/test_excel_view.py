@@ -0,0 +1,110 @@
+"""ExcelStyleTableView: selection outline, autofill preview and repaints."""
+from PyQt6.QtCore import QEvent, QItemSelection, QItemSelectionModel, QPointF, Qt
+from PyQt6.QtGui import QMouseEvent
+from PyQt6.QtWidgets import QApplication
+
+from ExcelStyleTableView import ExcelStyleTableView
+
+app = QApplication.instance() or QApplication([])
+
+
+def sheet_view(rows=50, cols=10, virtual=False):
+    view = ExcelStyleTableView()
+    view.setModelWithHeaders(rows, cols, virtual=virtual)
+    view.resize(500, 400)
+    view.show()
+    return view
+
+
+def select(view, top, left, bottom, right):
+    model = view.model()
+    view.selectionModel().select(QItemSelection(model.index(top, left), model.index(bottom, right)),
+                                 QItemSelectionModel.SelectionFlag.ClearAndSelect)
+
+
+def test_selection_outline_is_mapped_once_per_scroll():
+    view = sheet_view()
+    select(view, 1, 1, 3, 2)
+    model = view.model()
+    rect = view._selection_geometry()
+    assert rect == view.visualRect(model.index(1, 1)).united(view.visualRect(model.index(3, 2))).adjusted(0, 0, -1, -1)
+    assert view._selection_geometry() is rect
+
+    view.verticalScrollBar().setValue(1)
+    assert view._selection_rect is None
+    assert view._selection_geometry().top() < rect.top()
+
+
+def test_whole_column_of_a_virtual_sheet_is_one_range():
+    view = sheet_view(virtual=True)
+    assert not view.horizontalHeader().highlightSections()
+    view.selectColumn(3)
+    assert view._selection_bounds == (0, 3, view.model().rowCount() - 1, 3)
+
+
+def release(view):
+    position = QPointF(5, 5)
+    view.mouseReleaseEvent(QMouseEvent(QEvent.Type.MouseButtonRelease, position, view.viewport().mapToGlobal(position),
+                                       Qt.MouseButton.LeftButton, Qt.MouseButton.NoButton,
+                                       Qt.KeyboardModifier.NoModifier))
+
+
+def drag_fill(view, start, end):
+    model = view.model()
+    view.autofill_dragging = True
+    view.autofill_start_index = model.index(*start)
+    view.autofill_end_index = model.index(*end)
+    view.autofill_direction = "vertical" if start[1] == end[1] else "horizontal"
+    release(view)
+
+
+def test_autofill_keeps_one_preview_rectangle_and_one_undo_step():
+    view = sheet_view()
+    model = view.model()
+    for row, texts in enumerate([("a", '=A1&"!"'), ("b", '=A2&"!"')]):
+        for col, text in enumerate(texts):
+            model.setData(model.index(row, col), text)
+    select(view, 0, 0, 1, 1)
+
+    drag_fill(view, (1, 1), (9, 1))
+    assert view.keep_preview_range == (2, 0, 9, 1)
+    assert [model.cell_text(row, 0) for row in range(2, 10)] == ["a", "b"] * 4
+    assert model.cell_text(9, 1) == '=A10&"!"'
+    model.flush_recalc()
+    assert model.display_text(9, 1) == "b!"
+    preview = view._preview_geometry()
+    assert preview.contains(view.visualRect(model.index(5, 1)).center())
+
+    model.undo()
+    assert all(model.cell_text(row, col) == "" for row in range(2, 10) for col in range(2))
+    assert model.cell_text(1, 1) == '=A2&"!"'
+
+
+def test_release_without_a_selection_leaves_fill_mode():
+    view = sheet_view()
+    view.selectionModel().clearSelection()
+    drag_fill(view, (1, 1), (9, 1))
+    assert not view.autofill_dragging and view.autofill_start_index is None
+    assert view.keep_preview_range is None
+
+
+def test_dash_animation_repaints_only_the_outline():
+    view = sheet_view(rows=2000)
+    view.keep_preview_range = (2, 1, 8, 2)
+    view._sync_dash_timer()
+    assert view.dash_timer.isActive()
+
+    rect = view._preview_geometry()
+    region = view._outline_region(rect, 2)
+    assert region.contains(rect.topLeft()) and region.contains(rect.bottomRight())
+    assert not region.contains(rect.center())
+
+    updates = []
+    viewport = view.viewport()
+    viewport.update = updates.append
+    view.update_dash_animation()
+    assert updates == [region]
+
+    # Scrolled off screen: the dashes stop marching
+    view.verticalScrollBar().setValue(view.verticalScrollBar().maximum())
+    assert not view.dash_timer.isActive()
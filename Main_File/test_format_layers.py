@@ -0,0 +1,28 @@
+"""FormatLayers: styled rectangles resolved per cell, later formats win."""
+from format_layers import FormatLayers
+from style_table import StyleTable, DEFAULT_STYLE
+
+
+def test_whole_column_then_cell_format():
+    styles = StyleTable()
+    layers = FormatLayers(styles)
+    layers.add(0, 2, 1048575, 2, h_align="center")
+    layers.add(5, 0, 5, 16383, wrap=True)
+
+    assert styles.get(layers.style_id_at(1000000, 2)).h_align == "center"
+    assert layers.style_id_at(1000000, 3) == 0
+    both = styles.get(layers.style_id_at(5, 2))
+    assert both.h_align == "center" and both.wrap
+
+    # A later format replaces the same attribute of an earlier one it covers
+    rect, removed = layers.add(0, 2, 1048575, 2, h_align="right")
+    assert [old.changes for old in removed] == [(("h_align", "center"),)]
+    assert styles.get(layers.style_id_at(7, 2)).h_align == "right"
+    assert len(layers) == 2
+
+    # Undo: put the old rectangle back in its place
+    layers.remove(rect)
+    for old in removed:
+        layers.restore(old)
+    assert styles.get(layers.style_id_at(7, 2)).h_align == "center"
+    assert styles.get(layers.style_id_at(7, 1)) == DEFAULT_STYLE
@@ -0,0 +1,87 @@
+"""Formula engine: tokenizer, parser precedence, functions and error values."""
+import pytest
+
+from formula_engine import (FormulaError, TextSource, compile_formula_at, format_value, shift_formula, tokenize,
+                            DIV0, NAME, NUM, VALUE)
+
+
+def evaluate(text, cells=None, row=5, col=5):
+    cells = cells or {}
+    source = TextSource(lambda r, c: cells.get((r, c), ""))
+    return compile_formula_at(text, row, col).evaluate(source)
+
+
+def test_tokenize():
+    assert tokenize('SUM($A$1:b2)&"x"') == [
+        ("name", "SUM"), ("op", "("), ("ref", "$A$1"), ("op", ":"), ("ref", "b2"), ("op", ")"),
+        ("op", "&"), ("string", "x"), ("end", None)]
+    with pytest.raises(FormulaError):
+        compile_formula_at("=1+", 0, 0)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("=1+2*3", 7),
+    ("=-2^2", 4),          # negation binds tighter than ^, like Excel
+    ("=2^3^2", 64),        # ^ is left associative
+    ("=10%", 0.1),
+    ('="a"<"B"', True),
+    ('=1<"a"', True),      # numbers sort before text
+    ('=1&"b"', "1b"),
+])
+def test_operators(text, expected):
+    assert evaluate(text) == expected
+
+
+def test_functions_over_ranges():
+    cells = {(0, 0): "3", (1, 0): "4", (2, 0): "x", (3, 0): DIV0}
+    assert evaluate("=SUM(A1:A3)", cells) == 7
+    assert evaluate("=AVERAGE(A1:A2)", cells) == 3.5
+    assert evaluate("=COUNT(A1:A3)", cells) == 2
+    assert evaluate("=MAX(A1:A3)*2", cells) == 8
+    assert evaluate("=MIN(B1:B9)", cells) == 0
+    # An error in a referenced cell passes through
+    assert evaluate("=SUM(A1:A4)", cells) == DIV0
+    assert evaluate("=A4+1", cells) == DIV0
+    assert evaluate("=A3+1", cells) == VALUE
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("=1/0", DIV0),
+    ("=AVERAGE(B1:B2)", DIV0),
+    ("=FOO(1)", NAME),
+    ("=10^400", NUM),
+    ("=10^400*1.5", NUM),
+    ("=SUM(10^400,0.5)", NUM),
+    ("=7^30000000", NUM),
+    ("=1e308*10", NUM),
+    ("=(-8)^0.5", NUM),
+])
+def test_errors(text, expected):
+    assert evaluate(text) == expected
+
+
+def test_format_value():
+    assert [format_value(value) for value in (None, True, 4.0, 0.1, 1e20, "x")] == ["", "TRUE", "4", "0.1", "1e+20", "x"]
+
+
+def test_filled_formulas_share_one_template():
+    first = compile_formula_at("=A1*$B$1+SUM(A$1:A1)", 0, 2)
+    filled = compile_formula_at("=A5000*$B$1+SUM(A$1:A5000)", 4999, 2)
+    assert filled.template is first.template
+    assert filled.references == ((4999, 0, 4999, 0), (0, 1, 0, 1), (0, 0, 4999, 0))
+    cells = {(4999, 0): "2", (0, 1): "3"}
+    assert evaluate("=A5000*$B$1", cells, 4999, 2) == 6
+    # A reference that looks like R1C1 text is still a different formula
+    assert compile_formula_at("=R1C1", 0, 0).template is not compile_formula_at("=A1", 0, 0).template
+
+
+@pytest.mark.parametrize("text, rows, cols, expected", [
+    ("=A1+B2", 2, 1, "=B3+C4"),
+    ("=$A$1+A$1+$A1", 3, 2, "=$A$1+C$1+$A4"),
+    ("=SUM(A1:B2)*2", 1, 0, "=SUM(A2:B3)*2"),
+    ("=A1+1", -1, 0, "=#REF!+1"),
+    ("=$A1+A1", 0, -1, "=$A1+#REF!"),
+    ('="A1"&A1', 1, 0, '="A1"&A2'),
+])
+def test_shift_formula(text, rows, cols, expected):
+    assert shift_formula(text, rows, cols) == expected
@@ -0,0 +1,56 @@
+"""KineticScroller: the timer only runs while the sheet is moving."""
+from PyQt6.QtCore import QElapsedTimer
+from PyQt6.QtWidgets import QApplication, QTableWidget
+
+from KineticScroller import KineticScroller, STOP_SPEED
+
+app = QApplication.instance() or QApplication([])
+
+
+def scroll_area(rows=500):
+    area = QTableWidget(rows, 5)
+    area.resize(300, 200)
+    area.show()
+    return area
+
+
+def run_until_stopped(scroller, limit_ms=3000):
+    clock = QElapsedTimer()
+    clock.start()
+    while scroller.is_moving() and clock.elapsed() < limit_ms:
+        QApplication.processEvents()
+
+
+def test_wheel_kick_scrolls_and_then_stops():
+    area = scroll_area()
+    scroller = KineticScroller(area)
+    assert not scroller.is_moving()
+
+    scroller.add_sample(1000, 0, -120)      # wheel down
+    assert scroller.is_moving() and scroller.velocity_y < 0
+    run_until_stopped(scroller)
+    assert not scroller.is_moving()
+    assert area.verticalScrollBar().value() > 0
+    assert abs(scroller.velocity_y) < STOP_SPEED
+
+
+def test_the_bottom_stops_the_scroll_and_reports_it():
+    area = scroll_area(rows=20)
+    scroller = KineticScroller(area)
+    reached = []
+    scroller.reached_bottom.connect(lambda: reached.append(True))
+    area.verticalScrollBar().setValue(area.verticalScrollBar().maximum())
+
+    scroller.add_sample(1000, 0, -1200)
+    run_until_stopped(scroller)
+    assert reached and scroller.velocity_y == 0.0
+
+
+def test_a_tiny_kick_doesnt_start_the_timer_and_stop_resets():
+    scroller = KineticScroller(scroll_area())
+    scroller.add_sample(1000, 0, -1)
+    assert not scroller.is_moving()
+    scroller.add_sample(5000, 0, -120)
+    assert scroller.is_moving()
+    scroller.stop()
+    assert not scroller.is_moving() and scroller.velocity_y == 0.0
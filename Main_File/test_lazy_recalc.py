@@ -0,0 +1,67 @@
+"""Lazy recalculation: a stale formula overwritten with plain text.
+
+Run with `python -m pytest Main_File` (no display needed, the model is Qt-core only).
+"""
+from PyQt6.QtCore import QCoreApplication
+
+from SparseTableModel import SparseTableModel, PendingRole
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+def lazy_sheet():
+    # B5001 reads A5001 and is stale: it is far outside the viewport
+    model = SparseTableModel(virtual=True)
+    model.lazy_recalc = True
+    model.set_viewport(0, 0, 20, 5)
+    model.setData(model.index(5000, 0), "1")
+    model.setData(model.index(5000, 1), "=A5001*2")
+    model.flush_recalc()
+    return model
+
+
+def test_stale_formula_overwritten_with_text():
+    model = lazy_sheet()
+    assert (5000, 1) in model._pending
+
+    model.setData(model.index(5000, 1), "plain")
+    model.flush_recalc()
+    assert model.display_text(5000, 1) == "plain"
+    assert not model.data(model.index(5000, 1), PendingRole)
+    assert (5000, 1) not in model._stale_rank
+
+    # A formula in the viewport reading it, and further edits, still work
+    model.setData(model.index(0, 2), '=B5001&"!"')
+    model.flush_recalc()
+    assert model.display_text(0, 2) == "plain!"
+    model.setData(model.index(5000, 0), "2")
+    model.flush_recalc()
+    assert model.display_text(0, 2) == "plain!"
+    assert not model._pending
+
+
+def test_only_the_viewport_is_computed_until_scrolled_or_read():
+    model = SparseTableModel(virtual=True)
+    model.lazy_recalc = True
+    model.set_viewport(0, 0, 20, 5)
+    model.setData(model.index(0, 0), "3")
+    model.setData(model.index(1, 0), "=A1+1")          # in view
+    model.setData(model.index(9000, 0), "=A1*10")      # far below
+    model.flush_recalc()
+    assert model.display_text(1, 0) == "4"
+    assert (9000, 0) in model._pending
+
+    # A formula in view reading the stale one computes it first
+    model.setData(model.index(2, 0), "=A9001+1")
+    model.flush_recalc()
+    assert model.display_text(2, 0) == "31"
+    assert not model._pending
+
+    model.setData(model.index(0, 0), "5")
+    model.flush_recalc()
+    assert model.display_text(2, 0) == "51"
+    model.setData(model.index(8000, 1), "=A1")
+    model.flush_recalc()
+    assert (8000, 1) in model._pending
+    model.set_viewport(7990, 0, 8010, 5)
+    assert model.display_text(8000, 1) == "5"
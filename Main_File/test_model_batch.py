@@ -0,0 +1,30 @@
+"""Batched model transactions: one dataChanged per outermost batch."""
+from PyQt6.QtCore import QCoreApplication, Qt
+
+from SparseTableModel import SparseTableModel
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+def test_nested_batches_emit_one_bounding_change():
+    model = SparseTableModel(1000, 10)
+    emitted = []
+    model.dataChanged.connect(lambda top_left, bottom_right, roles: emitted.append(
+        (top_left.row(), top_left.column(), bottom_right.row(), bottom_right.column())))
+
+    with model.batch():
+        for row in range(10, 500):
+            model.setData(model.index(row, 2), str(row))
+        with model.batch():
+            model.setData(model.index(3, 4), "x")
+        assert not emitted
+    assert emitted == [(3, 2, 499, 4)]
+    assert model.cell_text(499, 2) == "499"
+
+
+def test_changes_outside_a_batch_are_emitted_right_away():
+    model = SparseTableModel(10, 10)
+    roles = []
+    model.dataChanged.connect(lambda top_left, bottom_right, changed_roles: roles.append(changed_roles))
+    model.changed(0, 0, 50, 50, [Qt.ItemDataRole.DisplayRole])
+    assert roles == [[Qt.ItemDataRole.DisplayRole]]
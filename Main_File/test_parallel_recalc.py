@@ -0,0 +1,39 @@
+"""Parallel recalculation gives the same values as computing in order."""
+from PyQt6.QtCore import QCoreApplication
+
+import SparseTableModel as sparse_model
+from parallel_recalc import components
+from SparseTableModel import SparseTableModel
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+def chains(columns, rows):
+    # Independent columns: a number on top and a chain of formulas below it
+    model = SparseTableModel(rows + 1, columns + 1)
+    model.background_recalc = False
+    for col in range(columns):
+        model.set_cell_text(0, col, str(col + 1))
+        for row in range(1, rows):
+            model.set_cell_text(row, col, "=%s%d*2+1" % ("ABCDEFGH"[col], row))
+    model.set_cell_text(rows, 0, "=SUM(A1:A%d)" % rows)
+    model.set_cell_text(0, columns, "=B1/0")
+    return model
+
+
+def test_components_split_independent_columns():
+    model = chains(4, 10)
+    edges = {}
+    order, _cyclic = model.dependencies.recalc_order([], list(model.dependencies.formulas), edges)
+    # Column A with its SUM, B to D, and the lone =B1/0
+    assert sorted(len(group) for group in components(order, edges)) == [1, 9, 9, 9, 10]
+
+
+def test_worker_processes_match_a_serial_recalculation(monkeypatch):
+    monkeypatch.setattr(sparse_model, "PARALLEL_MIN_FORMULAS", 10)
+    serial, parallel = chains(4, 12), chains(4, 12)
+    assert serial.recalculate_all(jobs=1) == parallel.recalculate_all(jobs=2)
+    cells = [(row, col) for row in range(13) for col in range(5)]
+    assert [parallel.display_text(*cell) for cell in cells] == [serial.display_text(*cell) for cell in cells]
+    assert parallel.display_text(12, 0) == serial.display_text(12, 0) != ""
+    assert parallel.display_text(0, 4) == "#DIV/0!"
@@ -0,0 +1,63 @@
+"""Vectorized range aggregates agree with a plain scan of the cells."""
+import random
+
+import pytest
+
+from cell_store import ChunkedCellStore
+from formula_engine import TextSource, CellError, DIV0, RangeMemo, range_stats
+from range_aggregates import SheetSource
+from shared_strings import SharedStringTable
+
+
+def sheet(texts):
+    cells, strings = ChunkedCellStore(), SharedStringTable()
+    for (row, col), text in texts.items():
+        cells.set(row, col, strings.add(text))
+    return cells, strings, SheetSource(cells, strings, ChunkedCellStore(), {})
+
+
+def test_matches_a_plain_scan_and_follows_edits():
+    rng = random.Random(7)
+    texts = {(row, col): rng.choice(["1", "2.5", "-3", "x"])
+             for row in range(0, 1000, 3) for col in range(3)}
+    cells, strings, source = sheet(texts)
+    plain = TextSource(lambda row, col: texts.get((row, col), ""))
+    for rect in [(0, 0, 999, 2), (5, 1, 800, 1), (130, 0, 140, 2), (64, 2, 191, 2)]:
+        assert source.range_stats(*rect) == plain.range_stats(*rect)
+
+    # One edit: only its block is read again
+    reads = source.block_reads
+    texts[(500, 1)] = "100"
+    cells.set(500, 1, strings.add("100"))
+    assert source.range_stats(0, 1, 999, 1) == plain.range_stats(0, 1, 999, 1)
+    assert source.block_reads == reads + 1
+
+
+def test_errors_in_the_range_are_raised():
+    _cells, _strings, source = sheet({(0, 0): "1", (300, 0): DIV0})
+    with pytest.raises(CellError) as error:
+        source.range_stats(0, 0, 999, 0)
+    assert error.value.code == DIV0
+    assert source.range_stats(0, 0, 299, 0)[:2] == (1, 1)
+
+
+def test_range_results_are_memoized_per_version():
+    cells, strings, source = sheet({(row, 0): str(row) for row in range(200)})
+    memo = source.memo
+    assert range_stats(source, (0, 0, 199, 0))[0] == sum(range(200))
+    assert range_stats(source, (0, 0, 199, 0))[0] == sum(range(200))
+    assert (memo.hits, memo.misses) == (1, 1)
+
+    cells.set(10, 0, strings.add("1000"))
+    assert range_stats(source, (0, 0, 199, 0))[0] == sum(range(200)) + 990
+    assert memo.misses == 2 and len(memo) == 1
+
+
+def test_memo_drops_the_least_recently_used_first():
+    _cells, _strings, source = sheet({(row, 0): "1" for row in range(100)})
+    memo = source.memo = RangeMemo(max_bytes=1)
+    range_stats(source, (0, 0, 9, 0))
+    range_stats(source, (0, 0, 19, 0))
+    assert len(memo) == 1 and memo.evictions == 1
+    range_stats(source, (0, 0, 19, 0))
+    assert memo.hits == 1
@@ -0,0 +1,35 @@
+"""recalc_cli: formulas of an xlsx file replaced by their values."""
+import openpyxl
+
+from recalc_cli import main
+
+
+def test_values_replace_supported_formulas(tmp_path):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = "Data"
+    sheet.append([1, 2, "=A1+B1", "=SUM(A1:C1)"])
+    sheet.append(["5", True, "=A2+1", "=SUM(A2:B2)", "=1/0"])
+    sheet.append(["=C3", "=Other!A1", "=B3&\"x\"", None])
+    book.create_sheet("Other")["A1"] = 10
+    path = tmp_path / "book.xlsx"
+    book.save(path)
+
+    assert main([str(path), "-o", str(tmp_path / "out")]) == 0
+    result = openpyxl.load_workbook(tmp_path / "out" / "book_values.xlsx")["Data"]
+    assert [cell.value for cell in result[1]] == [1, 2, 3, 6, None]
+    # "5" stays text: + converts it, SUM skips it (and the boolean), like Excel
+    assert result["A2"].value == "5" and result["A2"].data_type == "s"
+    assert result["B2"].value is True
+    assert result["C2"].value == 6
+    assert result["D2"].value == 0
+    assert result["E2"].value == "#DIV/0!" and result["E2"].data_type == "e"
+    # Other sheets aren't supported: that formula and the ones reading it stay formulas
+    assert result["B3"].value == "=Other!A1"
+    assert result["C3"].value == '=B3&"x"'
+    assert result["A3"].value == "=C3"
+
+
+def test_missing_file_fails(tmp_path, capsys):
+    assert main([str(tmp_path / "missing.xlsx")]) == 1
+    assert "failed" in capsys.readouterr().out
@@ -0,0 +1,43 @@
+"""Background recalculation: pending cells, results and cancellation."""
+from PyQt6.QtCore import QCoreApplication
+
+import SparseTableModel as sparse_model
+from SparseTableModel import SparseTableModel, PendingRole, PENDING_TEXT
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+def running_total(monkeypatch, rows=300):
+    monkeypatch.setattr(sparse_model, "BACKGROUND_MIN_FORMULAS", 50)
+    model = SparseTableModel(rows, 5)
+    for row in range(rows):
+        model.set_cell_text(row, 0, "1")
+        model.set_cell_text(row, 1, "=SUM($A$1:A%d)" % (row + 1))
+    model.changed(0, 0, rows - 1, 1)
+    return model
+
+
+def test_results_arrive_from_the_thread(monkeypatch):
+    model = running_total(monkeypatch)
+    model.flush_recalc()
+    assert model._recalc_thread is not None
+    last = model.index(299, 1)
+    if model.data(last, PendingRole):
+        assert model.data(last) == PENDING_TEXT
+
+    model.wait_recalc()
+    assert not model.is_recalculating()
+    assert model.display_text(299, 1) == "300"
+
+
+def test_an_edit_it_reads_restarts_the_run(monkeypatch):
+    model = running_total(monkeypatch)
+    model.flush_recalc()
+    first = model._recalc_thread
+    model.setData(model.index(0, 0), "101")
+    model.flush_recalc()
+    assert model._recalc_thread is not first
+    model.wait_recalc()
+    first.wait()
+    assert model.display_text(299, 1) == "400"
+    assert model.display_text(0, 1) == "101"
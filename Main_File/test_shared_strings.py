@@ -0,0 +1,35 @@
+"""SharedStringTable: one copy per distinct text, reference counted."""
+from shared_strings import SharedStringTable
+
+
+def test_repeated_text_is_stored_once():
+    table = SharedStringTable()
+    first = table.add("Open")
+    assert table.add("Open") == first
+    other = table.add("Closed")
+    assert len(table) == 2 and table.refcount(first) == 2 and table.get(other) == "Closed"
+
+    table.release(first)
+    assert table.get(first) == "Open"
+    table.release(first)
+    assert len(table) == 1
+    # The freed id is reused
+    assert table.add("Pending") == first
+
+
+def test_numbers_are_parsed_once_per_id():
+    table = SharedStringTable()
+    assert table.number(table.add("42")) == 42
+    assert table.number(table.add("1.5")) == 1.5
+    assert table.number(table.add("abc")) is None
+
+
+def test_snapshot_keeps_released_strings_and_compact_renumbers():
+    table = SharedStringTable()
+    keep, drop = table.add("a"), table.add("b")
+    strings = table.snapshot()
+    table.release(keep)
+    assert strings[keep] == "a"
+
+    remap = table.compact()
+    assert remap == {drop: 0} and table.get(0) == "b"
@@ -0,0 +1,39 @@
+"""Copy-on-write snapshots: later edits don't show in an earlier snapshot."""
+import pickle
+
+from PyQt6.QtCore import QCoreApplication
+
+from cell_store import ChunkedCellStore
+from SparseTableModel import SparseTableModel
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+def test_store_snapshot_shares_blocks_until_written():
+    store = ChunkedCellStore()
+    store.set(0, 0, "a")
+    store.set(100, 100, "b")
+    snapshot = store.snapshot()
+    store.set(0, 0, "changed")
+    store.set(200, 0, "new")
+
+    assert snapshot.get(0, 0) == "a" and snapshot.get(200, 0) is None
+    assert store.get(0, 0) == "changed"
+    # The block nobody wrote is still the same object
+    assert snapshot.chunk(1, 1) is store.chunk(1, 1)
+
+
+def test_model_snapshot_is_consistent_and_picklable():
+    model = SparseTableModel(10, 10)
+    model.setData(model.index(0, 0), "2")
+    model.setData(model.index(0, 1), "=A1*3")
+    snapshot = model.snapshot()
+    model.setData(model.index(0, 0), "5")
+    model.setData(model.index(1, 0), "gone")
+    model.flush_recalc()
+
+    assert snapshot.text(0, 1) == "=A1*3"
+    assert snapshot.display_text(0, 1) == "6"
+    assert model.display_text(0, 1) == "15"
+    assert list(snapshot.iter_rows()) == [["2", "=A1*3"]]
+    assert pickle.loads(pickle.dumps(snapshot)).display_text(0, 1) == "6"
@@ -0,0 +1,99 @@
+"""SparseTableModel: sheet size, growth and cell storage."""
+from PyQt6.QtCore import QCoreApplication, QElapsedTimer, Qt
+
+from SparseTableModel import SparseTableModel, MAX_ROWS, MAX_COLUMNS, GROW_BLOCK_ROWS, GROW_BLOCK_COLUMNS
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+def test_virtual_sheet_has_excel_size():
+    model = SparseTableModel(30, 30, virtual=True)
+    assert (model.rowCount(), model.columnCount()) == (MAX_ROWS, MAX_COLUMNS)
+    assert model.headerData(MAX_COLUMNS - 1, Qt.Orientation.Horizontal) == "XFD"
+    assert model.headerData(MAX_ROWS - 1, Qt.Orientation.Vertical) == str(MAX_ROWS)
+
+    model.setData(model.index(MAX_ROWS - 1, MAX_COLUMNS - 1), "corner")
+    assert model.data(model.index(MAX_ROWS - 1, MAX_COLUMNS - 1)) == "corner"
+    assert model.cells.chunk_count() == 1
+    # Nothing to append to a full sheet
+    assert not model.insertRows(MAX_ROWS, 1)
+
+
+def test_grow_adds_whole_blocks_in_one_insert():
+    model = SparseTableModel(10, 5)
+    inserts = []
+    model.rowsInserted.connect(lambda parent, first, last: inserts.append(("rows", first, last)))
+    model.columnsInserted.connect(lambda parent, first, last: inserts.append(("columns", first, last)))
+
+    assert model.grow(rows=1, cols=1) == (GROW_BLOCK_ROWS, GROW_BLOCK_COLUMNS)
+    assert (model.rowCount(), model.columnCount()) == (10 + GROW_BLOCK_ROWS, 5 + GROW_BLOCK_COLUMNS)
+    assert inserts == [("rows", 10, 9 + GROW_BLOCK_ROWS), ("columns", 5, 4 + GROW_BLOCK_COLUMNS)]
+
+    # Big sheets grow by a quarter of their size, never past the limit
+    model = SparseTableModel(MAX_ROWS - 100, 10)
+    assert model.grow(rows=1) == (100, 0)
+    assert model.grow(rows=1) == (0, 0)
+
+
+def test_cycle_and_its_readers_stay_circular_after_an_incremental_edit():
+    model = SparseTableModel(50, 10)
+    model.setData(model.index(30, 1), "=1/0")            # B31
+    model.setData(model.index(12, 6), "=MIN(B15:E36)")   # G13
+    model.setData(model.index(30, 2), "=MAX(C18:E37)")   # C31 reads itself
+    model.setData(model.index(0, 0), "1")
+    model.setData(model.index(0, 7), "=A1+1")
+    model.flush_recalc()
+    assert model.display_text(30, 2) == "#CIRCULAR!"
+    assert model.display_text(12, 6) == "#CIRCULAR!"
+
+    model.setData(model.index(33, 1), "1")               # B34, read by G13 only
+    model.setData(model.index(0, 0), "5")
+    model.flush_recalc()
+    assert model.display_text(12, 6) == "#CIRCULAR!"
+    assert model.display_text(0, 7) == "6"
+
+    # Breaking the cycle brings both back
+    model.setData(model.index(30, 2), "7")
+    model.flush_recalc()
+    assert model.display_text(12, 6) == "#DIV/0!"
+
+
+def test_formula_and_value_are_kept_apart():
+    model = SparseTableModel(10, 10)
+    changes = []
+    model.dataChanged.connect(lambda top_left, bottom_right, roles: changes.append(roles))
+    model.setData(model.index(0, 0), "4")
+    model.setData(model.index(1, 0), "=A1*2")
+    model.flush_recalc()
+
+    index = model.index(1, 0)
+    assert model.data(index, Qt.ItemDataRole.EditRole) == "=A1*2"
+    assert model.data(index) == "8"
+    # The computed value goes out as DisplayRole only, so it isn't taken for an edit
+    assert [Qt.ItemDataRole.EditRole in roles for roles in changes] == [True, True, False]
+
+    model.setData(index, "plain")
+    model.flush_recalc()
+    assert model.data(index) == "plain" and (1, 0) not in model.dependencies
+
+
+def test_a_burst_of_edits_is_recalculated_once():
+    model = SparseTableModel(100, 5)
+    model.setData(model.index(0, 0), "1")
+    for row in range(1, 100):
+        model.setData(model.index(row, 1), "=$A$1+%d" % row)
+    model.flush_recalc()
+    runs = []
+    recalculate_rects = model.recalculate_rects
+    model.recalculate_rects = lambda rects: runs.append(len(rects)) or recalculate_rects(rects)
+
+    for value in range(2, 12):
+        model.setData(model.index(0, 0), str(value))
+    model.setData(model.index(50, 0), "x")
+    assert not runs and model.display_text(99, 1) == "100"
+    deadline = QElapsedTimer()
+    deadline.start()
+    while not runs and deadline.elapsed() < 1000:
+        QCoreApplication.processEvents()
+    assert runs == [2]
+    assert model.display_text(99, 1) == "110"
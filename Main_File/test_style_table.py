@@ -0,0 +1,13 @@
+"""StyleTable: each distinct style is stored once."""
+from style_table import StyleTable, DEFAULT_STYLE
+
+
+def test_equal_styles_share_an_id():
+    table = StyleTable()
+    assert table.intern(DEFAULT_STYLE) == 0
+    centered = DEFAULT_STYLE._replace(h_align="center")
+    style_id = table.intern(centered)
+    assert style_id == 1
+    assert table.intern(DEFAULT_STYLE._replace(h_align="center")) == style_id
+    assert table.get(style_id) == centered
+    assert len(table) == 2
@@ -0,0 +1,53 @@
+"""Undo/redo with run-length encoded range diffs."""
+from PyQt6.QtCore import QCoreApplication
+
+from SparseTableModel import SparseTableModel
+from undo_stack import encode_runs, iter_runs
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+def test_runs_round_trip():
+    items = [(0, 1, "x"), (0, 2, "x"), (1, 0, "x"), (2, 2, "y")]
+    runs = encode_runs(0, 0, 2, 2, items)
+    assert runs == [[None, 1], ["x", 3], [None, 4], ["y", 1]]
+    assert list(iter_runs(0, 0, 2, 2, runs)) == items
+
+
+def test_undo_restores_an_autofilled_range():
+    model = SparseTableModel(100000, 3)
+    model.setData(model.index(5, 0), "keep")
+    with model.undo_range("Autofill", 0, 0, 99999, 0):
+        for row in range(1, 100000):
+            model.set_cell_text(row, 0, "fill")
+        model.changed(1, 0, 99999, 0)
+    command = model.undo_stack._undo[-1]
+    # Before: 5 empty cells, "keep", the rest empty; after: one long run
+    assert len(command.before) == 3 and len(command.after) == 2
+
+    model.undo()
+    assert model.cell_text(5, 0) == "keep"
+    assert model.cell_text(6, 0) == "" and model.cell_text(99999, 0) == ""
+    model.redo()
+    assert model.cell_text(5, 0) == "fill" and model.cell_text(99999, 0) == "fill"
+
+
+def test_undo_restores_formulas_and_formats():
+    model = SparseTableModel(10, 10)
+    model.setData(model.index(0, 0), "1")
+    with model.undo_range("Autofill", 0, 1, 1, 1):
+        model.set_cell_text(0, 1, "=A1+1")
+        model.set_cell_text(1, 1, "=A2+1")
+        model.changed(0, 1, 1, 1)
+    model.flush_recalc()
+    model.setData(model.index(0, 1), "text")
+    model.flush_recalc()
+    model.apply_style(0, 0, 9, 0, wrap=True)
+
+    model.undo()
+    assert not model.style_at(3, 0).wrap
+    model.undo()
+    model.flush_recalc()
+    assert model.cell_text(0, 1) == "=A1+1"
+    assert model.display_text(0, 1) == "2"
+    assert model.undo_stack.can_redo()
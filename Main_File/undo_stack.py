@@ -0,0 +1,182 @@
+"""Undo/redo stack that records edits as compact range diffs.
+
+A command covers a rectangle and keeps the cell text before and after the
+edit, run-length encoded in row-major order. An autofill of 100k empty
+cells with one value is then two runs, and undoing it is one bulk restore.
+Formatting commands just remember the format rectangle they added and the
+ones it replaced.
+"""
+import time
+
+
+COALESCE_SECONDS = 1.0            # repeated edits of the same range within this merge
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+RUN_OVERHEAD = 64                 # rough size of one run, used for the memory budget
+
+
+def encode_runs(top, left, bottom, right, items):
+    """Run-length encode a rectangle from its sparse (row, col, value) items.
+
+    Returns [[value, count], ...] covering every cell row by row; empty
+    cells are runs of None, so untouched areas cost nothing.
+    """
+    width = right - left + 1
+    total = width * (bottom - top + 1)
+    runs = []
+    position = 0
+    for row, col, value in sorted(items, key=lambda item: (item[0], item[1])):
+        offset = (row - top) * width + (col - left)
+        if offset > position:
+            runs.append([None, offset - position])
+        if runs and runs[-1][0] == value:
+            runs[-1][1] += 1
+        else:
+            runs.append([value, 1])
+        position = offset + 1
+    if position < total:
+        runs.append([None, total - position])
+    return runs
+
+
+def iter_runs(top, left, bottom, right, runs):
+    """Yield (row, col, value) for the non-empty cells of encoded runs."""
+    width = right - left + 1
+    position = 0
+    for value, count in runs:
+        if value is not None:
+            for offset in range(position, position + count):
+                yield top + offset // width, left + offset % width, value
+        position += count
+
+
+def runs_size(runs):
+    return sum(RUN_OVERHEAD + (len(value) if isinstance(value, str) else 0) for value, _count in runs)
+
+
+class CellRangeCommand:
+    def __init__(self, label, rect, before, after):
+        self.label = label
+        self.rect = rect          # (top, left, bottom, right)
+        self.before = before      # runs
+        self.after = after        # runs
+        self.time = time.monotonic()
+
+    def undo(self, model):
+        model.restore_runs(self.rect, self.before)
+
+    def redo(self, model):
+        model.restore_runs(self.rect, self.after)
+
+    def nbytes(self):
+        return runs_size(self.before) + runs_size(self.after)
+
+    def merge(self, other):
+        """Absorb a newer edit of the same range (e.g. retyping a cell)."""
+        if (not isinstance(other, CellRangeCommand) or other.rect != self.rect
+                or other.label != self.label or other.time - self.time > COALESCE_SECONDS):
+            return False
+        self.after = other.after
+        self.time = other.time
+        return True
+
+
+class FormatCommand:
+    def __init__(self, label, added, removed):
+        self.label = label
+        self.added = added        # FormatRect added by the edit
+        self.removed = removed    # FormatRects it made redundant
+
+    def undo(self, model):
+        model.formats.remove(self.added)
+        for rect in self.removed:
+            model.formats.restore(rect)
+        model.format_rects_changed([self.added] + self.removed)
+
+    def redo(self, model):
+        for rect in self.removed:
+            model.formats.remove(rect)
+        model.formats.restore(self.added)
+        model.format_rects_changed([self.added] + self.removed)
+
+    def nbytes(self):
+        return RUN_OVERHEAD * (1 + len(self.removed))
+
+    def merge(self, other):
+        return False
+
+
+class MergeCommand:
+    def __init__(self, label, span, cells):
+        self.label = label
+        self.span = span          # (top_row, left_col, row_span, col_span)
+        self.cells = cells        # CellRangeCommand for the cleared cells
+
+    def undo(self, model):
+        self.cells.undo(model)
+        model.merged_cells.remove(self.span)
+        model.layoutChanged.emit()
+
+    def redo(self, model):
+        self.cells.redo(model)
+        model.merged_cells.append(self.span)
+        model.layoutChanged.emit()
+
+    def nbytes(self):
+        return self.cells.nbytes()
+
+    def merge(self, other):
+        return False
+
+
+class UndoStack:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._undo = []
+        self._redo = []
+        self._bytes = 0
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def nbytes(self):
+        return self._bytes
+
+    def clear(self):
+        self._undo = []
+        self._redo = []
+        self._bytes = 0
+
+    def push(self, command):
+        """Record an edit that has already been applied."""
+        self._bytes -= sum(item.nbytes() for item in self._redo)
+        self._redo = []
+        if self._undo:
+            top = self._undo[-1]
+            before = top.nbytes()
+            if top.merge(command):
+                self._bytes += top.nbytes() - before
+                return
+        self._undo.append(command)
+        self._bytes += command.nbytes()
+        # Oldest history goes first once the budget is exceeded, the last edit always stays
+        while self._bytes > self.max_bytes and len(self._undo) > 1:
+            self._bytes -= self._undo.pop(0).nbytes()
+
+    def undo(self, model):
+        if not self._undo:
+            return None
+        command = self._undo.pop()
+        command.undo(model)
+        self._redo.append(command)
+        return command
+
+    def redo(self, model):
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        command.redo(model)
+        self._undo.append(command)
+        return command